@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for Project Bundler
+
+Generates synthetic projects and times each phase headlessly:
+scan, bundle, parse (legacy and streaming), restore into an empty
+folder and restore over identical files. Results are written as JSON
+and can be compared against a stored baseline to flag regressions.
+
+    python benchmarks/bench_bundler.py --output results.json
+    python benchmarks/bench_bundler.py --compare results.json
+"""
+
+from pathlib import Path
+from contextlib import ExitStack
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, NamedTuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from project_bundler import ArchiveManager, DeltaManager, ProjectManager  # noqa: E402
+
+
+class Scenario(NamedTuple):
+    """Shape of one synthetic project"""
+    files: int
+    size: int          # approximate bytes per file
+    depth: int         # folder nesting
+    markers: bool      # sprinkle "=== x ===" lines through the content
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    "tiny_files": Scenario(files=5000, size=200, depth=2, markers=False),
+    "huge_files": Scenario(files=4, size=16 * 1024 * 1024, depth=1, markers=False),
+    "deep_tree": Scenario(files=2000, size=2000, depth=40, markers=False),
+    "marker_lines": Scenario(files=500, size=8000, depth=3, markers=True),
+}
+
+WORDS = ("def", "return", "self", "value", "items", "result", "for", "in", "if",
+         "None", "path", "name", "data", "import", "class", "yield", "lambda")
+
+
+def make_content(rng: random.Random, size: int, markers: bool) -> str:
+    """Python-looking text of roughly size bytes"""
+    lines: List[str] = []
+    total = 0
+    while total < size:
+        if markers and rng.random() < 0.05:
+            line = rng.choice(("=== section ===", "# === not a header ===", "=== END ==="))
+        else:
+            indent = "    " * rng.randint(0, 3)
+            line = indent + " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines) + "\n"
+
+
+def generate_project(root: Path, scenario: Scenario, scale: float, seed: int = 1234) -> int:
+    """Write a synthetic project under root, returns its size in bytes"""
+    rng = random.Random(seed)
+    files = max(1, int(scenario.files * scale))
+    size = max(16, int(scenario.size * (scale if scenario.files * scale < 1 else 1)))
+    total = 0
+    for i in range(files):
+        depth = rng.randint(1, scenario.depth) if scenario.depth > 1 else 1
+        parts = [f"pkg{rng.randint(0, 9)}" for _ in range(depth - 1)]
+        folder = root.joinpath(*parts)
+        folder.mkdir(parents=True, exist_ok=True)
+        data = make_content(rng, size, scenario.markers).encode("utf-8")
+        (folder / f"module_{i}.py").write_bytes(data)
+        total += len(data)
+    return total
+
+
+def measure(func: Callable[[], object], repeat: int, nbytes: int, nfiles: int,
+            setup: Callable[[], None] = None) -> dict:
+    """Best-of-repeat wall time plus one tracemalloc pass for peak memory"""
+    best = float("inf")
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "seconds": round(best, 6),
+        "mb_per_s": round(nbytes / best / 1e6, 2) if best else None,
+        "files_per_s": round(nfiles / best, 1) if best else None,
+        "peak_mb": round(peak / 1e6, 2),
+    }
+
+
+def differs(path: Path, other: Path) -> bool:
+    try:
+        return path.read_bytes() != other.read_bytes()
+    except OSError:
+        return True
+
+
+def delta_roundtrip(manager: ProjectManager, baseline: Path, delta: Path, target: Path) -> int:
+    """Files that don't come back after restoring a delta that only indents one file"""
+    first = min(manager.get_py_files())
+    original = first.read_bytes()
+    first.write_bytes(b"    " + original)
+    try:
+        DeltaManager.write_bundle(delta, manager, baseline)
+        shutil.rmtree(target, ignore_errors=True)
+        with ExitStack() as stack:
+            names, data = ArchiveManager.open_members(delta, stack)
+            ProjectManager(target).restore_members(data, names)
+        return sum(differs(path, target / manager.relative_name(path))
+                   for path in manager.get_py_files())
+    finally:
+        first.write_bytes(original)
+
+
+def run_scenario(name: str, scenario: Scenario, workdir: Path, scale: float,
+                 repeat: int) -> dict:
+    """Generate one project and time every phase on it"""
+    project = workdir / name
+    target = workdir / f"{name}_restore"
+    archive = workdir / f"{name}.txt"
+    delta = workdir / f"{name}_delta.txt"
+    # A reused --workdir must not leave files from an earlier run in the project
+    shutil.rmtree(project, ignore_errors=True)
+    shutil.rmtree(target, ignore_errors=True)
+    for path in (archive, delta, DeltaManager.manifest_path(delta)):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+    nbytes = generate_project(project, scenario, scale)
+
+    manager = ProjectManager(project)
+    files = manager.get_py_files()
+    members = {manager.relative_name(path): path for path in files}
+    nfiles = len(files)
+    results = {"files": nfiles, "bytes": nbytes}
+
+    results["scan"] = measure(manager.get_py_files, repeat, nbytes, nfiles)
+    results["bundle"] = measure(
+        lambda: ArchiveManager.write_archive(archive, name, members, index=True),
+        repeat, nbytes, nfiles)
+
+    def parse_legacy():
+        text = archive.read_text(encoding="utf-8").replace("\r\n", "\n")
+        return ArchiveManager.parse_archive(text)
+
+    def parse_stream():
+        with ExitStack() as stack:
+            names, data = ArchiveManager.open_members(archive, stack)
+            for member in names:
+                data[member]
+
+    results["parse_legacy"] = measure(parse_legacy, repeat, nbytes, nfiles)
+    results["parse_stream"] = measure(parse_stream, repeat, nbytes, nfiles)
+
+    def restore():
+        with ExitStack() as stack:
+            names, data = ArchiveManager.open_members(archive, stack)
+            return ProjectManager(target).restore_members(data, names)
+
+    def clear_target():
+        shutil.rmtree(target, ignore_errors=True)
+        target.mkdir()
+
+    results["restore_new"] = measure(restore, repeat, nbytes, nfiles, setup=clear_target)
+    results["restore_unchanged"] = measure(restore, repeat, nbytes, nfiles)
+
+    # Files that did not come back byte-identical after a full round trip
+    stats = restore()
+    results["roundtrip_errors"] = stats.errors + stats.restored + stats.created_new
+    # A delta must carry changes that only touch whitespace at either end of a file
+    results["roundtrip_errors"] += delta_roundtrip(manager, archive, delta, target)
+    return results
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> List[str]:
+    """Phases that got slower than baseline by more than threshold"""
+    regressions = []
+    for name, phases in current["results"].items():
+        old_phases = baseline.get("results", {}).get(name, {})
+        for phase, metrics in phases.items():
+            old = old_phases.get(phase)
+            if not isinstance(metrics, dict) or not isinstance(old, dict):
+                continue
+            if old["seconds"] and metrics["seconds"] > old["seconds"] * (1 + threshold):
+                change = metrics["seconds"] / old["seconds"] - 1
+                regressions.append(f"{name}.{phase}: {old['seconds']:.4f}s -> "
+                                   f"{metrics['seconds']:.4f}s (+{change:.0%})")
+    return regressions
+
+
+def print_table(report: dict):
+    print(f"{'scenario':<14} {'phase':<18} {'seconds':>9} {'MB/s':>9} "
+          f"{'files/s':>10} {'peak MB':>8}")
+    for name, phases in report["results"].items():
+        for phase, metrics in phases.items():
+            if isinstance(metrics, dict):
+                print(f"{name:<14} {phase:<18} {metrics['seconds']:>9.4f} "
+                      f"{metrics['mb_per_s'] or 0:>9.1f} {metrics['files_per_s'] or 0:>10.0f} "
+                      f"{metrics['peak_mb']:>8.1f}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable, default: all)")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiply file counts by this factor (default 1.0)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timed runs per phase, best is kept (default 3)")
+    parser.add_argument("-o", "--output", type=Path, help="write JSON results here")
+    parser.add_argument("--compare", type=Path, metavar="BASELINE",
+                        help="flag phases slower than this earlier JSON result")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="allowed slowdown before flagging (default 0.15)")
+    parser.add_argument("--workdir", type=Path, help="keep generated projects here")
+    args = parser.parse_args(argv)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "scale": args.scale,
+            "repeat": args.repeat,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": {},
+    }
+
+    with ExitStack() as stack:
+        if args.workdir:
+            workdir = args.workdir
+            workdir.mkdir(parents=True, exist_ok=True)
+        else:
+            workdir = Path(stack.enter_context(tempfile.TemporaryDirectory(prefix="bundler_bench_")))
+        for name in args.scenario or sorted(SCENARIOS):
+            print(f"Running {name}...", file=sys.stderr)
+            report["results"][name] = run_scenario(name, SCENARIOS[name], workdir,
+                                                   args.scale, max(1, args.repeat))
+
+    print_table(report)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    broken = [f"{name}: {phases['roundtrip_errors']} files"
+              for name, phases in report["results"].items() if phases["roundtrip_errors"]]
+    if broken:
+        print("\nRound trip errors:")
+        for line in broken:
+            print(f"  {line}")
+        return 1
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nNo regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
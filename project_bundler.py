@@ -4,95 +4,3774 @@
 # Backup and restore Python project files via text archives
 # =============================================================================
 
-import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
-from pathlib import Path
+from pathlib import Path, PurePosixPath
+from functools import partial
+from collections import deque
+from contextlib import ExitStack, contextmanager
+import argparse
+import bz2
 import datetime
+import difflib
+import fnmatch
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import lzma
+import mmap
+import os
+import queue
 import re
-from typing import Dict, List, Tuple, Optional
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from collections.abc import Mapping
+from typing import (BinaryIO, Callable, Dict, Iterable, Iterator, List, NamedTuple,
+                    Sequence, Set, Tuple, Optional, Union)
+
+# tkinter (and concurrent.futures) are imported on first use, so the
+# command-line mode starts fast and never loads the GUI toolkit
+tk = filedialog = messagebox = ttk = None
+
+
+def _load_tk():
+    """Import tkinter into the module globals used by the GUI classes"""
+    global tk, filedialog, messagebox, ttk
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, ttk
+
+
+class RestoreStats(NamedTuple):
+    """Counts from writing restored files"""
+    restored: int
+    created_new: int
+    unchanged: int
+    errors: int
+    cancelled: bool = False
+    corrupt: Tuple[str, ...] = ()    # members not written because they failed their check
+    stages: Tuple["StageStats", ...] = ()   # throughput of the restore pipeline's stages
+    missing: Tuple[str, ...] = ()    # stored members whose object is gone from the store
+
+
+class OperationCancelled(Exception):
+    """A long-running operation was cancelled between files"""
+
+
+class Progress(NamedTuple):
+    """Snapshot of a long-running operation"""
+    files_done: int
+    files_total: int
+    bytes_done: int
+    elapsed: float
+
+    @property
+    def throughput(self) -> float:
+        """Bytes per second so far"""
+        return self.bytes_done / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class ProgressTracker:
+    """Counts files and bytes of an operation, reporting and checking for cancel
+
+    The callback is throttled to REPORT_INTERVAL, and is always called for
+    the last file. Cancellation is cooperative: callers check between files.
+    """
+
+    REPORT_INTERVAL = 0.1
+
+    def __init__(self, files_total: int = 0,
+                 callback: Optional[Callable[[Progress], None]] = None,
+                 cancel_event: Optional[threading.Event] = None):
+        self.files_total = files_total
+        self.callback = callback
+        self.cancel_event = cancel_event
+        self.reset()
+
+    def reset(self):
+        """Start counting from zero again"""
+        self.files_done = 0
+        self.bytes_done = 0
+        self.started = time.perf_counter()
+        self._last_report = 0.0
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def check_cancel(self):
+        """Raise OperationCancelled if cancellation was requested"""
+        if self.cancelled:
+            raise OperationCancelled()
+
+    def snapshot(self) -> Progress:
+        return Progress(self.files_done, self.files_total, self.bytes_done,
+                        time.perf_counter() - self.started)
+
+    def advance(self, nbytes: int, files: int = 1):
+        """Record finished files and report if it's time to"""
+        self.files_done += files
+        self.bytes_done += nbytes
+        if self.callback is None:
+            return
+        now = time.perf_counter()
+        if now - self._last_report >= self.REPORT_INTERVAL or self.files_done >= self.files_total:
+            self._last_report = now
+            self.callback(self.snapshot())
+
+
+class _PhaseTimer:
+    """Times one pass through a phase and records it on exit"""
+
+    __slots__ = ("metrics", "name", "nbytes", "files", "errors", "started")
+
+    def __init__(self, metrics: "Metrics", name: str, nbytes: int, files: int):
+        self.metrics = metrics
+        self.name = name
+        self.nbytes = nbytes
+        self.files = files
+        self.errors = 0
+
+    def add(self, nbytes: int = 0, files: int = 0):
+        self.nbytes += nbytes
+        self.files += files
+
+    def fail(self):
+        self.errors += 1
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and not issubclass(exc_type, OperationCancelled):
+            self.errors += 1
+        self.metrics.record(self.name, time.perf_counter() - self.started,
+                            self.nbytes, self.files, self.errors)
+        return False
+
+
+class _NullPhase:
+    """Stand-in for _PhaseTimer while metrics are off"""
+
+    __slots__ = ()
+
+    def add(self, nbytes: int = 0, files: int = 0):
+        pass
+
+    def fail(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class Metrics:
+    """Per-phase timings, byte, file and error counts for one run
+
+    Off by default, in which case phase() costs next to nothing. A session
+    turns it on, optionally with cProfile and tracemalloc, and writes a
+    JSON report at the end. Phases timed on worker threads add up thread
+    time, so they can exceed the wall time of the run.
+    """
+
+    ENV_REPORT = "PROJECT_BUNDLER_METRICS"
+    ENV_PROFILE = "PROJECT_BUNDLER_PROFILE"
+    ENV_TRACEMALLOC = "PROJECT_BUNDLER_TRACEMALLOC"
+
+    _NULL = _NullPhase()
+
+    def __init__(self):
+        self.enabled = False
+        self.phases: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def phase(self, name: str, nbytes: int = 0, files: int = 0):
+        """Context manager timing a phase; use .add() and .fail() inside it"""
+        if not self.enabled:
+            return self._NULL
+        return _PhaseTimer(self, name, nbytes, files)
+
+    def record(self, name: str, seconds: float = 0.0, nbytes: int = 0,
+               files: int = 0, errors: int = 0):
+        """Add to the totals of a phase"""
+        if not self.enabled:
+            return
+        with self._lock:
+            totals = self.phases.setdefault(
+                name, {"seconds": 0.0, "calls": 0, "bytes": 0, "files": 0, "errors": 0})
+            totals["seconds"] += seconds
+            totals["calls"] += 1
+            totals["bytes"] += nbytes
+            totals["files"] += files
+            totals["errors"] += errors
+
+    def report(self) -> dict:
+        """Phase totals with throughput, as plain JSON-ready data"""
+        with self._lock:
+            phases = {name: dict(totals) for name, totals in self.phases.items()}
+        for totals in phases.values():
+            seconds = totals["seconds"]
+            totals["seconds"] = round(seconds, 6)
+            totals["mb_per_s"] = round(totals["bytes"] / seconds / 1e6, 2) if seconds > 0 else None
+        return {"phases": phases}
+
+    @contextmanager
+    def session(self, command: str, report: Optional[str] = None,
+                profile: Optional[str] = None, trace_memory: bool = False):
+        """Collect metrics around one operation, if a report or profile is wanted
+
+        Missing arguments fall back to the PROJECT_BUNDLER_* environment
+        variables. The report goes to a JSON file, or to stdout for "-";
+        the cProfile dump covers the calling thread only.
+        """
+        report = report or os.environ.get(self.ENV_REPORT)
+        profile = profile or os.environ.get(self.ENV_PROFILE)
+        trace_memory = trace_memory or os.environ.get(self.ENV_TRACEMALLOC, "") not in ("", "0")
+        if not (report or profile or trace_memory):
+            yield self
+            return
+
+        with self._lock:
+            self.phases = {}
+        self.enabled = True
+        started = time.perf_counter()
+        created = datetime.datetime.now().isoformat(timespec="seconds")
+        status = "ok"
+        profiler = None
+        if profile:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        if trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+        try:
+            yield self
+        except OperationCancelled:
+            status = "cancelled"
+            raise
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            result = {"command": command, "created": created, "status": status,
+                      "wall_seconds": round(time.perf_counter() - started, 6)}
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(profile)
+                result["profile"] = str(profile)
+            if trace_memory:
+                result["peak_memory_mb"] = round(tracemalloc.get_traced_memory()[1] / 1e6, 2)
+                tracemalloc.stop()
+            self.enabled = False
+            result.update(self.report())
+            if report == "-":
+                print(json.dumps(result, indent=2))
+            elif report:
+                Path(report).write_text(json.dumps(result, indent=2), encoding="utf-8")
+
+
+METRICS = Metrics()
 
 
 class ProjectManager:
     """Class for managing project folder operations"""
 
-    def __init__(self, initial_dir: Optional[Path] = None):
+    # Directories never worth descending into
+    PRUNED_DIRS = frozenset({
+        ".git", ".hg", ".svn", "__pycache__", "node_modules",
+        ".venv", "venv", ".tox", ".nox", ".mypy_cache", ".pytest_cache", ".ruff_cache",
+    })
+    DEFAULT_INCLUDE = ("*.py",)
+
+    # Files up to this size are read ahead on the thread pool, larger ones streamed
+    PREFETCH_LIMIT = 1024 * 1024
+    READ_WORKERS = 8
+    WRITE_WORKERS = 8
+    HASH_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, initial_dir: Optional[Path] = None,
+                 include: Sequence[str] = DEFAULT_INCLUDE, exclude: Sequence[str] = ()):
+        # Directory listings taken once per operation: relative dir -> {name: entry}
+        self._snapshot: Dict[str, Dict[str, object]] = {}
+        self._snapshot_lock = threading.Lock()
         self.project_dir = initial_dir or Path.cwd()
+        self.set_patterns(include, exclude)
+
+    @property
+    def project_dir(self) -> Path:
+        return self._project_dir
+
+    @project_dir.setter
+    def project_dir(self, value: Path):
+        self._project_dir = value
+        self._resolved_dir: Optional[Path] = None
+        self.invalidate_snapshot()
+
+    def set_patterns(self, include: Sequence[str], exclude: Sequence[str] = ()):
+        """Set include/exclude globs, matched against relative POSIX paths"""
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self._include_re = self._compile_globs(self.include)
+        self._exclude_re = self._compile_globs(self.exclude)
+
+    @staticmethod
+    def _compile_globs(patterns: Sequence[str]):
+        """Compile glob patterns into a single regex, None if there are none"""
+        if not patterns:
+            return None
+        return re.compile("|".join(fnmatch.translate(p) for p in patterns))
 
     def get_py_files(self) -> List[Path]:
-        """Returns all .py files in the project directory"""
-        return list(self.project_dir.glob("*.py"))
+        """Returns all matching files under the project directory, recursively
+
+        Heavy directories (VCS metadata, caches, virtualenvs, node_modules)
+        and excluded paths are pruned before they are descended into.
+        """
+        with METRICS.phase("scan") as timer:
+            found = []
+            stack = [(str(self.project_dir), "")]
+
+            while stack:
+                listing = self.scan_folder(*stack.pop())
+                if listing is None:
+                    continue
+                files, folders = listing
+                found.extend((relative, Path(entry.path)) for relative, entry in files)
+                stack.extend(folders)
+
+            timer.add(files=len(found))
+            return [path for _, path in sorted(found)]
+
+    def scan_folder(self, directory: str, prefix: str):
+        """List the matching files and the subfolders of one folder
+
+        Returns ([(relative name, DirEntry)], [(path, prefix)]), or None if
+        the folder can't be read or is a virtualenv.
+        """
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError:
+            return None
+
+        # A pyvenv.cfg marks a virtualenv, whatever the folder is called
+        if prefix and any(entry.name == "pyvenv.cfg" for entry in entries):
+            return None
+
+        files, folders = [], []
+        for entry in entries:
+            relative = prefix + entry.name
+            if self._exclude_re and self._exclude_re.match(relative):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in self.PRUNED_DIRS:
+                        folders.append((entry.path, relative + "/"))
+                elif entry.is_file() and (self._include_re is None
+                                          or self._include_re.match(relative)):
+                    files.append((relative, entry))
+            except OSError:
+                continue
+        return files, folders
+
+    def relative_name(self, path: Path) -> str:
+        """Archive name of a project file: its POSIX path relative to the project"""
+        return path.relative_to(self.project_dir).as_posix()
+
+    def _resolve(self, filename: str) -> Path:
+        """Map an archive name to a path, refusing anything outside the project
+
+        Backslashes are refused too, since Windows treats them as separators,
+        and the resolved path must still be inside the resolved project
+        folder, so symlinked folders can't lead out of it either.
+        """
+        relative = PurePosixPath(filename)
+        if (relative.is_absolute() or ".." in relative.parts or ":" in filename
+                or "\\" in filename):
+            raise ValueError(f"Unsafe file name in archive: {filename}")
+        path = self.project_dir.joinpath(*relative.parts)
+        if self._resolved_dir is None:
+            self._resolved_dir = self.project_dir.resolve()
+        try:
+            path.resolve().relative_to(self._resolved_dir)
+        except ValueError:
+            raise ValueError(f"Unsafe file name in archive: {filename}") from None
+        return path
+
+    def invalidate_snapshot(self):
+        """Forget cached directory listings; call at the start of an operation"""
+        with self._snapshot_lock:
+            self._snapshot = {}
+
+    def _listing(self, rel_dir: PurePosixPath) -> Dict[str, object]:
+        """Names in one project directory, scanned on first use and then cached
+
+        Values are os.DirEntry objects, or stat results for files written
+        since the scan.
+        """
+        key = rel_dir.as_posix()
+        with self._snapshot_lock:
+            listing = self._snapshot.get(key)
+        if listing is None:
+            listing = {}
+            try:
+                with os.scandir(self.project_dir.joinpath(*rel_dir.parts)) as it:
+                    for entry in it:
+                        listing[os.path.normcase(entry.name)] = entry
+            except OSError:
+                pass
+            with self._snapshot_lock:
+                listing = self._snapshot.setdefault(key, listing)
+        return listing
+
+    def _snapshot_entry(self, filename: str):
+        """Snapshot entry for an archive name, None if it is missing or unsafe"""
+        try:
+            self._resolve(filename)
+        except ValueError:
+            return None
+        relative = PurePosixPath(filename)
+        return self._listing(relative.parent).get(os.path.normcase(relative.name))
 
     def file_exists(self, filename: str) -> bool:
         """Check if file already exists in the project directory"""
-        return (self.project_dir / filename).exists()
+        return self._snapshot_entry(filename) is not None
 
-    def write_file(self, filename: str, content: str) -> bool:
-        """Write file to the project directory"""
+    def file_size(self, filename: str) -> Optional[int]:
+        """Size of a project file from the snapshot, None if it does not exist"""
+        entry = self._snapshot_entry(filename)
+        if entry is None:
+            return None
         try:
-            (self.project_dir / filename).write_text(content, encoding="utf-8")
-            return True
-        except Exception:
-            return False
+            stat = entry.stat() if isinstance(entry, os.DirEntry) else entry
+        except OSError:
+            return None
+        return stat.st_size
+
+    def _record_write(self, filename: str, path: Path):
+        """Update the snapshot after writing a file, if its folder was scanned"""
+        relative = PurePosixPath(filename)
+        with self._snapshot_lock:
+            listing = self._snapshot.get(relative.parent.as_posix())
+        if listing is None:
+            return
+        try:
+            listing[os.path.normcase(relative.name)] = path.stat()
+        except OSError:
+            listing.pop(os.path.normcase(relative.name), None)
+
+    def write_file(self, filename: str, content: Union[str, memoryview]) -> bool:
+        """Write file to the project directory, creating subdirectories
+
+        The content goes to a temp file that is then renamed over the
+        target, so readers never see a half-written file. Bytes-like
+        content is written as is.
+        """
+        with METRICS.phase("write") as timer:
+            try:
+                path = self._resolve(filename)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+                try:
+                    if isinstance(content, str):
+                        tmp_path.write_text(content, encoding="utf-8")
+                    else:
+                        tmp_path.write_bytes(content)
+                    if path.exists():
+                        shutil.copymode(path, tmp_path)
+                    os.replace(tmp_path, path)
+                    self._record_write(filename, path)
+                except BaseException:
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+                    raise
+                timer.add(len(content), files=1)
+                return True
+            except Exception:
+                timer.fail()
+                return False
+
+    @staticmethod
+    def _encode_like_write_text(content: Union[str, memoryview]) -> bytes:
+        """Bytes that write_text would put on disk for content"""
+        if not isinstance(content, str):
+            return content
+        if os.linesep != "\n":
+            content = content.replace("\n", os.linesep)
+        return content.encode("utf-8")
+
+    def is_unchanged(self, filename: str, content: Union[str, memoryview]) -> bool:
+        """Check if the file on disk already holds exactly this content
+
+        Sizes are compared first, from the snapshot; the file is only hashed
+        when they match.
+        """
+        with METRICS.phase("compare", files=1) as timer:
+            try:
+                path = self._resolve(filename)
+                data = self._encode_like_write_text(content)
+                if self.file_size(filename) != len(data):
+                    return False
+                digest = hashlib.sha256()
+                with open(path, "rb") as src:
+                    for chunk in iter(partial(src.read, self.HASH_CHUNK_SIZE), b""):
+                        digest.update(chunk)
+                timer.add(len(data))
+                return digest.digest() == hashlib.sha256(data).digest()
+            except Exception:
+                return False
+
+    def restore_file(self, filename: str, content: Union[str, memoryview, None]) -> str:
+        """Write a restored file unless it is unchanged
+
+        Returns "unchanged", "written" or "error"; None content is an error.
+        """
+        if content is None:
+            return "error"
+        if self.is_unchanged(filename, content):
+            return "unchanged"
+        return "written" if self.write_file(filename, content) else "error"
+
+    def restore_members(self, members: Mapping, filenames: Iterable[str],
+                        tracker: Optional[ProgressTracker] = None) -> RestoreStats:
+        """Write the named archive members into the project and count outcomes
+
+        Members that fail their checksum or can't be decoded are never
+        written; they count as errors and are listed in the stats. Files
+        already holding the same content are left alone. The work runs
+        through a RestorePipeline, so reading, checking and writing overlap.
+        On cancellation no new files are started, writes already in flight
+        finish, and the stats come back marked as cancelled.
+        """
+        return RestorePipeline(self, members).run(filenames, tracker)
 
     def read_file(self, filename: str) -> Optional[str]:
         """Read file from the project directory"""
         try:
-            return (self.project_dir / filename).read_text(encoding="utf-8")
+            return self._resolve(filename).read_text(encoding="utf-8")
         except Exception:
             return None
 
+    @staticmethod
+    def _read_small(path: Path) -> Optional[str]:
+        """Read a file if it is small enough to prefetch, else return None"""
+        with METRICS.phase("read") as timer:
+            try:
+                if path.stat().st_size > ProjectManager.PREFETCH_LIMIT:
+                    return None
+                content = path.read_text(encoding="utf-8")
+                timer.add(len(content), files=1)
+                return content
+            except Exception:
+                timer.fail()
+                return None
 
-class ArchiveManager:
-    """Class for managing text archive operations"""
+    @staticmethod
+    def prefetch_files(paths: Sequence[Path], workers: int = READ_WORKERS,
+                       reader: Optional[Callable[[Path], object]] = None
+                       ) -> Iterator[Tuple[Path, Optional[str]]]:
+        """Read files concurrently, yielding (path, content) in input order
+
+        Only a bounded window of reads is in flight at once, so memory stays
+        capped. Content is None for large or unreadable files, which callers
+        should stream from disk instead. A reader replaces the default one,
+        e.g. to hash files on the pool as well.
+        """
+        read = reader or ProjectManager._read_small
+        if workers <= 1:
+            for path in paths:
+                yield path, read(path)
+            return
+
+        window = workers * 4
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for path in paths:
+                pending.append((path, pool.submit(read, path)))
+                if len(pending) >= window:
+                    done_path, future = pending.popleft()
+                    yield done_path, future.result()
+            while pending:
+                done_path, future = pending.popleft()
+                yield done_path, future.result()
+
+
+class StageStats(NamedTuple):
+    """Throughput counters of one restore pipeline stage"""
+    name: str
+    files: int
+    bytes: int
+    busy: float       # seconds spent working, summed over the stage's threads
+    waited: float     # seconds spent blocked on an empty or full queue
+
+    @property
+    def throughput(self) -> float:
+        """Bytes per busy second"""
+        return self.bytes / self.busy if self.busy else 0.0
+
+
+class _Stage:
+    """Thread-safe running counters of a pipeline stage"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.files = self.bytes = 0
+        self.busy = self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, busy: float, nbytes: int = 0, files: int = 1):
+        with self._lock:
+            self.busy += busy
+            self.bytes += nbytes
+            self.files += files
+
+    def wait(self, seconds: float):
+        with self._lock:
+            self.waited += seconds
+
+    def stats(self) -> StageStats:
+        with self._lock:
+            return StageStats(self.name, self.files, self.bytes, self.busy, self.waited)
+
+
+class RestorePipeline:
+    """Restores archive members through overlapping read, check and write stages
+
+    A reader thread fetches the wanted bodies in archive order, so a
+    compressed archive is read front to back and a mapped one is paged in
+    sequentially. Checker threads verify each body against its hash,
+    decode it if needed and drop files whose copy on disk is already
+    identical. A pool of writers persists the rest. The stages are joined
+    by bounded queues: a stage that gets ahead blocks until the next one
+    catches up, so about two queues' worth of bodies are held at once,
+    however large the archive.
+    """
+
+    DEPTH = 32          # bodies waiting between two stages
+    CHECKERS = 4
+    _DONE = None        # end-of-stream marker, one per consumer thread
+
+    def __init__(self, project_manager: "ProjectManager", members: Mapping,
+                 depth: int = DEPTH, checkers: int = CHECKERS,
+                 writers: int = ProjectManager.WRITE_WORKERS):
+        self.project_manager = project_manager
+        self.members = members
+        self.depth = depth
+        self.checkers = checkers
+        self.writers = writers
+        self.stages = {name: _Stage(name) for name in ("read", "check", "write")}
+
+    def _get(self, source: queue.Queue, stage: _Stage):
+        started = time.perf_counter()
+        item = source.get()
+        stage.wait(time.perf_counter() - started)
+        return item
+
+    def _put(self, target: queue.Queue, item, stage: _Stage):
+        started = time.perf_counter()
+        target.put(item)
+        stage.wait(time.perf_counter() - started)
+
+    def _ordered(self, filenames: Iterable[str]) -> List[str]:
+        """Filenames in the order their bodies are stored"""
+        filenames = list(filenames)
+        if not isinstance(self.members, ArchiveMembers):
+            return filenames
+        sources: Dict[int, int] = {}
+        entries = self.members.entries
+
+        def position(filename: str) -> Tuple[int, int]:
+            source, entry = entries.get(filename, (None, None))
+            if entry is None:
+                return (-1, 0)
+            return (sources.setdefault(id(source), len(sources)), entry.offset)
+        return sorted(filenames, key=position)
+
+    def run(self, filenames: Iterable[str],
+            tracker: Optional[ProgressTracker] = None) -> RestoreStats:
+        """Restore filenames from the members and count outcomes"""
+        read_queue: queue.Queue = queue.Queue(self.depth)
+        write_queue: queue.Queue = queue.Queue(self.depth)
+        lock = threading.Lock()
+        counts = {"restored": 0, "created_new": 0, "unchanged": 0, "errors": 0}
+        corrupt: List[str] = []
+        missing: List[str] = []
+        failures: List[BaseException] = []
+        checkers_left = [self.checkers]
+        project_manager = self.project_manager
+
+        def cancelled() -> bool:
+            return tracker is not None and tracker.cancelled
+
+        def finished(outcome: str, nbytes: int = 0, filename: Optional[str] = None):
+            with lock:
+                counts[outcome] += 1
+                if filename is not None:
+                    corrupt.append(filename)
+                if tracker is not None:
+                    tracker.advance(nbytes)
+
+        def read():
+            stage = self.stages["read"]
+            try:
+                for filename in self._ordered(filenames):
+                    if cancelled():
+                        break
+                    started = time.perf_counter()
+                    try:
+                        if isinstance(self.members, ArchiveMembers):
+                            entry, raw = self.members.read_raw(filename)
+                        else:
+                            entry, raw = None, self.members[filename]
+                    except MissingObjectError:
+                        stage.add(time.perf_counter() - started)
+                        with lock:
+                            missing.append(filename)
+                        finished("errors")
+                        continue
+                    except Exception:
+                        entry, raw = None, None
+                    stage.add(time.perf_counter() - started, len(raw) if raw is not None else 0)
+                    self._put(read_queue, (filename, entry, raw), stage)
+            except BaseException as e:
+                failures.append(e)
+            finally:
+                for _ in range(self.checkers):
+                    self._put(read_queue, self._DONE, stage)
+
+        def check():
+            stage = self.stages["check"]
+            try:
+                while True:
+                    item = self._get(read_queue, stage)
+                    if item is self._DONE:
+                        break
+                    if cancelled() or failures:
+                        continue
+                    filename, entry, raw = item
+                    started = time.perf_counter()
+                    try:
+                        payload = raw if entry is None else ArchiveMembers.prepare(entry, raw)
+                    except Exception:
+                        payload = None
+                    if payload is None:
+                        stage.add(time.perf_counter() - started)
+                        finished("errors", filename=filename)
+                        continue
+                    existed = project_manager.file_exists(filename)
+                    unchanged = project_manager.is_unchanged(filename, payload)
+                    stage.add(time.perf_counter() - started, len(payload))
+                    if unchanged:
+                        finished("unchanged", len(payload))
+                    else:
+                        self._put(write_queue, (filename, payload, existed), stage)
+            except BaseException as e:
+                failures.append(e)
+                # Keep draining, so the reader is never left blocked on a full queue
+                while self._get(read_queue, stage) is not self._DONE:
+                    pass
+            finally:
+                with lock:
+                    checkers_left[0] -= 1
+                    last = checkers_left[0] == 0
+                if last:
+                    for _ in range(self.writers):
+                        self._put(write_queue, self._DONE, stage)
+
+        def write():
+            stage = self.stages["write"]
+            try:
+                while True:
+                    item = self._get(write_queue, stage)
+                    if item is self._DONE:
+                        break
+                    if cancelled() or failures:
+                        continue
+                    filename, payload, existed = item
+                    started = time.perf_counter()
+                    written = project_manager.write_file(filename, payload)
+                    stage.add(time.perf_counter() - started, len(payload) if written else 0)
+                    if not written:
+                        finished("errors", len(payload))
+                    else:
+                        finished("restored" if existed else "created_new", len(payload))
+            except BaseException as e:
+                failures.append(e)
+                while self._get(write_queue, stage) is not self._DONE:
+                    pass
+
+        threads = [threading.Thread(target=read, name="restore-read", daemon=True)]
+        threads += [threading.Thread(target=check, name="restore-check", daemon=True)
+                    for _ in range(self.checkers)]
+        threads += [threading.Thread(target=write, name="restore-write", daemon=True)
+                    for _ in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if failures:
+            raise failures[0]
+
+        stages = tuple(stage.stats() for stage in self.stages.values())
+        for stage in stages:
+            METRICS.record(f"stage_{stage.name}", stage.busy, stage.bytes, stage.files)
+        return RestoreStats(counts["restored"], counts["created_new"], counts["unchanged"],
+                            counts["errors"], cancelled(), tuple(corrupt), stages,
+                            tuple(missing))
 
     @staticmethod
-    def create_archive(project_name: str, files: Dict[str, str]) -> str:
-        """Create archive content from files dictionary"""
-        content_lines = [
-            f"# Project Archive – {project_name}",
+    def merge_stages(groups: Iterable[Sequence[StageStats]]) -> Tuple[StageStats, ...]:
+        """Add up the stage counters of several runs, stage by stage"""
+        merged: Dict[str, StageStats] = {}
+        for stages in groups:
+            for stage in stages:
+                old = merged.get(stage.name)
+                merged[stage.name] = stage if old is None else StageStats(
+                    stage.name, old.files + stage.files, old.bytes + stage.bytes,
+                    old.busy + stage.busy, old.waited + stage.waited)
+        return tuple(merged.values())
+
+
+class UnreadableFileError(Exception):
+    """A source file failed to read after its block was started"""
+
+
+class PreparedFile(NamedTuple):
+    """A format 2 body hashed ahead of writing; data is None for files streamed later"""
+    data: Optional[bytes]
+    length: int
+    checksum: str
+
+
+class ArchiveWriter:
+    """Streams archive content into an open binary file handle
+
+    Format 1 blocks are delimited by marker lines only, with surrounding
+    whitespace dropped. Format 2 headers also carry the body's byte length
+    and hash ("=== name === 1234 sha256=... ==="), and the body is the
+    file's text verbatim with "\\n" line endings, so content that looks like
+    a marker is safe and readers can skip bodies without scanning them.
+
+    Given a start position, the writer continues an existing format 2
+    archive instead of starting a new one: no header is written, and later
+    records for a filename supersede earlier ones or, as tombstones
+    ("=== name === 0 deleted=1 ==="), delete it.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+    BUFFER_SIZE = 1024 * 1024
+    VERSION = 2
+
+    def __init__(self, handle: BinaryIO, project_name: str, total_files: int,
+                 newline: str = os.linesep, index: bool = False,
+                 extra_header: Sequence[str] = (), seekable: bool = True,
+                 version: int = VERSION, start: Optional[int] = None,
+                 previous_index: Optional[int] = None):
+        if version not in (1, 2):
+            raise ValueError(f"Unknown archive format: {version}")
+        self.handle = handle
+        self.seekable = seekable
+        self.project_name = project_name
+        self.newline = newline
+        self.extra_header = tuple(extra_header)
+        self.version = version
+        self.position = 0
+        self.files_written = 0
+        self.entries: Optional[List[ArchiveEntry]] = [] if index else None
+        self.previous_index = previous_index
+
+        if start is not None:
+            # Appending: the header is already there
+            self.position = self.header_size = start
+            return
+        self._write_text("\n".join([
+            f"{ArchiveManager.TITLE_PREFIX}{project_name}",
             f"# Date: {datetime.datetime.now():%Y-%m-%d %H:%M:%S}",
-            f"# Total files: {len(files)}",
+            f"# Total files: {total_files}",
+            *([f"# Format: {version}"] if version > 1 else []),
+            *self.extra_header,
             ""
-        ]
+        ]))
+        self.header_size = self.position
+
+    def _encode(self, text: str) -> bytes:
+        """Encode text with the configured line endings"""
+        if self.newline != "\n":
+            text = text.replace("\n", self.newline)
+        return text.encode("utf-8")
+
+    def _write_bytes(self, data: bytes):
+        """Write raw bytes and advance the position"""
+        self.handle.write(data)
+        self.position += len(data)
+
+    def _write_text(self, text: str):
+        """Encode text with the configured line endings and write it"""
+        self._write_bytes(self._encode(text))
+
+    @staticmethod
+    def _rstrip_chunks(chunks: Iterable[str]) -> Iterator[str]:
+        """Yield text pieces whose concatenation equals "".join(chunks).rstrip()
+
+        Trailing whitespace is held back until more content follows it, so
+        the whole text never has to be in memory at once.
+        """
+        pending = ""
+        for chunk in chunks:
+            stripped = chunk.rstrip()
+            if not stripped:
+                pending += chunk
+                continue
+            yield pending + stripped
+            pending = chunk[len(stripped):]
+
+    @staticmethod
+    def content_digest(chunks: Iterable[str]) -> str:
+        """SHA-256 of text as it reads back from an archive block
+
+        This is the hash of the block body with surrounding whitespace
+        removed and "\\n" line endings, independent of where it is stored.
+        """
+        digest = hashlib.sha256()
+        started = False
+        for piece in ArchiveWriter._rstrip_chunks(chunks):
+            data = piece.encode("utf-8")
+            if not started:
+                data = data.lstrip()
+                started = bool(data)
+            digest.update(data)
+        return digest.hexdigest()
+
+    def add_chunks(self, filename: str, chunks: Iterable[str]):
+        """Write one file block, stripping trailing whitespace on the fly"""
+        self._write_text(f"\n=== {filename} ===\n")
+
+        # Body boundaries and checksum follow the same whitespace rules
+        # as ArchiveManager.iter_entries, so index entries match a scan
+        digest = hashlib.sha256()
+        body_start = None
+        header_end = self.position
+
+        for piece in self._rstrip_chunks(chunks):
+            data = self._encode(piece)
+            if body_start is None:
+                lead = len(data) - len(data.lstrip())
+                body_start = self.position + lead
+                digest.update(data[lead:])
+            else:
+                digest.update(data)
+            self._write_bytes(data)
+
+        if body_start is None:
+            body_start = header_end
+        entry = ArchiveEntry(filename, body_start, self.position - body_start,
+                             digest.hexdigest())
+
+        self._write_text("\n\n=== END ===\n")
+        self.files_written += 1
+        if self.entries is not None:
+            self.entries.append(entry)
+
+    def _write_record(self, filename: str, length: int, checksum: str, chunks: Iterable[bytes],
+                      verify: bool = True):
+        """Write one format 2 block whose body length and hash are known up front
+
+        With verify, the body is hashed again while it is copied, which
+        catches files that changed after they were hashed.
+        """
+        self._write_text(f"\n=== {filename} === {length} sha256={checksum} ===\n")
+        body_start = self.position
+        digest = hashlib.sha256() if verify else None
+        for data in chunks:
+            if digest is not None:
+                digest.update(data)
+            self._write_bytes(data)
+        if self.position - body_start != length or (
+                digest is not None and digest.hexdigest() != checksum):
+            raise ValueError(f"{filename} changed while it was being bundled")
+        self._write_text("\n=== END ===\n")
+        self.files_written += 1
+        if self.entries is not None:
+            self.entries.append(ArchiveEntry(filename, body_start, length, checksum))
+
+    @staticmethod
+    def _normalize_newlines(text: str) -> str:
+        if "\r" in text:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        return text
+
+    @staticmethod
+    def encode_text(content: str) -> Tuple[bytes, str]:
+        """Format 2 body of a text and its SHA-256"""
+        data = ArchiveWriter._normalize_newlines(content).encode("utf-8")
+        return data, hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def _file_chunks(path: Path) -> Iterator[bytes]:
+        """A file's format 2 body in chunks, with newlines translated as text mode does"""
+        with open(path, "r", encoding="utf-8") as src:
+            for text in iter(partial(src.read, ArchiveWriter.CHUNK_SIZE), ""):
+                yield text.encode("utf-8")
+
+    @staticmethod
+    def prepare_file(path: Path) -> Optional[PreparedFile]:
+        """Read and hash a file for a format 2 archive, None if it can't be read
+
+        Meant for the read pool, so hashing runs alongside other reads:
+        small files come back encoded, large ones only sized and hashed.
+        """
+        content = ProjectManager._read_small(path)
+        if content is not None:
+            data, checksum = ArchiveWriter.encode_text(content)
+            return PreparedFile(data, len(data), checksum)
+        try:
+            digest = hashlib.sha256()
+            length = 0
+            for data in ArchiveWriter._file_chunks(path):
+                digest.update(data)
+                length += len(data)
+        except Exception:
+            return None
+        return PreparedFile(None, length, digest.hexdigest())
+
+    def add_text(self, filename: str, content: str):
+        """Write one file block from an in-memory string"""
+        if self.version == 1:
+            self.add_chunks(filename, [content])
+            return
+        self.add_encoded(filename, *self.encode_text(content))
+
+    def add_encoded(self, filename: str, data: bytes, checksum: str):
+        """Write one format 2 block from a body already encoded and hashed"""
+        self._write_record(filename, len(data), checksum, [data], verify=False)
+
+    def _add_file_v2(self, filename: str, path: Path, prepared: Optional[PreparedFile] = None):
+        """Stream a file as a format 2 block: one pass to size and hash it, one to copy
+
+        The first pass is skipped when the file was already hashed on the read pool.
+        """
+        if prepared is None:
+            prepared = self.prepare_file(path)
+            if prepared is None:
+                raise ValueError(f"{filename} can't be read")
+        self._write_record(filename, prepared.length, prepared.checksum,
+                           self._file_chunks(path))
+
+    def add_tombstone(self, filename: str):
+        """Write a format 2 record marking filename as deleted"""
+        if self.version == 1:
+            raise ValueError("Format 1 archives can't record deletions")
+        self._write_text(f"\n=== {filename} === 0 deleted=1 ===\n")
+        entry = ArchiveEntry(filename, self.position, 0, deleted=True)
+        self._write_text("\n=== END ===\n")
+        if self.entries is not None:
+            self.entries.append(entry)
+
+    def add_reference(self, filename: str, length: int, checksum: str):
+        """Write a format 2 record whose body is the object checksum in a store"""
+        if self.version == 1:
+            raise ValueError("Format 1 archives can't refer to an object store")
+        self._write_text(f"\n=== {filename} === 0 sha256={checksum} size={length} stored=1 ===\n")
+        entry = ArchiveEntry(filename, self.position, length, checksum, stored=True)
+        self._write_text("\n=== END ===\n")
+        self.files_written += 1
+        if self.entries is not None:
+            self.entries.append(entry)
+
+    def add_pointer(self, filename: str, volume: int):
+        """Write a format 2 record saying which volume of a VolumeSet holds filename"""
+        if self.version == 1:
+            raise ValueError("Format 1 archives can't be split into volumes")
+        self._write_text(f"\n=== {filename} === 0 volume={volume} ===\n")
+        entry = ArchiveEntry(filename, self.position, 0, volume=volume)
+        self._write_text("\n=== END ===\n")
+        self.files_written += 1
+        if self.entries is not None:
+            self.entries.append(entry)
+
+    def add_file(self, filename: str, path: Path,
+                 prepared: Optional[PreparedFile] = None) -> bool:
+        """Stream a source file into the archive, return False if it can't be read
+
+        On a non-seekable handle (e.g. a compressor) a partial block can't be
+        undone, so UnreadableFileError is raised instead.
+        """
+        start = self.position
+        try:
+            if self.version == 1:
+                with open(path, "r", encoding="utf-8") as src:
+                    self.add_chunks(filename, iter(partial(src.read, self.CHUNK_SIZE), ""))
+            else:
+                self._add_file_v2(filename, path, prepared)
+            return True
+        except Exception as e:
+            if not self.seekable:
+                raise UnreadableFileError(filename) from e
+            self.rollback(start)
+            return False
+
+    def rollback(self, position: int):
+        """Drop everything written after position"""
+        self.handle.seek(position)
+        self.handle.truncate()
+        self.position = position
+
+    def finish(self):
+        """Write the table-of-contents trailer if the index is enabled
+
+        The trailer is made of comment lines after the last block, so it is
+        ignored by marker-based parsing. Its last line records where the
+        trailer starts, which lets readers find it by looking at the tail.
+        When appending, only the new records are listed, after a line
+        pointing back to the trailer of the previous update.
+        """
+        if self.entries is None:
+            return
+
+        index_offset = self.position
+        latest = sorted(ArchiveManager.live_entries(self.entries, tombstones=True).values(),
+                        key=lambda entry: entry.offset)
+        lines = [f"\n{ArchiveManager.INDEX_HEADER} {len(latest)} files"]
+        if self.previous_index is not None:
+            lines.append(f"{ArchiveManager.INDEX_PREVIOUS} {self.previous_index}")
+        for entry in latest:
+            checksum = ArchiveManager.INDEX_TOMBSTONE if entry.deleted else entry.checksum
+            lines.append(f"# {entry.offset} {entry.length} {checksum} {entry.filename}")
+        lines.append(f"{ArchiveManager.INDEX_FOOTER} {index_offset + len(self.newline)}\n")
+        self._write_text("\n".join(lines))
+
+
+class ArchiveEntry(NamedTuple):
+    """Location of one file body inside an archive, in bytes"""
+    filename: str
+    offset: int
+    length: int
+    checksum: str = ""
+    deleted: bool = False     # a tombstone: the file was removed at this point
+    stored: bool = False      # the body is an object in the archive's ObjectStore
+    volume: int = 0           # the body is in this volume of a VolumeSet
+
+
+class MissingObjectError(ValueError):
+    """A stored entry's object is not in its object store"""
+
+
+class ObjectStore:
+    """Content-addressed store of file bodies shared by manifest archives
+
+    Each unique body is kept once, as <root>/ab/abcd..., named by the
+    SHA-256 of its format 2 bytes, so a record's checksum is also its
+    object's name. Archives bundled into a store hold only names and
+    hashes, and a "# Store:" header line pointing at the store. Existence
+    checks list each fan-out folder once per run instead of testing
+    objects one by one.
+    """
+
+    HASH_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.objects_written = 0
+        self.bytes_written = 0
+        self._known: Dict[str, set] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def for_archive(archive_path: Path, header: Dict[str, List[str]]) -> Optional["ObjectStore"]:
+        """The store an archive's header points at, None for self-contained archives"""
+        store = header.get("Store")
+        if not store:
+            return None
+        return ObjectStore(Path(archive_path).parent.joinpath(*PurePosixPath(store[0]).parts))
+
+    def path(self, checksum: str) -> Path:
+        """Where the object with this hash lives"""
+        if not self.HASH_PATTERN.fullmatch(checksum):
+            raise ValueError(f"Not an object name: {checksum!r}")
+        return self.root / checksum[:2] / checksum
+
+    def _names(self, prefix: str) -> set:
+        """Objects in one fan-out folder, listed on first use"""
+        with self._lock:
+            names = self._known.get(prefix)
+            if names is None:
+                try:
+                    with os.scandir(self.root / prefix) as it:
+                        names = {entry.name for entry in it}
+                except OSError:
+                    names = set()
+                self._known[prefix] = names
+            return names
+
+    def missing(self, checksums: Iterable[str]) -> List[str]:
+        """The hashes that have no object yet"""
+        return [checksum for checksum in checksums if checksum not in self._names(checksum[:2])]
+
+    def _write(self, checksum: str, chunks: Iterable[bytes]) -> bool:
+        """Store an object unless it exists, checking its hash; True if written"""
+        if not self.missing([checksum]):
+            return False
+        path = self.path(checksum)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Unique temporary name: other threads or processes may store the same body
+        tmp_path = path.with_name(f".{checksum}.{os.getpid()}.{threading.get_ident()}.tmp")
+        digest = hashlib.sha256()
+        length = 0
+        try:
+            with open(tmp_path, "wb") as dst:
+                for data in chunks:
+                    digest.update(data)
+                    dst.write(data)
+                    length += len(data)
+            if digest.hexdigest() != checksum:
+                raise ValueError(f"Object {checksum} changed while it was being stored")
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        names = self._names(checksum[:2])
+        with self._lock:
+            names.add(checksum)
+            self.objects_written += 1
+            self.bytes_written += length
+        return True
+
+    def put(self, data: bytes, checksum: str) -> bool:
+        """Store an encoded body; True if it was new"""
+        return self._write(checksum, [data])
+
+    def put_file(self, path: Path, prepared: PreparedFile) -> bool:
+        """Store a large file's body by streaming it; True if it was new"""
+        return self._write(prepared.checksum, ArchiveWriter._file_chunks(path))
+
+    def read_raw(self, entry: "ArchiveEntry") -> bytes:
+        """Body of a stored entry as it is on disk, not yet checked"""
+        with METRICS.phase("object", nbytes=entry.length, files=1):
+            try:
+                return self.path(entry.checksum).read_bytes()
+            except FileNotFoundError:
+                raise MissingObjectError(f"Object missing for {entry.filename}") from None
+
+    def read(self, entry: "ArchiveEntry") -> bytes:
+        """Body of a stored entry, checked against its hash"""
+        data = self.read_raw(entry)
+        if hashlib.sha256(data).hexdigest() != entry.checksum:
+            raise ValueError(f"Checksum mismatch for {entry.filename}")
+        return data
+
+    def digest(self, checksum: str) -> Optional[str]:
+        """SHA-256 of an object's content, read in chunks; None if it is missing"""
+        digest = hashlib.sha256()
+        try:
+            with open(self.path(checksum), "rb") as src:
+                for data in iter(partial(src.read, ArchiveWriter.CHUNK_SIZE), b""):
+                    digest.update(data)
+        except FileNotFoundError:
+            return None
+        return digest.hexdigest()
+
+
+class ArchiveMembers(Mapping):
+    """Read-only filename -> content mapping that decodes bodies on access
+
+    Entries may come from several open archives; later additions win, which
+    is how a baseline and its chain of deltas, and appended records, are
+    layered.
+    """
+
+    CARRIAGE_RETURN = re.compile(b"\r")
+
+    def __init__(self, handle: Optional[BinaryIO] = None,
+                 entries: Iterable[ArchiveEntry] = ()):
+        self.entries: Dict[str, Tuple[BinaryIO, ArchiveEntry]] = {}
+        if handle is not None:
+            self.add(handle, entries)
+
+    def add(self, handle: BinaryIO, entries: Iterable[ArchiveEntry],
+            deleted: Iterable[str] = (), store: Optional[ObjectStore] = None):
+        """Layer entries of another archive on top, dropping deleted names
+
+        Stored entries are read from store instead of the archive handle.
+        """
+        for filename in deleted:
+            self.entries.pop(filename, None)
+        for entry in entries:
+            if entry.deleted:
+                self.entries.pop(entry.filename, None)
+            elif entry.stored:
+                if store is None:
+                    raise ValueError(f"{entry.filename} is in an object store, "
+                                     "but the archive names none")
+                self.entries[entry.filename] = (store, entry)
+            else:
+                self.entries[entry.filename] = (handle, entry)
+
+    def __getitem__(self, filename: str) -> str:
+        handle, entry = self.entries[filename]
+        if isinstance(handle, ObjectStore):
+            return handle.read(entry).decode("utf-8")
+        return ArchiveManager.read_entry(handle, entry)
+
+    def payload(self, filename: str) -> Union[str, memoryview]:
+        """Body ready for writing: a raw slice when possible, else decoded text"""
+        return self.prepare(*self.read_raw(filename))
+
+    def read_raw(self, filename: str) -> Tuple[ArchiveEntry, Union[bytes, memoryview]]:
+        """A member's entry and its body as stored, not yet checked or decoded
+
+        Bodies of memory-mapped archives are slices of the mapping.
+        """
+        handle, entry = self.entries[filename]
+        if isinstance(handle, ObjectStore):
+            return entry, handle.read_raw(entry)
+        with METRICS.phase("read", nbytes=entry.length, files=1):
+            if isinstance(handle, mmap.mmap):
+                if entry.offset + entry.length > len(handle):
+                    raise ValueError(f"Archive is truncated inside {entry.filename}")
+                return entry, memoryview(handle)[entry.offset:entry.offset + entry.length]
+            handle.seek(entry.offset)
+            data = handle.read(entry.length)
+            if len(data) != entry.length:
+                raise ValueError(f"Archive is truncated inside {entry.filename}")
+            return entry, data
+
+    @staticmethod
+    def prepare(entry: ArchiveEntry, raw: Union[bytes, memoryview]) -> Union[str, memoryview]:
+        """Check a body from read_raw against its hash and make it ready for writing
+
+        A body without carriage returns is already what write_text would
+        produce on systems with plain newline line endings, so there it is
+        handed out as is; otherwise it is decoded to text.
+        """
+        with METRICS.phase("decode", nbytes=entry.length, files=1):
+            if entry.checksum and hashlib.sha256(raw).hexdigest() != entry.checksum:
+                raise ValueError(f"Checksum mismatch for {entry.filename}")
+            if os.linesep == "\n" and not ArchiveMembers.CARRIAGE_RETURN.search(raw):
+                return raw if isinstance(raw, memoryview) else memoryview(raw)
+            # Match the universal newline handling of text-mode reads
+            return bytes(raw).decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+    def __contains__(self, filename) -> bool:
+        # Mapping's default would decode the body just to test membership
+        return filename in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class VerifyResult(NamedTuple):
+    """Outcome of checking archive records against their hashes"""
+    checked: int          # records whose hash matched
+    unverified: int       # records without a hash (format 1 without an index)
+    failures: List[str]   # one message per problem found
+
+
+class ArchiveManager:
+    """Class for managing text archive operations"""
+
+    HEADER_PATTERN = re.compile(rb'=== (.+?) ===')
+    # Format 2 header: "=== name === <length> [key=value ...] ==="
+    RECORD_PATTERN = re.compile(rb'=== (.+) === (\d+)((?: [\w-]+=\S*)*) ===\s*$')
+    # Only archives whose header has this line hold format 2 records
+    FORMAT_PATTERN = re.compile(rb'(?m)^# Format: 2\s*$')
+    END_MARKER = b"=== END ==="
+    LINE_LIMIT = 64 * 1024
+    TITLE_PREFIX = "# Project Archive – "
+    INDEX_HEADER = "# Index:"
+    INDEX_FOOTER = "# Index offset:"
+    INDEX_PREVIOUS = "# Index previous:"
+    INDEX_TOMBSTONE = "deleted"       # checksum column of a deleted file
+    INDEX_FOOTER_PATTERN = re.compile(rb'# Index offset: (\d+)\s*\Z')
+    INDEX_TAIL_SIZE = 256
+
+    # Compression codecs by name, file suffix and magic bytes
+    COMPRESSION_SUFFIXES = {".gz": "gzip", ".bz2": "bz2", ".xz": "xz"}
+    COMPRESSION_MAGIC = {b"\x1f\x8b": "gzip", b"BZh": "bz2", b"\xfd7zXZ\x00": "xz"}
+    DEFAULT_COMPRESSION_LEVEL = 6
+
+    @staticmethod
+    def create_archive(project_name: str, files: Dict[str, str], version: int = 1) -> str:
+        """Create archive content from files dictionary
+
+        Stays on format 1 by default, so its output is byte for byte what it
+        always produced, while write_archive and the other writers default
+        to format 2; pass version=2 for records with length and checksum.
+        """
+        buffer = io.BytesIO()
+        writer = ArchiveWriter(buffer, project_name, len(files), newline="\n",
+                               version=version)
+        for filename, file_content in sorted(files.items()):
+            writer.add_text(filename, file_content)
+
+        return buffer.getvalue().decode("utf-8")
+
+    @staticmethod
+    def compression_for(path: Path) -> Optional[str]:
+        """Compression codec implied by a file name suffix"""
+        return ArchiveManager.COMPRESSION_SUFFIXES.get(Path(path).suffix.lower())
+
+    @staticmethod
+    def _open_codec(path: Path, mode: str, compression: str,
+                    level: int = DEFAULT_COMPRESSION_LEVEL) -> BinaryIO:
+        """Open a compressed file stream with the given codec"""
+        # Appending adds a new compressed stream, which readers concatenate
+        writing = "r" not in mode
+        if compression == "gzip":
+            return gzip.open(path, mode, compresslevel=level) if writing else gzip.open(path, mode)
+        if compression == "bz2":
+            return bz2.open(path, mode, compresslevel=level) if writing else bz2.open(path, mode)
+        if compression == "xz":
+            return lzma.open(path, mode, preset=level) if writing else lzma.open(path, mode)
+        raise ValueError(f"Unknown compression: {compression}")
+
+    @staticmethod
+    def detect_compression(path: Path) -> Optional[str]:
+        """Detect the compression codec of a file from its magic bytes"""
+        with open(path, "rb") as handle:
+            head = handle.read(6)
+        for magic, compression in ArchiveManager.COMPRESSION_MAGIC.items():
+            if head.startswith(magic):
+                return compression
+        return None
+
+    @staticmethod
+    def open_archive(path: Path) -> BinaryIO:
+        """Open an archive for binary reading, decompressing transparently"""
+        compression = ArchiveManager.detect_compression(path)
+        if compression:
+            return ArchiveManager._open_codec(path, "rb", compression)
+        return open(path, "rb")
+
+    @staticmethod
+    def is_compressed(handle: BinaryIO) -> bool:
+        """True for decompressing streams, where seeking means re-reading"""
+        return isinstance(handle, (gzip.GzipFile, bz2.BZ2File, lzma.LZMAFile))
+
+    @staticmethod
+    def _write_members(writer: ArchiveWriter, ordered: List[Tuple[str, Path]], workers: int,
+                       tracker: Optional[ProgressTracker] = None,
+                       store: Optional[ObjectStore] = None):
+        """Feed files into a writer, prefetching small ones on a thread pool
+
+        For format 2 the pool also hashes every file, so checksums are
+        computed concurrently with reading rather than while writing. With
+        a store, bodies go into it (unless already there) and the archive
+        only gets references. The tracker is advanced, never reset, since
+        one may span several archives (the volumes of a set).
+        """
+        reader = ArchiveWriter.prepare_file if writer.version > 1 else None
+        contents = ProjectManager.prefetch_files([path for _, path in ordered], workers, reader)
+        for (filename, path), (_, content) in zip(ordered, contents):
+            if tracker is not None:
+                tracker.check_cancel()
+            start = writer.position
+            prepared = content if isinstance(content, PreparedFile) else None
+            if store is not None:
+                with METRICS.phase("store", files=1) as timer:
+                    if prepared is None:
+                        timer.fail()    # unreadable: left out, like a failed add_file
+                        continue
+                    try:
+                        if prepared.data is not None:
+                            written = store.put(prepared.data, prepared.checksum)
+                        else:
+                            written = store.put_file(path, prepared)
+                    except Exception:
+                        timer.fail()
+                        continue
+                    timer.add(prepared.length if written else 0)
+                    writer.add_reference(filename, prepared.length, prepared.checksum)
+            elif content is None or (prepared is not None and prepared.data is None):
+                # Large files are streamed from disk; format 2 ones were hashed on the pool
+                with METRICS.phase("stream") as timer:
+                    written = writer.files_written
+                    writer.add_file(filename, path, prepared)
+                    if writer.files_written == written:
+                        timer.fail()
+                    timer.add(writer.position - start, files=1)
+            else:
+                with METRICS.phase("assemble", files=1) as timer:
+                    if prepared is not None:
+                        writer.add_encoded(filename, prepared.data, prepared.checksum)
+                    else:
+                        writer.add_text(filename, content)
+                    timer.add(writer.position - start)
+            if tracker is not None:
+                tracker.advance(writer.position - start)
+
+    @staticmethod
+    def write_archive(out_path: Path, project_name: str, files: Dict[str, Path],
+                      index: bool = False,
+                      workers: int = ProjectManager.READ_WORKERS,
+                      extra_header: Sequence[str] = (),
+                      compression: Optional[str] = None,
+                      level: int = DEFAULT_COMPRESSION_LEVEL,
+                      tracker: Optional[ProgressTracker] = None,
+                      version: int = ArchiveWriter.VERSION,
+                      store: Optional[ObjectStore] = None) -> int:
+        """Stream files straight from disk into an archive, return files written
+
+        Small files are read ahead on a thread pool; large ones are streamed
+        in chunks as their turn comes. Compression defaults to the one implied
+        by the output suffix (.gz, .bz2, .xz) and is applied as a stream.
+        A tracker receives progress and may cancel between files, in which
+        case OperationCancelled is raised and nothing is left on disk. It is
+        advanced from where it stands, so callers reset it if they need to.
+        With a store the archive becomes a manifest of names and hashes,
+        without an index, and new bodies are added to the store.
+        """
+        out_path = Path(out_path)
+        tmp_path = out_path.with_name(out_path.name + ".tmp")
+        ordered = sorted(files.items())
+        if compression is None:
+            compression = ArchiveManager.compression_for(out_path)
+        if store is not None:
+            if version == 1:
+                raise ValueError("Format 1 archives can't refer to an object store")
+            relative = os.path.relpath(store.root.resolve(), out_path.resolve().parent)
+            extra_header = [*extra_header, f"# Store: {Path(relative).as_posix()}"]
+            index = False
+
+        try:
+            if compression:
+                # Compress on the fly; a compressed block can't be rolled back,
+                # so an unreadable file sends us down the staged path below
+                done = (tracker.files_done, tracker.bytes_done) if tracker is not None else None
+                try:
+                    with ArchiveManager._open_codec(tmp_path, "wb", compression, level) as handle:
+                        writer = ArchiveWriter(handle, project_name, len(files), index=index,
+                                               extra_header=extra_header, seekable=False,
+                                               version=version)
+                        ArchiveManager._write_members(writer, ordered, workers, tracker, store)
+                        with METRICS.phase("finish"):
+                            writer.finish()
+                    os.replace(tmp_path, out_path)
+                    return writer.files_written
+                except UnreadableFileError:
+                    if tracker is not None:
+                        # Take back the progress of the abandoned attempt
+                        tracker.files_done, tracker.bytes_done = done
+
+            with open(tmp_path, "wb", buffering=ArchiveWriter.BUFFER_SIZE) as handle:
+                writer = ArchiveWriter(handle, project_name, len(files), index=index,
+                                       extra_header=extra_header, version=version)
+                ArchiveManager._write_members(writer, ordered, workers, tracker, store)
+                if writer.files_written == len(files):
+                    with METRICS.phase("finish"):
+                        writer.finish()
+
+            # Unreadable files were rolled back, so the header count is stale
+            if writer.files_written != len(files):
+                with METRICS.phase("rewrite_header", nbytes=writer.position):
+                    ArchiveManager._rewrite_header(tmp_path, writer)
+
+            if compression:
+                with METRICS.phase("compress", nbytes=writer.position):
+                    ArchiveManager._compress_file(tmp_path, out_path, compression, level)
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, out_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        return writer.files_written
+
+    @staticmethod
+    def _compress_file(src_path: Path, out_path: Path, compression: str, level: int):
+        """Stream-compress a finished archive into place"""
+        part_path = out_path.with_name(out_path.name + ".part")
+        try:
+            with open(src_path, "rb") as src, \
+                    ArchiveManager._open_codec(part_path, "wb", compression, level) as dst:
+                shutil.copyfileobj(src, dst, ArchiveWriter.BUFFER_SIZE)
+            os.replace(part_path, out_path)
+        except BaseException:
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            raise
+
+    @staticmethod
+    def _rewrite_header(path: Path, old_writer: ArchiveWriter):
+        """Rewrite an archive with a corrected file count in its header"""
+        fixed_path = path.with_name(path.name + ".fix")
+        try:
+            with open(path, "rb") as src, \
+                    open(fixed_path, "wb", buffering=ArchiveWriter.BUFFER_SIZE) as dst:
+                writer = ArchiveWriter(dst, old_writer.project_name, old_writer.files_written,
+                                       newline=old_writer.newline,
+                                       index=old_writer.entries is not None,
+                                       extra_header=old_writer.extra_header,
+                                       version=old_writer.version)
+                src.seek(old_writer.header_size)
+                shutil.copyfileobj(src, dst, ArchiveWriter.CHUNK_SIZE)
+
+                # Shift index entries by the change in header size
+                shift = writer.position - old_writer.header_size
+                writer.position = old_writer.position + shift
+                if old_writer.entries is not None:
+                    writer.entries = [entry._replace(offset=entry.offset + shift)
+                                      for entry in old_writer.entries]
+                writer.finish()
+            os.replace(fixed_path, path)
+        except BaseException:
+            try:
+                os.remove(fixed_path)
+            except OSError:
+                pass
+            raise
+
+    @staticmethod
+    def append_archive(path: Path, files: Dict[str, Path], deleted: Iterable[str] = (),
+                       workers: int = ProjectManager.READ_WORKERS,
+                       level: int = DEFAULT_COMPRESSION_LEVEL,
+                       tracker: Optional[ProgressTracker] = None) -> int:
+        """Add records for files, and tombstones for deleted names, to the end
+        of a format 2 archive; return files written
+
+        Nothing already in the archive is rewritten and only its header and
+        index tail are read, so the cost follows the size of the change. The
+        header's file count is left as it was, so it counts the first bundle
+        only; compacting brings it up to date.
+        An indexed archive gets a trailer for the new records that links to
+        the previous one. Compressed archives gain another compressed
+        stream. On failure the file is cut back to its previous size.
+        """
+        path = Path(path)
+        compression = ArchiveManager.detect_compression(path)
+        with ArchiveManager.open_archive(path) as handle:
+            header = ArchiveManager.read_header(handle)
+            if header.get("Format") != [str(ArchiveWriter.VERSION)]:
+                raise ValueError(f"{path.name} is an older format archive; "
+                                 "compact it before appending")
+            if header.get("Volume"):
+                raise ValueError(f"Can't append to {path.name}: it is split into volumes")
+            handle.seek(0)
+            newline = "\r\n" if handle.readline().endswith(b"\r\n") else "\n"
+            indexed = ArchiveManager.read_index(handle) is not None
+            previous_index = ArchiveManager.index_offset(handle) if indexed else None
+
+        ordered = sorted(files.items())
+        size = path.stat().st_size
+        try:
+            if compression:
+                with ArchiveManager._open_codec(path, "ab", compression, level) as handle:
+                    writer = ArchiveWriter(handle, "", len(files), newline=newline,
+                                           seekable=False, start=0)
+                    for filename in deleted:
+                        writer.add_tombstone(filename)
+                    ArchiveManager._write_members(writer, ordered, workers, tracker)
+            else:
+                with open(path, "r+b", buffering=ArchiveWriter.BUFFER_SIZE) as handle:
+                    handle.seek(size)
+                    writer = ArchiveWriter(handle, "", len(files), newline=newline,
+                                           index=indexed, start=size,
+                                           previous_index=previous_index)
+                    for filename in deleted:
+                        writer.add_tombstone(filename)
+                    ArchiveManager._write_members(writer, ordered, workers, tracker)
+                    with METRICS.phase("finish"):
+                        writer.finish()
+        except BaseException as e:
+            os.truncate(path, size)
+            if isinstance(e, UnreadableFileError):
+                raise ValueError(f"Can't read {e}; nothing was appended") from e
+            raise
+        return writer.files_written
+
+    @staticmethod
+    def compact_archive(path: Path, out_path: Optional[Path] = None,
+                        level: int = DEFAULT_COMPRESSION_LEVEL) -> int:
+        """Rewrite an archive with only the live record of each file, return files kept
+
+        Superseded records, tombstones and per-update index trailers are dropped
+        and the result is an indexed format 2 archive (a manifest keeps its
+        store and stays unindexed), so compacting also upgrades older archives.
+        A delta keeps its baseline, with deletions folded back into its header.
+        Writes over path unless out_path is given.
+        """
+        path = Path(path)
+        out_path = Path(out_path) if out_path else path
+        if out_path == path:
+            compression = ArchiveManager.detect_compression(path)
+        else:
+            compression = ArchiveManager.compression_for(out_path)
+        tmp_path = out_path.with_name(out_path.name + ".tmp")
+
+        try:
+            with ArchiveManager.open_archive(path) as src:
+                header = ArchiveManager.read_header(src)
+                if header.get("Volume"):
+                    raise ValueError(f"Can't compact {path.name}: it is split into volumes")
+                project_name = ArchiveManager.read_title(src)
+                src.seek(0)
+                newline = "\r\n" if src.readline().endswith(b"\r\n") else "\n"
+                with METRICS.phase("parse"):
+                    _, entries = ArchiveManager.list_entries(src)
+
+                live: Dict[str, ArchiveEntry] = {}
+                deleted = set(header.get("Deleted", []))
+                for entry in entries:
+                    if entry.deleted:
+                        live.pop(entry.filename, None)
+                        deleted.add(entry.filename)
+                    else:
+                        live[entry.filename] = entry
+                        deleted.discard(entry.filename)
+
+                extra_header = []
+                if header.get("Baseline"):
+                    baseline = path.parent.joinpath(*PurePosixPath(header["Baseline"][0]).parts)
+                    relative = os.path.relpath(baseline.resolve(), out_path.resolve().parent)
+                    extra_header.append(f"# Baseline: {Path(relative).as_posix()}")
+                    extra_header.extend(f"# Deleted: {filename}" for filename in sorted(deleted))
+                store = ObjectStore.for_archive(path, header)
+                if store is not None:
+                    relative = os.path.relpath(store.root.resolve(), out_path.resolve().parent)
+                    extra_header.append(f"# Store: {Path(relative).as_posix()}")
+
+                with ExitStack() as stack:
+                    if compression:
+                        handle = stack.enter_context(
+                            ArchiveManager._open_codec(tmp_path, "wb", compression, level))
+                    else:
+                        handle = stack.enter_context(
+                            open(tmp_path, "wb", buffering=ArchiveWriter.BUFFER_SIZE))
+                    writer = ArchiveWriter(handle, project_name or path.stem, len(live),
+                                           newline=newline, index=store is None,
+                                           extra_header=extra_header,
+                                           seekable=not compression)
+                    # Records are copied in archive order, so compressed input is read once
+                    for entry in sorted(live.values(), key=lambda entry: entry.offset):
+                        if entry.stored:
+                            writer.add_reference(entry.filename, entry.length, entry.checksum)
+                            continue
+                        with METRICS.phase("assemble", nbytes=entry.length, files=1):
+                            writer.add_text(entry.filename, ArchiveManager.read_entry(src, entry))
+                    with METRICS.phase("finish"):
+                        writer.finish()
+            os.replace(tmp_path, out_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        manifest = DeltaManager.manifest_path(path)
+        if out_path != path and manifest.exists():
+            shutil.copy2(manifest, DeltaManager.manifest_path(out_path))
+        return writer.files_written
+
+    @staticmethod
+    def parse_archive(archive_content: str) -> Tuple[List[str], Dict[str, str]]:
+        """Parse archive content, return file list and content"""
+        # Find first marker
+        first_marker_pos = archive_content.find("===")
+        if first_marker_pos == -1:
+            raise ValueError("No '===' marker found in the text file")
+
+        # Format 2 bodies are length-delimited and can't be split on markers
+        if "# Format: 2" in archive_content[:first_marker_pos]:
+            data = archive_content.encode("utf-8")
+            live = ArchiveManager.live_entries(ArchiveManager.scan_entries(data))
+            if any(entry.stored for entry in live.values()):
+                raise ValueError("Archive refers to an object store; open it with open_members")
+            if any(entry.volume for entry in live.values()):
+                raise ValueError("Archive is split into volumes; open it with open_members")
+            file_data = {
+                filename: data[entry.offset:entry.offset + entry.length].decode("utf-8")
+                for filename, entry in live.items()}
+            return sorted(file_data), file_data
+
+        content = archive_content[first_marker_pos:]
+        blocks = re.split(r'(?m)^=== END ===\s*$', content)
+
+        file_list = []
+        file_data = {}
+
+        for block in blocks:
+            block = block.strip()
+            if not block:
+                continue
+
+            match = re.match(r'^=== (.+?) ===\s*(.+)', block, re.DOTALL)
+            if match:
+                filename = match.group(1).strip()
+                file_content = match.group(2).rstrip()
+
+                if filename:
+                    file_list.append(filename)
+                    file_data[filename] = file_content
+
+        return sorted(file_list), file_data
+
+    @staticmethod
+    def iter_entries(handle: BinaryIO) -> Iterator[ArchiveEntry]:
+        """Scan an open binary archive line by line and yield its file entries
+
+        Bodies are never loaded: only their byte offset and length are tracked,
+        with surrounding whitespace excluded the same way parse_archive does.
+        Lines are only taken for format 2 records when the header says so.
+        """
+        position = handle.tell()
+        filename = None
+        body_start = body_end = header_end = 0
+        at_line_start = True
+        in_header = True
+        records = False
+
+        # readline() is capped so a single enormous line can't blow up memory
+        for piece in iter(partial(handle.readline, ArchiveManager.LINE_LIMIT), b""):
+            line_start = at_line_start
+            at_line_start = piece.endswith(b"\n")
+            content, content_pos = piece, position
+            position += len(piece)
+
+            if filename is None:
+                if not line_start or piece.rstrip() == ArchiveManager.END_MARKER:
+                    continue
+                if in_header and ArchiveManager.FORMAT_PATTERN.match(piece):
+                    records = True
+                record = ArchiveManager._parse_record_header(piece) if records else None
+                if record:
+                    # Format 2: jump over the body, then expect its END marker
+                    name, length, meta = record
+                    handle.seek(position + length)
+                    tail = handle.readline(ArchiveManager.LINE_LIMIT)
+                    end = handle.readline(ArchiveManager.LINE_LIMIT)
+                    ArchiveManager._check_record_end(name, tail, end)
+                    yield ArchiveManager._record_entry(name, position, length, meta)
+                    position += length + len(tail) + len(end)
+                    at_line_start = True
+                    continue
+                match = ArchiveManager.HEADER_PATTERN.match(piece)
+                if not match:
+                    continue
+                in_header = False
+                filename = match.group(1).strip().decode("utf-8", errors="replace")
+                body_start = None
+                header_end = position
+                content, content_pos = piece[match.end():], content_pos + match.end()
+            elif line_start and piece.rstrip() == ArchiveManager.END_MARKER:
+                if filename:
+                    yield ArchiveManager._make_entry(filename, body_start, body_end, header_end)
+                filename = None
+                continue
+
+            # Track the first and last non-whitespace byte of the body
+            stripped = content.lstrip()
+            if stripped:
+                if body_start is None:
+                    body_start = content_pos + len(content) - len(stripped)
+                body_end = content_pos + len(content.rstrip())
+
+        # A trailing block without an END marker still counts, as in parse_archive
+        if filename:
+            yield ArchiveManager._make_entry(filename, body_start, body_end, header_end)
+
+    @staticmethod
+    def _parse_record_header(line: bytes) -> Optional[Tuple[str, int, Dict[str, str]]]:
+        """Split a format 2 header line into (filename, length, meta), None for format 1"""
+        match = ArchiveManager.RECORD_PATTERN.match(line)
+        if not match:
+            return None
+        meta = dict(token.split("=", 1) for token in match.group(3).decode("ascii").split())
+        return match.group(1).strip().decode("utf-8", errors="replace"), int(match.group(2)), meta
+
+    @staticmethod
+    def _record_entry(filename: str, offset: int, length: int,
+                      meta: Dict[str, str]) -> ArchiveEntry:
+        """Entry for a format 2 record; a stored one's length is its object's size"""
+        if meta.get("stored") == "1":
+            return ArchiveEntry(filename, offset, int(meta.get("size", 0)),
+                                meta.get("sha256", ""), stored=True)
+        if "volume" in meta:
+            return ArchiveEntry(filename, offset, 0, volume=int(meta["volume"]))
+        return ArchiveEntry(filename, offset, length, meta.get("sha256", ""),
+                            meta.get("deleted") == "1")
+
+    @staticmethod
+    def _check_record_end(filename: str, tail: bytes, end: bytes):
+        """Raise unless a format 2 body is followed by a newline and its END marker"""
+        if tail not in (b"\n", b"\r\n") or end.rstrip() != ArchiveManager.END_MARKER:
+            raise ValueError(f"Archive is corrupt or truncated after {filename}")
+
+    @staticmethod
+    def live_entries(entries: Iterable[ArchiveEntry],
+                     tombstones: bool = False) -> Dict[str, ArchiveEntry]:
+        """Replay entries in archive order: the last record for a name wins
+
+        A tombstone removes the name, or replaces its entry when tombstones
+        is set (deletions an index must still carry for layered archives).
+        """
+        live: Dict[str, ArchiveEntry] = {}
+        for entry in entries:
+            if entry.deleted and not tombstones:
+                live.pop(entry.filename, None)
+            else:
+                live[entry.filename] = entry
+        return live
+
+    @staticmethod
+    def _make_entry(filename: str, body_start: Optional[int], body_end: int,
+                    header_end: int) -> ArchiveEntry:
+        """Build an entry from tracked body boundaries"""
+        if body_start is None:
+            return ArchiveEntry(filename, header_end, 0)
+        return ArchiveEntry(filename, body_start, body_end - body_start)
+
+    @staticmethod
+    def _find_line(buffer, prefix: bytes, pos: int) -> int:
+        """Offset of the next line at or after pos that starts with prefix, or -1"""
+        if (pos == 0 or buffer[pos - 1:pos] == b"\n") and buffer[pos:pos + len(prefix)] == prefix:
+            return pos
+        found = buffer.find(b"\n" + prefix, pos)
+        return found + 1 if found >= 0 else -1
+
+    @staticmethod
+    def _line_end(buffer, pos: int) -> int:
+        """Offset just past the newline ending the line at pos"""
+        found = buffer.find(b"\n", pos)
+        return found + 1 if found >= 0 else len(buffer)
+
+    @staticmethod
+    def scan_entries(buffer) -> Iterator[ArchiveEntry]:
+        """Find file entries in an in-memory or mapped archive by marker search
+
+        Gives the same entries as iter_entries, but jumps between marker
+        lines with find(), so bodies are never walked line by line.
+        """
+        find_line, line_end = ArchiveManager._find_line, ArchiveManager._line_end
+        end_marker = ArchiveManager.END_MARKER
+        size = len(buffer)
+        pos = 0
+        first = find_line(buffer, b"=== ", 0)
+        records = ArchiveManager.FORMAT_PATTERN.search(buffer[:max(first, 0)]) is not None
+
+        while True:
+            line = find_line(buffer, b"=== ", pos)
+            if line < 0:
+                return
+            pos = line_end(buffer, line)
+            text = buffer[line:pos]
+            record = ArchiveManager._parse_record_header(text) if records else None
+            if record:
+                name, length, meta = record
+                tail_end = line_end(buffer, min(pos + length, size))
+                end_end = line_end(buffer, tail_end)
+                ArchiveManager._check_record_end(
+                    name, buffer[pos + length:tail_end] if pos + length <= size else b"",
+                    buffer[tail_end:end_end])
+                yield ArchiveManager._record_entry(name, pos, length, meta)
+                pos = end_end
+                continue
+            match = ArchiveManager.HEADER_PATTERN.match(text)
+            if not match or text.rstrip() == end_marker:
+                continue
+            filename = match.group(1).strip().decode("utf-8", errors="replace")
+            header_end = pos
+
+            # The block runs to the next line that is exactly an END marker
+            search, body_limit = pos, size
+            while True:
+                marker = find_line(buffer, end_marker, search)
+                if marker < 0:
+                    break
+                search = line_end(buffer, marker)
+                if buffer[marker:search].rstrip() == end_marker:
+                    body_limit = marker
+                    break
+
+            # Trim surrounding whitespace without copying the body
+            body_start, body_end = line + match.end(), body_limit
+            while body_start < body_end and buffer[body_start] in b" \t\n\r\x0b\x0c":
+                body_start += 1
+            while body_end > body_start and buffer[body_end - 1] in b" \t\n\r\x0b\x0c":
+                body_end -= 1
+            if filename:
+                yield ArchiveManager._make_entry(
+                    filename, body_start if body_end > body_start else None, body_end, header_end)
+            if body_limit == size:
+                return
+            pos = search
+
+    @staticmethod
+    def map_archive(handle: BinaryIO) -> Optional[mmap.mmap]:
+        """Memory-map an uncompressed archive read-only, None if it can't be"""
+        if ArchiveManager.is_compressed(handle):
+            return None
+        try:
+            return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError, io.UnsupportedOperation):
+            return None
+
+    @staticmethod
+    def _close_map(buffer: mmap.mmap):
+        """Close a mapping, leaving it to the garbage collector if slices survive"""
+        try:
+            buffer.close()
+        except BufferError:
+            pass
+
+    @staticmethod
+    def read_entry(handle: BinaryIO, entry: ArchiveEntry) -> str:
+        """Read and decode a single file body from an open archive"""
+        with METRICS.phase("decode", nbytes=entry.length, files=1):
+            handle.seek(entry.offset)
+            data = handle.read(entry.length)
+            if len(data) != entry.length:
+                raise ValueError(f"Archive is truncated inside {entry.filename}")
+            if entry.checksum and hashlib.sha256(data).hexdigest() != entry.checksum:
+                raise ValueError(f"Checksum mismatch for {entry.filename}")
+            # Match the universal newline handling of text-mode reads
+            return data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+    @staticmethod
+    def read_entry_view(buffer: mmap.mmap, entry: ArchiveEntry) -> memoryview:
+        """Slice a file body out of a mapped archive without copying it"""
+        with METRICS.phase("decode", nbytes=entry.length, files=1):
+            if entry.offset + entry.length > len(buffer):
+                raise ValueError(f"Archive is truncated inside {entry.filename}")
+            view = memoryview(buffer)[entry.offset:entry.offset + entry.length]
+            if entry.checksum and hashlib.sha256(view).hexdigest() != entry.checksum:
+                view.release()
+                raise ValueError(f"Checksum mismatch for {entry.filename}")
+            return view
+
+    @staticmethod
+    def index_offset(handle: BinaryIO) -> Optional[int]:
+        """Offset of the last table-of-contents trailer, from the archive's tail"""
+        size = handle.seek(0, io.SEEK_END)
+        handle.seek(max(0, size - ArchiveManager.INDEX_TAIL_SIZE))
+        match = ArchiveManager.INDEX_FOOTER_PATTERN.search(handle.read())
+        if not match or int(match.group(1)) >= size:
+            return None
+        return int(match.group(1))
+
+    @staticmethod
+    def read_index(handle: BinaryIO) -> Optional[List[ArchiveEntry]]:
+        """Read the table-of-contents trailer, return None if there is none
+
+        Compressed archives are never read through the index: reaching the
+        tail means decompressing everything, so a forward scan is cheaper.
+        Appended archives have one trailer per update, each pointing to
+        the one before; entries come back in archive order.
+        """
+        if ArchiveManager.is_compressed(handle):
+            return None
+        index_offset = ArchiveManager.index_offset(handle)
+
+        footer = ArchiveManager.INDEX_FOOTER.encode("utf-8")
+        previous_prefix = ArchiveManager.INDEX_PREVIOUS.encode("utf-8")
+        segments = []
+        while index_offset is not None:
+            handle.seek(index_offset)
+            header = handle.readline().decode("utf-8").rstrip()
+            if not header.startswith(ArchiveManager.INDEX_HEADER):
+                return None
+
+            entries, previous = [], None
+            for line in iter(handle.readline, b""):
+                if line.startswith(footer):
+                    break
+                if line.startswith(previous_prefix):
+                    previous = int(line[len(previous_prefix):])
+                    if previous >= index_offset:
+                        raise ValueError("Index trailers are out of order")
+                    continue
+                offset, length, checksum, filename = (
+                    line.decode("utf-8").rstrip("\r\n")[2:].split(" ", 3))
+                if int(offset) + int(length) > index_offset:
+                    raise ValueError(f"Index entry for {filename} points past the index")
+                if checksum == ArchiveManager.INDEX_TOMBSTONE:
+                    entries.append(ArchiveEntry(filename, int(offset), 0, deleted=True))
+                else:
+                    entries.append(ArchiveEntry(filename, int(offset), int(length), checksum))
+            else:
+                return None
+            segments.append(entries)
+            index_offset = previous
+
+        if not segments:
+            return None
+        return [entry for segment in reversed(segments) for entry in segment]
+
+    @staticmethod
+    def list_entries(handle: BinaryIO) -> Tuple[List[str], List[ArchiveEntry]]:
+        """Return sorted live filenames and all entries of an open archive
+
+        Archives with an index are listed from the trailer alone; others are
+        scanned through the === markers, by memory map when uncompressed.
+        Superseded records and tombstones stay in the entry list.
+        """
+        entries = ArchiveManager.read_index(handle)
+        if entries is None:
+            buffer = ArchiveManager.map_archive(handle)
+            if buffer is not None:
+                try:
+                    entries = list(ArchiveManager.scan_entries(buffer))
+                finally:
+                    buffer.close()
+            else:
+                handle.seek(0)
+                entries = list(ArchiveManager.iter_entries(handle))
+        return sorted(ArchiveManager.live_entries(entries)), entries
+
+    @staticmethod
+    def extract_member(handle: BinaryIO, filename: str) -> Optional[str]:
+        """Read one file from an open archive, seeking straight to it if indexed"""
+        entries = ArchiveManager.read_index(handle)
+        if entries is None:
+            handle.seek(0)
+            entries = ArchiveManager.iter_entries(handle)
+
+        found = None
+        for entry in entries:
+            if entry.filename == filename:
+                found = None if entry.deleted else entry
+        if found and found.stored:
+            raise ValueError(f"{filename} is in an object store; "
+                             "open the archive with open_members")
+        if found and found.volume:
+            raise ValueError(f"{filename} is in volume {found.volume}; "
+                             "open the archive with open_members")
+        return ArchiveManager.read_entry(handle, found) if found else None
+
+    @staticmethod
+    def read_title(handle: BinaryIO) -> Optional[str]:
+        """Project name from the first line of an archive, None if it isn't one"""
+        handle.seek(0)
+        first = handle.readline(ArchiveManager.LINE_LIMIT).decode("utf-8", errors="replace")
+        if not first.startswith(ArchiveManager.TITLE_PREFIX):
+            return None
+        return first[len(ArchiveManager.TITLE_PREFIX):].strip()
+
+    @staticmethod
+    def read_header(handle: BinaryIO) -> Dict[str, List[str]]:
+        """Collect "# Key: value" lines that precede the first file block"""
+        handle.seek(0)
+        header: Dict[str, List[str]] = {}
+        for line in iter(partial(handle.readline, ArchiveManager.LINE_LIMIT), b""):
+            if ArchiveManager.HEADER_PATTERN.match(line):
+                break
+            text = line.decode("utf-8", errors="replace").rstrip("\r\n")
+            key, sep, value = text[2:].partition(": ")
+            if text.startswith("# ") and sep:
+                header.setdefault(key, []).append(value)
+        return header
+
+    @staticmethod
+    def open_members(path: Path, stack: ExitStack) -> Tuple[List[str], ArchiveMembers]:
+        """Open an archive (and its baselines, for deltas) registered on stack
+
+        Returns the sorted file list and a lazy mapping of the final contents.
+        """
+        members = ArchiveMembers()
+        with METRICS.phase("parse") as timer:
+            for archive_path in DeltaManager.resolve_chain(Path(path)):
+                _, entries = ArchiveManager.add_members(members, archive_path, stack)
+                timer.add(sum(entry.length for entry in entries), files=len(entries))
+            return sorted(members), members
+
+    @staticmethod
+    def add_members(members: ArchiveMembers, archive_path: Path,
+                    stack: ExitStack) -> Tuple[Dict[str, List[str]], List[ArchiveEntry]]:
+        """Layer one archive file onto members, return its header and entries
+
+        Bodies of uncompressed archives are read from a shared mapping, and
+        those of manifest archives from their object store. A volume set's
+        volumes are layered in order; its entries only point at them.
+        """
+        handle = stack.enter_context(ArchiveManager.open_archive(archive_path))
+        header = ArchiveManager.read_header(handle)
+        _, entries = ArchiveManager.list_entries(handle)
+        if header.get("Volume"):
+            for volume_path in VolumeSet.volume_paths(archive_path, header):
+                ArchiveManager.add_members(members, volume_path, stack)
+            return header, entries
+        buffer = ArchiveManager.map_archive(handle)
+        if buffer is not None:
+            stack.callback(ArchiveManager._close_map, buffer)
+        members.add(buffer if buffer is not None else handle, entries,
+                    header.get("Deleted", []), ObjectStore.for_archive(archive_path, header))
+        return header, entries
+
+
+    @staticmethod
+    def verify_archive(path: Path, workers: int = ProjectManager.READ_WORKERS) -> VerifyResult:
+        """Check every record of an archive (and of its baselines) against its hash
+
+        Nothing is restored or decoded. Uncompressed archives are mapped and
+        their records hashed on a thread pool; the index, if any, must agree
+        with the records it points at. Compressed archives are read once,
+        front to back. Objects of manifest archives are hashed in their
+        store. Structural damage such as truncation is reported and ends the
+        check of that archive. Volume sets are checked by VolumeSet.verify.
+        """
+        if VolumeSet.volume_paths(path):
+            return VolumeSet.verify(path, workers)
+        checked = unverified = 0
+        failures = []
+        chain = DeltaManager.resolve_chain(Path(path))
+        for archive_path in chain:
+            label = f"{archive_path.name}: " if len(chain) > 1 else ""
+            with ExitStack() as stack:
+                try:
+                    handle = stack.enter_context(ArchiveManager.open_archive(archive_path))
+                    store = ObjectStore.for_archive(archive_path,
+                                                    ArchiveManager.read_header(handle))
+                    buffer = ArchiveManager.map_archive(handle)
+                    if buffer is not None:
+                        stack.callback(ArchiveManager._close_map, buffer)
+                        result = ArchiveManager._verify_mapped(handle, buffer, workers, store)
+                    else:
+                        result = ArchiveManager._verify_stream(handle, store)
+                except (OSError, EOFError, ValueError) as e:
+                    failures.append(f"{label}{e}")
+                    continue
+            checked += result.checked
+            unverified += result.unverified
+            failures.extend(label + failure for failure in result.failures)
+        return VerifyResult(checked, unverified, failures)
+
+    @staticmethod
+    def _verify_mapped(handle: BinaryIO, buffer: mmap.mmap, workers: int,
+                       store: Optional[ObjectStore] = None) -> VerifyResult:
+        """Hash the records of a mapped archive concurrently"""
+        records = [entry for entry in ArchiveManager.scan_entries(buffer) if not entry.deleted]
+        failures = []
+
+        index = ArchiveManager.read_index(handle)
+        if index is not None:
+            if ArchiveManager.read_header(handle).get("Format") == [str(ArchiveWriter.VERSION)]:
+                # Records carry their own hash; the index must point at them
+                found = set(records)
+                failures.extend(f"{entry.filename}: index doesn't match the archive"
+                                for entry in index if not entry.deleted and entry not in found)
+            else:
+                # Format 1 bodies are read through the index, which also holds their hash
+                records = [entry for entry in index if not entry.deleted]
+
+        def digest(entry: ArchiveEntry) -> Optional[str]:
+            if entry.stored:
+                return store.digest(entry.checksum) if store is not None else None
+            with memoryview(buffer) as whole:
+                with whole[entry.offset:entry.offset + entry.length] as view:
+                    return hashlib.sha256(view).hexdigest()
+
+        with METRICS.phase("verify", nbytes=sum(entry.length for entry in records),
+                           files=len(records)):
+            hashed = [entry for entry in records if entry.checksum]
+            failed = len(failures)
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                for entry, actual in zip(hashed, pool.map(digest, hashed)):
+                    ArchiveManager._check_digest(entry.filename, entry.checksum, actual, failures)
+            failed = len(failures) - failed
+        return VerifyResult(len(hashed) - failed, len(records) - len(hashed), failures)
+
+    @staticmethod
+    def _check_digest(filename: str, expected: str, actual: Optional[str], failures: List[str]):
+        """Record a failure unless actual matches; None means the object is missing"""
+        if actual is None:
+            failures.append(f"{filename}: object missing from the store")
+        elif actual != expected:
+            failures.append(f"{filename}: checksum mismatch")
+
+    @staticmethod
+    def _verify_stream(handle: BinaryIO, store: Optional[ObjectStore] = None) -> VerifyResult:
+        """Hash the records of a compressed archive in one forward pass"""
+        if ArchiveManager.read_header(handle).get("Format") != [str(ArchiveWriter.VERSION)]:
+            # Format 1 bodies carry no hash, and the index is never read when compressed
+            handle.seek(0)
+            entries = ArchiveManager.iter_entries(handle)
+            return VerifyResult(0, sum(1 for entry in entries if not entry.deleted), [])
+
+        checked = unverified = 0
+        failures = []
+        handle.seek(0)
+        with METRICS.phase("verify") as timer:
+            # Every block of a format 2 archive is a record, so lines between them are safe
+            for line in iter(partial(handle.readline, ArchiveManager.LINE_LIMIT), b""):
+                record = ArchiveManager._parse_record_header(line)
+                if record is None:
+                    continue
+                name, length, meta = record
+                digest = hashlib.sha256()
+                remaining = length
+                while remaining:
+                    data = handle.read(min(remaining, ArchiveWriter.CHUNK_SIZE))
+                    if not data:
+                        break
+                    digest.update(data)
+                    remaining -= len(data)
+                ArchiveManager._check_record_end(name, handle.readline(ArchiveManager.LINE_LIMIT),
+                                                 handle.readline(ArchiveManager.LINE_LIMIT))
+                timer.add(length, files=1)
+                if meta.get("deleted") == "1":
+                    continue
+                if "sha256" not in meta:
+                    unverified += 1
+                    continue
+                if meta.get("stored") == "1":
+                    actual = store.digest(meta["sha256"]) if store is not None else None
+                else:
+                    actual = digest.hexdigest()
+                failed = len(failures)
+                ArchiveManager._check_digest(name, meta["sha256"], actual, failures)
+                checked += len(failures) == failed
+        return VerifyResult(checked, unverified, failures)
+
+
+class VolumeSet:
+    """An archive split into size-capped volumes that are processed in parallel
+
+    Each volume is a complete indexed archive holding whole files only. The
+    archive the user names is a small format 2 index of the set: its header
+    lists the volumes ("# Volume: backup.vol001.txt") and each of its
+    records only says which volume holds a file ("=== a.py === 0 volume=1
+    ==="), so listing opens no volume and restoring some files opens only
+    theirs. Verify and restore run one volume per worker process and merge
+    the results in volume order. Everything else reads a set through
+    ArchiveManager.open_members, which layers its volumes.
+    """
+
+    RECORD_OVERHEAD = 160       # bytes of record header, end marker and index line per file
+    VOLUME_NAME = re.compile(r"(.+)\.vol\d{3,}(\.txt.*)?")
+
+    @staticmethod
+    def volume_path(out_path: Path, number: int) -> Path:
+        """Path of one volume: backup.txt.gz -> backup.vol001.txt.gz"""
+        stem, txt, rest = out_path.name.rpartition(".txt")
+        if not txt:
+            return out_path.with_name(f"{out_path.name}.vol{number:03d}")
+        return out_path.with_name(f"{stem}.vol{number:03d}.txt{rest}")
+
+    @staticmethod
+    def index_path(volume_path: Path) -> Optional[Path]:
+        """Index a volume would belong to, going by its name: backup.vol001.txt -> backup.txt"""
+        match = VolumeSet.VOLUME_NAME.fullmatch(volume_path.name)
+        if not match:
+            return None
+        return volume_path.with_name(match.group(1) + (match.group(2) or ""))
+
+    @staticmethod
+    def volume_paths(archive_path: Path,
+                     header: Optional[Dict[str, List[str]]] = None) -> List[Path]:
+        """Volumes of a volume set in order, [] for any other archive"""
+        if header is None:
+            with ArchiveManager.open_archive(archive_path) as handle:
+                header = ArchiveManager.read_header(handle)
+        return [Path(archive_path).parent.joinpath(*PurePosixPath(name).parts)
+                for name in header.get("Volume", [])]
+
+    @staticmethod
+    def entries(archive_path: Path) -> List[ArchiveEntry]:
+        """Records of a volume set's index, one per file, naming its volume"""
+        with ArchiveManager.open_archive(archive_path) as handle:
+            return ArchiveManager.list_entries(handle)[1]
+
+    @staticmethod
+    def plan(ordered: List[Tuple[str, Path]],
+             volume_size: int) -> List[List[Tuple[str, Path]]]:
+        """Split files into consecutive groups of up to volume_size bytes
+
+        Sizes are those of the uncompressed files. A file is never split,
+        so one bigger than volume_size gets a volume of its own.
+        """
+        volumes: List[List[Tuple[str, Path]]] = []
+        current: List[Tuple[str, Path]] = []
+        size = 0
+        for filename, path in ordered:
+            try:
+                length = path.stat().st_size
+            except OSError:
+                length = 0
+            length += len(filename.encode("utf-8")) + VolumeSet.RECORD_OVERHEAD
+            if current and size + length > volume_size:
+                volumes.append(current)
+                current, size = [], 0
+            current.append((filename, path))
+            size += length
+        if current:
+            volumes.append(current)
+        return volumes
+
+    @staticmethod
+    def write(out_path: Path, project_name: str, files: Dict[str, Path], volume_size: int,
+              workers: int = ProjectManager.READ_WORKERS,
+              level: int = ArchiveManager.DEFAULT_COMPRESSION_LEVEL,
+              tracker: Optional[ProgressTracker] = None) -> Tuple[int, int]:
+        """Bundle files into volumes next to out_path and the set's index at
+        out_path; return (files written, volumes)
+
+        Volumes share out_path's compression. If bundling fails or is
+        cancelled, the volumes written so far are removed.
+        """
+        out_path = Path(out_path)
+        volume_paths: List[Path] = []
+        names: List[List[str]] = []
+        try:
+            for number, group in enumerate(VolumeSet.plan(sorted(files.items()), volume_size), 1):
+                volume_path = VolumeSet.volume_path(out_path, number)
+                volume_paths.append(volume_path)
+                written = ArchiveManager.write_archive(volume_path, project_name, dict(group),
+                                                       index=True, workers=workers, level=level,
+                                                       tracker=tracker)
+                if written == len(group):
+                    names.append([filename for filename, _ in group])
+                else:
+                    # Unreadable files were left out of the volume
+                    with ArchiveManager.open_archive(volume_path) as handle:
+                        names.append(ArchiveManager.list_entries(handle)[0])
+            VolumeSet._write_index(out_path, project_name, volume_paths, names, level)
+        except BaseException:
+            for volume_path in volume_paths:
+                try:
+                    os.remove(volume_path)
+                except OSError:
+                    pass
+            raise
+        return sum(len(group) for group in names), len(volume_paths)
+
+    @staticmethod
+    def _write_index(out_path: Path, project_name: str, volume_paths: List[Path],
+                     names: List[List[str]], level: int):
+        """Write the archive that lists the volumes and which one holds each file"""
+        compression = ArchiveManager.compression_for(out_path)
+        tmp_path = out_path.with_name(out_path.name + ".tmp")
+        try:
+            with ExitStack() as stack:
+                if compression:
+                    handle = stack.enter_context(
+                        ArchiveManager._open_codec(tmp_path, "wb", compression, level))
+                else:
+                    handle = stack.enter_context(open(tmp_path, "wb"))
+                writer = ArchiveWriter(handle, project_name, sum(len(group) for group in names),
+                                       extra_header=[f"# Volume: {path.name}"
+                                                     for path in volume_paths],
+                                       seekable=not compression)
+                for number, group in enumerate(names, 1):
+                    for filename in group:
+                        writer.add_pointer(filename, number)
+            os.replace(tmp_path, out_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    @staticmethod
+    def _map(func: Callable, jobs: List[tuple], workers: Optional[int]) -> list:
+        """func(*job) for every job on a process pool, results in job order"""
+        if len(jobs) <= 1 or workers == 1:
+            return [func(*job) for job in jobs]
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1,
+                                                 len(jobs))) as pool:
+            futures = [pool.submit(func, *job) for job in jobs]
+            return [future.result() for future in futures]
+
+    @staticmethod
+    def _verify_volume(volume_path: Path) -> VerifyResult:
+        """Check one volume; runs in a worker process"""
+        try:
+            return ArchiveManager.verify_archive(volume_path, workers=1)
+        except (OSError, EOFError, ValueError) as e:
+            return VerifyResult(0, 0, [str(e)])
+
+    @staticmethod
+    def verify(archive_path: Path, workers: Optional[int] = None) -> VerifyResult:
+        """Check every volume of a set against its hashes, one per worker process
+
+        A volume that doesn't hold as many files as the index says is
+        reported too.
+        """
+        volume_paths = VolumeSet.volume_paths(archive_path)
+        expected: Dict[int, int] = {}
+        for entry in VolumeSet.entries(archive_path):
+            expected[entry.volume] = expected.get(entry.volume, 0) + 1
+        results = VolumeSet._map(VolumeSet._verify_volume,
+                                 [(path,) for path in volume_paths], workers)
+
+        checked = unverified = 0
+        failures = []
+        for number, (volume_path, result) in enumerate(zip(volume_paths, results), 1):
+            checked += result.checked
+            unverified += result.unverified
+            failures.extend(f"{volume_path.name}: {failure}" for failure in result.failures)
+            found = result.checked + result.unverified
+            if not result.failures and found != expected.get(number, 0):
+                failures.append(f"{volume_path.name}: holds {found} files, "
+                                f"the volume index lists {expected.get(number, 0)}")
+        return VerifyResult(checked, unverified, failures)
+
+    @staticmethod
+    def _restore_volume(volume_path: Path, target: Path, filenames: List[str]) -> RestoreStats:
+        """Restore some files of one volume; runs in a worker process"""
+        with ExitStack() as stack:
+            members = ArchiveMembers()
+            ArchiveManager.add_members(members, volume_path, stack)
+            return ProjectManager(target).restore_members(members, filenames)
+
+    @staticmethod
+    def restore(archive_path: Path, target: Path, filenames: Iterable[str],
+                workers: Optional[int] = None) -> RestoreStats:
+        """Restore files of a volume set into target, one volume per worker process
+
+        Only the volumes holding the named files are opened; names the set
+        doesn't hold are ignored.
+        """
+        volume_paths = VolumeSet.volume_paths(archive_path)
+        wanted = set(filenames)
+        groups: Dict[int, List[str]] = {}
+        for entry in VolumeSet.entries(archive_path):
+            if entry.filename in wanted:
+                if not 1 <= entry.volume <= len(volume_paths):
+                    raise ValueError(f"{entry.filename} is in volume {entry.volume}, "
+                                     f"but the archive lists {len(volume_paths)}")
+                groups.setdefault(entry.volume, []).append(entry.filename)
+        jobs = [(volume_paths[number - 1], Path(target), names)
+                for number, names in sorted(groups.items())]
+        for volume_path, _, _ in jobs:
+            if not volume_path.exists():
+                raise FileNotFoundError(f"Volume missing: {volume_path}")
+
+        results = VolumeSet._map(VolumeSet._restore_volume, jobs, workers)
+        return RestoreStats(sum(stats.restored for stats in results),
+                            sum(stats.created_new for stats in results),
+                            sum(stats.unchanged for stats in results),
+                            sum(stats.errors for stats in results),
+                            any(stats.cancelled for stats in results),
+                            tuple(name for stats in results for name in stats.corrupt),
+                            RestorePipeline.merge_stages(stats.stages for stats in results),
+                            tuple(name for stats in results for name in stats.missing))
+
+
+class DeltaResult(NamedTuple):
+    """Outcome of a differential bundle"""
+    changed: List[str]
+    deleted: List[str]
+    unchanged: int
+
+
+class DeltaManager:
+    """Class for differential bundles layered on a baseline archive
+
+    A delta is a regular archive holding only changed and added files.
+    Its header names the baseline archive and lists deleted files. A
+    sidecar manifest records size, mtime and content hash for every file
+    in the resulting state, so the next delta can skip unchanged files
+    without reading them. The hash is that of the file's format 2 body,
+    so a change to whitespace at either end still counts; hashes taken
+    from format 1 archives, which strip it, are kept as "stripped_sha256".
+    """
+
+    MANIFEST_SUFFIX = ".manifest.json"
+    MAX_CHAIN = 1000
+    MANIFEST_FORMAT = 2         # manifests without it hold stripped hashes
+
+    @staticmethod
+    def manifest_path(archive_path: Path) -> Path:
+        """Sidecar manifest location for an archive"""
+        archive_path = Path(archive_path)
+        return archive_path.with_name(archive_path.name + DeltaManager.MANIFEST_SUFFIX)
+
+    @staticmethod
+    def resolve_chain(archive_path: Path) -> List[Path]:
+        """Return [baseline, delta1, ..., archive_path] following Baseline headers"""
+        chain = [Path(archive_path)]
+        while len(chain) <= DeltaManager.MAX_CHAIN:
+            with ArchiveManager.open_archive(chain[0]) as handle:
+                baseline = ArchiveManager.read_header(handle).get("Baseline")
+            if not baseline:
+                return chain
+            chain.insert(0, chain[0].parent.joinpath(*PurePosixPath(baseline[0]).parts))
+        raise ValueError("Delta chain is too long or circular")
+
+    @staticmethod
+    def load_manifest(archive_path: Path) -> Dict[str, dict]:
+        """Load an archive's manifest, deriving hashes from its contents if missing"""
+        try:
+            data = json.loads(DeltaManager.manifest_path(archive_path).read_text(encoding="utf-8"))
+            files = data["files"]
+            if data.get("format") != DeltaManager.MANIFEST_FORMAT:
+                for info in files.values():
+                    if "sha256" in info:
+                        info["stripped_sha256"] = info.pop("sha256")
+            return files
+        except (OSError, ValueError, KeyError):
+            pass
+
+        # No sidecar (e.g. a plain GUI bundle): hash what the archive holds
+        manifest = {}
+        exact: Dict[str, bool] = {}
+        with ExitStack() as stack:
+            members = ArchiveMembers()
+            for path in DeltaManager.resolve_chain(archive_path):
+                header, entries = ArchiveManager.add_members(members, path, stack)
+                version = header.get("Format") == [str(ArchiveWriter.VERSION)]
+                exact.update((entry.filename, version) for entry in entries)
+            for filename, (_, entry) in members.entries.items():
+                if not exact.get(filename):
+                    digest = ArchiveWriter.content_digest([members[filename]])
+                    manifest[filename] = {"stripped_sha256": digest}
+                elif entry.checksum:
+                    manifest[filename] = {"sha256": entry.checksum}
+                else:
+                    manifest[filename] = {"sha256": ArchiveWriter.encode_text(members[filename])[1]}
+        return manifest
+
+    @staticmethod
+    def _save_manifest(archive_path: Path, project_name: str,
+                       baseline: Optional[Path], files: Dict[str, dict]):
+        """Write the sidecar manifest next to an archive"""
+        path = DeltaManager.manifest_path(archive_path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        data = {
+            "project": project_name,
+            "created": f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S}",
+            "baseline": str(baseline) if baseline else None,
+            "format": DeltaManager.MANIFEST_FORMAT,
+            "files": files,
+        }
+        tmp_path.write_text(json.dumps(data, indent=1, sort_keys=True), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _file_digest(path: Path, content: Optional[str], stripped: bool = False) -> Optional[str]:
+        """Hash of a project file's format 2 body, streaming it if it wasn't prefetched
+
+        With stripped, the hash is the format 1 one, without surrounding whitespace.
+        """
+        with METRICS.phase("hash", files=1) as timer:
+            if content is not None:
+                timer.add(len(content))
+                if stripped:
+                    return ArchiveWriter.content_digest([content])
+                return ArchiveWriter.encode_text(content)[1]
+            try:
+                if stripped:
+                    with open(path, "r", encoding="utf-8") as src:
+                        return ArchiveWriter.content_digest(
+                            iter(partial(src.read, ArchiveWriter.CHUNK_SIZE), ""))
+                digest = hashlib.sha256()
+                for data in ArchiveWriter._file_chunks(path):
+                    digest.update(data)
+                return digest.hexdigest()
+            except Exception:
+                timer.fail()
+                return None
+
+    @staticmethod
+    def write_bundle(out_path: Path, project_manager: ProjectManager,
+                     baseline: Optional[Path] = None,
+                     level: int = ArchiveManager.DEFAULT_COMPRESSION_LEVEL,
+                     tracker: Optional[ProgressTracker] = None) -> DeltaResult:
+        """Bundle files changed since baseline (or all files) plus a manifest
+
+        Files whose size and mtime match the baseline manifest are not read
+        at all; the rest are hashed and only real changes are written.
+        """
+        old = DeltaManager.load_manifest(baseline) if baseline else {}
+        paths = {project_manager.relative_name(path): path
+                 for path in project_manager.get_py_files()}
+        changed, deleted, files = DeltaManager.diff_manifest(paths, old, tracker)
+        DeltaManager.write_delta(out_path, project_manager, paths, changed, deleted, files,
+                                 baseline, level, tracker)
+        return DeltaResult(changed, deleted, len(files) - len(changed))
+
+    @staticmethod
+    def diff_manifest(paths: Dict[str, Path], old: Dict[str, dict],
+                      tracker: Optional[ProgressTracker] = None
+                      ) -> Tuple[List[str], List[str], Dict[str, dict]]:
+        """Compare current files with an old manifest: (changed, deleted, new manifest)
+
+        Files whose size and mtime match are taken from the old manifest
+        without being read; the rest are hashed. Entries with only a
+        stripped hash are always hashed again, and compared by that hash.
+        """
+        files: Dict[str, dict] = {}
+        to_hash = []
+        for filename, path in sorted(paths.items()):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            info = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            previous = old.get(filename)
+            if (previous and "sha256" in previous and previous.get("size") == info["size"]
+                    and previous.get("mtime_ns") == info["mtime_ns"]):
+                files[filename] = previous
+            else:
+                files[filename] = info
+                to_hash.append(filename)
+
+        changed = []
+        contents = ProjectManager.prefetch_files([paths[name] for name in to_hash])
+        for filename, (path, content) in zip(to_hash, contents):
+            if tracker is not None:
+                tracker.check_cancel()
+            digest = DeltaManager._file_digest(path, content)
+            previous = old.get(filename)
+            if digest is None:
+                # Unreadable now: keep whatever the baseline had
+                if previous:
+                    files[filename] = previous
+                else:
+                    del files[filename]
+                continue
+            files[filename]["sha256"] = digest
+            if previous and "sha256" not in previous and "stripped_sha256" in previous:
+                # From a format 1 baseline, which can only tell stripped contents apart
+                if (DeltaManager._file_digest(path, content, stripped=True)
+                        != previous["stripped_sha256"]):
+                    changed.append(filename)
+            elif not previous or previous.get("sha256") != digest:
+                changed.append(filename)
+
+        deleted = sorted(set(old) - set(files))
+        return changed, deleted, files
+
+    @staticmethod
+    def write_delta(out_path: Path, project_manager: ProjectManager, paths: Dict[str, Path],
+                    changed: List[str], deleted: List[str], files: Dict[str, dict],
+                    baseline: Optional[Path] = None,
+                    level: int = ArchiveManager.DEFAULT_COMPRESSION_LEVEL,
+                    tracker: Optional[ProgressTracker] = None):
+        """Write the changed files as an archive on baseline, plus its manifest"""
+        out_path = Path(out_path)
+        extra_header = []
+        if baseline:
+            relative = os.path.relpath(Path(baseline).resolve(), out_path.resolve().parent)
+            extra_header.append(f"# Baseline: {Path(relative).as_posix()}")
+            extra_header.extend(f"# Deleted: {filename}" for filename in deleted)
+
+        project_name = project_manager.project_dir.name
+        if tracker is not None:
+            tracker.files_total = len(changed)
+            tracker.reset()
+        ArchiveManager.write_archive(
+            out_path, project_name, {filename: paths[filename] for filename in changed},
+            index=True, extra_header=extra_header, level=level, tracker=tracker
+        )
+        DeltaManager._save_manifest(out_path, project_name, baseline, files)
+
+    @staticmethod
+    def append_bundle(archive_path: Path, project_manager: ProjectManager,
+                      level: int = ArchiveManager.DEFAULT_COMPRESSION_LEVEL,
+                      tracker: Optional[ProgressTracker] = None) -> DeltaResult:
+        """Append files changed since an archive was last updated to the archive itself
+
+        Like write_bundle on that archive as baseline, but instead of a new
+        delta the changes are added in place as superseding records and
+        tombstones, and the archive's manifest moves to the new state.
+        """
+        old = DeltaManager.load_manifest(archive_path)
+        paths = {project_manager.relative_name(path): path
+                 for path in project_manager.get_py_files()}
+        changed, deleted, files = DeltaManager.diff_manifest(paths, old, tracker)
+        DeltaManager.append_changes(archive_path, project_manager, paths, changed, deleted, files,
+                                    level, tracker)
+        return DeltaResult(changed, deleted, len(files) - len(changed))
+
+    @staticmethod
+    def append_changes(archive_path: Path, project_manager: ProjectManager,
+                       paths: Dict[str, Path], changed: List[str], deleted: List[str],
+                       files: Dict[str, dict],
+                       level: int = ArchiveManager.DEFAULT_COMPRESSION_LEVEL,
+                       tracker: Optional[ProgressTracker] = None):
+        """Append the changed files and deletions to an archive, and update its manifest"""
+        archive_path = Path(archive_path)
+        if changed or deleted:
+            if tracker is not None:
+                tracker.files_total = len(changed)
+                tracker.reset()
+            ArchiveManager.append_archive(
+                archive_path, {filename: paths[filename] for filename in changed}, deleted,
+                level=level, tracker=tracker)
+        chain = DeltaManager.resolve_chain(archive_path)
+        DeltaManager._save_manifest(archive_path, project_manager.project_dir.name,
+                                    chain[-2] if len(chain) > 1 else None, files)
+
+
+class DiffResult:
+    """Added, removed, modified and identical files between two sides
+
+    "Old" is what is there now (a project folder or the first archive) and
+    "new" is the archive being compared. Diffs are built only on request.
+    """
+
+    STATUSES = ("added", "removed", "modified", "identical")
+
+    def __init__(self, old_text: Callable[[str], Optional[str]],
+                 new_text: Callable[[str], Optional[str]],
+                 labels: Tuple[str, str] = ("a", "b")):
+        self.old_text = old_text
+        self.new_text = new_text
+        self.labels = labels
+        self.added: List[str] = []
+        self.removed: List[str] = []
+        self.modified: List[str] = []
+        self.identical: List[str] = []
+        self._status: Dict[str, str] = {}
+
+    def add(self, filename: str, status: str):
+        getattr(self, status).append(filename)
+        self._status[filename] = status
+
+    def status(self, filename: str) -> Optional[str]:
+        return self._status.get(filename)
+
+    def unified_diff(self, filename: str, context: int = 3) -> Iterator[str]:
+        """Unified diff lines for one file, decoded and diffed only now"""
+        status = self._status.get(filename)
+        if status == "identical":
+            return iter(())
+        old = self.old_text(filename) if status != "added" else ""
+        new = self.new_text(filename) if status != "removed" else ""
+        return difflib.unified_diff(
+            (old or "").splitlines(True), (new or "").splitlines(True),
+            f"{self.labels[0]}/{filename}", f"{self.labels[1]}/{filename}", n=context)
+
+
+class DiffManager:
+    """Compares archives with each other or with a project folder
+
+    Files are matched by content hash of their text without surrounding
+    whitespace, the same way delta manifests are. Where no carriage
+    returns are involved the hash is taken from raw bytes or the archive
+    index, so identical files are never decoded, and a size mismatch
+    settles the comparison without reading either side.
+    """
+
+    @staticmethod
+    def _raw_span(members: ArchiveMembers, filename: str) -> Optional[Tuple[int, int]]:
+        """Offsets of a member's stripped text in its mapping, if raw bytes will do
+
+        None when the member isn't mapped, holds carriage returns, or ends in
+        a non-ASCII character that str.rstrip might treat as whitespace.
+        """
+        handle, entry = members.entries[filename]
+        start, end = entry.offset, entry.offset + entry.length
+        if not isinstance(handle, mmap.mmap) or handle.find(b"\r", start, end) >= 0:
+            return None
+        whitespace = b" \t\n\x0b\x0c"
+        while end > start and handle[end - 1] in whitespace:
+            end -= 1
+        if end > start and handle[end - 1] >= 0x80:
+            return None
+        while start < end and handle[start] in whitespace:
+            start += 1
+        return start, end
+
+    @staticmethod
+    def member_digest(members: ArchiveMembers, filename: str) -> str:
+        """Content hash of an archive member, from the index or raw bytes when possible"""
+        handle, entry = members.entries[filename]
+        span = DiffManager._raw_span(members, filename)
+        if span is None:
+            return ArchiveWriter.content_digest([members[filename]])
+        if entry.checksum and span == (entry.offset, entry.offset + entry.length):
+            return entry.checksum
+        with memoryview(handle) as view:
+            return hashlib.sha256(view[span[0]:span[1]]).hexdigest()
+
+    @staticmethod
+    def file_digest(path: Path) -> Optional[str]:
+        """Content hash of a file on disk, without decoding it when possible"""
+        with METRICS.phase("hash", files=1) as timer:
+            try:
+                data = path.read_bytes()
+            except OSError:
+                timer.fail()
+                return None
+            timer.add(len(data))
+            if b"\r" not in data:
+                stripped = data.rstrip()
+                # str.rstrip would also drop non-ASCII spaces, so only trust an ASCII tail
+                if not stripped or stripped[-1] < 0x80:
+                    return hashlib.sha256(stripped.lstrip()).hexdigest()
+            try:
+                text = data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+            except UnicodeDecodeError:
+                timer.fail()
+                return None
+            return ArchiveWriter.content_digest([text])
+
+    @staticmethod
+    def file_checksums(path: Path) -> Set[str]:
+        """Hashes an archive body holding this file could carry, empty if unreadable
+
+        A format 2 body is the whole text with "\\n" line endings; a format 1
+        body is the stripped text with either line ending.
+        """
+        with METRICS.phase("hash", files=1) as timer:
+            try:
+                data = path.read_bytes()
+                timer.add(len(data))
+                text = ArchiveWriter._normalize_newlines(data.decode("utf-8"))
+            except (OSError, UnicodeDecodeError):
+                timer.fail()
+                return set()
+            stripped = text.rstrip().encode("utf-8").lstrip()
+            return {hashlib.sha256(body).hexdigest()
+                    for body in (text.encode("utf-8"), stripped,
+                                 stripped.replace(b"\n", b"\r\n"))}
+
+    @staticmethod
+    def compare_file(members: ArchiveMembers, project_manager: ProjectManager,
+                     filename: str) -> str:
+        """Status of one archive member against the project: added, modified or identical
+
+        Members with a checksum are compared by it, so they are never read
+        or decoded, whether compressed or in an object store.
+        """
+        size = project_manager.file_size(filename)
+        if size is None:
+            return "added"
+        checksum = members.entries[filename][1].checksum
+        if checksum:
+            path = project_manager._resolve(filename)
+            return "identical" if checksum in DiffManager.file_checksums(path) else "modified"
+        span = DiffManager._raw_span(members, filename)
+        if span is not None and size < span[1] - span[0]:
+            return "modified"
+        digest = DiffManager.file_digest(project_manager._resolve(filename))
+        if digest is None or digest != DiffManager.member_digest(members, filename):
+            return "modified"
+        return "identical"
+
+    @staticmethod
+    def compare_directory(members: ArchiveMembers, project_manager: ProjectManager,
+                          filenames: Optional[Iterable[str]] = None) -> DiffResult:
+        """Compare archive members with the project folder
+
+        With no filenames, every member is compared and project files missing
+        from the archive are reported as removed.
+        """
+        result = DiffResult(project_manager.read_file, members.__getitem__,
+                            (project_manager.project_dir.name, "archive"))
+        names = sorted(members) if filenames is None else list(filenames)
+        for filename in names:
+            result.add(filename, DiffManager.compare_file(members, project_manager, filename))
+        if filenames is None:
+            for path in project_manager.get_py_files():
+                filename = project_manager.relative_name(path)
+                if filename not in members:
+                    result.add(filename, "removed")
+        return result
+
+    @staticmethod
+    def compare_archives(old: ArchiveMembers, new: ArchiveMembers,
+                         labels: Tuple[str, str] = ("a", "b")) -> DiffResult:
+        """Compare the members of two archives"""
+        result = DiffResult(old.__getitem__, new.__getitem__, labels)
+        for filename in sorted(set(old) | set(new)):
+            if filename not in old:
+                result.add(filename, "added")
+            elif filename not in new:
+                result.add(filename, "removed")
+            else:
+                old_span = DiffManager._raw_span(old, filename)
+                new_span = DiffManager._raw_span(new, filename)
+                if (old_span is not None and new_span is not None
+                        and old_span[1] - old_span[0] != new_span[1] - new_span[0]):
+                    result.add(filename, "modified")
+                elif (DiffManager.member_digest(old, filename)
+                      == DiffManager.member_digest(new, filename)):
+                    result.add(filename, "identical")
+                else:
+                    result.add(filename, "modified")
+        return result
+
+
+class ProjectWatcher:
+    """Keeps a rolling archive of a project current by polling for changes
+
+    The first round writes a full bundle (or, if out_path already exists,
+    a delta on top of it). Every later round writes only changed and
+    deleted files as a delta whose baseline is the previous archive, kept
+    under a numbered name, so out_path always holds the latest state.
+    Polling stats folders and known files only, and slows down while the
+    project is idle; bursts of saves are debounced into one round. After
+    max_deltas rounds the chain is folded into a fresh full bundle.
+
+    With append set, rounds add their changes to out_path itself instead
+    of starting a new delta, and the full bundle after max_deltas rounds
+    doubles as compaction.
+    """
+
+    POLL_INTERVAL = 0.5
+    IDLE_INTERVAL = 5.0
+    DEBOUNCE = 1.0
+    MAX_DELTAS = 100
+
+    def __init__(self, project_manager: ProjectManager, out_path: Path,
+                 level: int = ArchiveManager.DEFAULT_COMPRESSION_LEVEL,
+                 debounce: float = DEBOUNCE, max_deltas: int = MAX_DELTAS,
+                 on_round: Optional[Callable[[DeltaResult], None]] = None,
+                 append: bool = False):
+        self.project_manager = project_manager
+        self.out_path = Path(out_path)
+        self.level = level
+        self.debounce = debounce
+        self.max_deltas = max(1, min(max_deltas, DeltaManager.MAX_CHAIN - 1))
+        self.on_round = on_round
+        self.append = append
+        self.appended = 0
+
+        # folder path -> (relative prefix, mtime_ns); name -> (path, size, mtime_ns)
+        self.folders: Dict[str, Tuple[str, int]] = {}
+        self.files: Dict[str, Tuple[Path, int, int]] = {}
+        self.dirty = True
+        self.last_change = 0.0
+        self.manifest: Optional[Dict[str, dict]] = None
+
+        name = self.out_path.name
+        suffixes = 2 if ArchiveManager.compression_for(self.out_path) else 1
+        parts = name.split(".")
+        if len(parts) > suffixes:
+            self._stem = ".".join(parts[:-suffixes])
+            self._suffix = "." + ".".join(parts[-suffixes:])
+        else:
+            self._stem, self._suffix = name, ""
+        self._generation_pattern = re.compile(
+            re.escape(self._stem) + r"\.\d{4,}" + re.escape(self._suffix))
+
+        self._add_tree(str(project_manager.project_dir), "")
+
+    def _generation_path(self, number: int) -> Path:
+        return self.out_path.with_name(f"{self._stem}.{number:04d}{self._suffix}")
+
+    def _add_tree(self, directory: str, prefix: str):
+        """Start tracking a folder and everything below it"""
+        stack = [(directory, prefix)]
+        while stack:
+            directory, prefix = stack.pop()
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                continue
+            listing = self.project_manager.scan_folder(directory, prefix)
+            if listing is None:
+                continue
+            self.folders[directory] = (prefix, mtime)
+            files, subfolders = listing
+            for relative, entry in files:
+                self._track(relative, Path(entry.path))
+            stack.extend(subfolders)
+
+    def _track(self, relative: str, path: Path) -> bool:
+        """Record a file's size and mtime, returning True if they changed"""
+        try:
+            stat = path.stat()
+        except OSError:
+            return self.files.pop(relative, None) is not None
+        known = self.files.get(relative)
+        self.files[relative] = (path, stat.st_size, stat.st_mtime_ns)
+        return known is None or known[1:] != (stat.st_size, stat.st_mtime_ns)
+
+    def _drop_tree(self, prefix: str):
+        """Stop tracking a folder and everything below it"""
+        for directory in [d for d, (p, _) in self.folders.items() if p.startswith(prefix)]:
+            del self.folders[directory]
+        for relative in [name for name in self.files if name.startswith(prefix)]:
+            del self.files[relative]
+
+    def _rescan_folder(self, directory: str, prefix: str) -> bool:
+        """Sync one folder whose listing changed, returning True if files did"""
+        listing = self.project_manager.scan_folder(directory, prefix)
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            listing = None
+        if listing is None:
+            before = len(self.files)
+            self._drop_tree(prefix)
+            if not prefix:
+                self.folders[directory] = ("", 0)
+            return len(self.files) != before
+
+        self.folders[directory] = (prefix, mtime)
+        files, subfolders = listing
+        changed = False
+        current = {relative for relative, _ in files}
+        for relative in [name for name in self.files if name.startswith(prefix)
+                         and "/" not in name[len(prefix):] and name not in current]:
+            del self.files[relative]
+            changed = True
+        for relative, entry in files:
+            changed |= self._track(relative, Path(entry.path))
+
+        known = {p for p, _ in self.folders.values()
+                 if p != prefix and p.startswith(prefix) and "/" not in p[len(prefix):-1]}
+        present = {sub_prefix for _, sub_prefix in subfolders}
+        for sub_prefix in known - present:
+            self._drop_tree(sub_prefix)
+            changed = True
+        for sub_path, sub_prefix in subfolders:
+            if sub_prefix not in known:
+                before = len(self.files)
+                self._add_tree(sub_path, sub_prefix)
+                changed |= len(self.files) != before
+        return changed
+
+    def poll(self) -> bool:
+        """Look for changes once, returning True if any were found
+
+        A folder's mtime only moves when entries are added, removed or
+        renamed, so only those folders are listed again; files edited in
+        place are caught by their own size and mtime.
+        """
+        changed = False
+        for directory, (prefix, mtime) in list(self.folders.items()):
+            if directory not in self.folders:
+                continue  # dropped along with a parent folder this round
+            try:
+                current = os.stat(directory).st_mtime_ns
+            except OSError:
+                current = None
+            if current != mtime:
+                changed |= self._rescan_folder(directory, prefix)
+
+        for relative, (path, size, mtime) in list(self.files.items()):
+            changed |= self._track(relative, path)
+
+        if changed:
+            self.dirty = True
+            self.last_change = time.monotonic()
+        return changed
+
+    def bundle(self) -> DeltaResult:
+        """Write one round: a full bundle or a delta on the previous archive
+
+        Rounds where nothing really changed (only mtimes moved) write nothing.
+        """
+        project_manager = self.project_manager
+        paths = {relative: path for relative, (path, _, _) in self.files.items()}
+        chain = DeltaManager.resolve_chain(self.out_path) if self.out_path.exists() else []
+        if chain and self.append and self.appended == 0:
+            # Only archives in the current format can be appended to
+            with ArchiveManager.open_archive(self.out_path) as handle:
+                if ArchiveManager.read_header(handle).get("Format") != [str(ArchiveWriter.VERSION)]:
+                    self.appended = self.max_deltas
+
+        if chain and self.append and self.appended < self.max_deltas:
+            if self.manifest is None:
+                self.manifest = DeltaManager.load_manifest(self.out_path)
+            changed, deleted, files = DeltaManager.diff_manifest(paths, self.manifest)
+            if changed or deleted:
+                DeltaManager.append_changes(self.out_path, project_manager, paths, changed,
+                                            deleted, files, self.level)
+                self.appended += 1
+        elif chain and not self.append and len(chain) <= self.max_deltas:
+            if self.manifest is None:
+                self.manifest = DeltaManager.load_manifest(self.out_path)
+            changed, deleted, files = DeltaManager.diff_manifest(paths, self.manifest)
+            if changed or deleted:
+                number = 1
+                while self._generation_path(number).exists():
+                    number += 1
+                previous = self._generation_path(number)
+                # Keep the current archive under a numbered name; out_path is replaced atomically
+                try:
+                    os.link(self.out_path, previous)
+                except OSError:
+                    shutil.copy2(self.out_path, previous)
+                manifest = DeltaManager.manifest_path(self.out_path)
+                if manifest.exists():
+                    shutil.copy2(manifest, DeltaManager.manifest_path(previous))
+                DeltaManager.write_delta(self.out_path, project_manager, paths, changed, deleted,
+                                         files, previous, self.level)
+        else:
+            changed, deleted, files = DeltaManager.diff_manifest(paths, {})
+            DeltaManager.write_delta(self.out_path, project_manager, paths, changed, [], files,
+                                     None, self.level)
+            self.appended = 0
+            # The old chain is no longer referenced; drop the numbered archives we made
+            for path in chain[:-1]:
+                if self._generation_pattern.fullmatch(path.name):
+                    for stale in (path, DeltaManager.manifest_path(path)):
+                        try:
+                            os.remove(stale)
+                        except OSError:
+                            pass
+
+        self.manifest = files
+        self.dirty = False
+        result = DeltaResult(changed, deleted, len(files) - len(changed))
+        if self.on_round and (changed or deleted or not chain):
+            self.on_round(result)
+        return result
+
+    def run(self, stop_event: Optional[threading.Event] = None):
+        """Poll and bundle until stop_event is set; pending changes are flushed"""
+        stop_event = stop_event or threading.Event()
+        interval = self.POLL_INTERVAL
+        try:
+            while not stop_event.is_set():
+                if self.poll():
+                    interval = self.POLL_INTERVAL
+                elif not self.dirty:
+                    interval = min(interval * 1.5, self.IDLE_INTERVAL)
+                if self.dirty and time.monotonic() - self.last_change >= self.debounce:
+                    self.bundle()
+                stop_event.wait(interval)
+        finally:
+            if self.dirty:
+                self.bundle()
+
+
+class BatchResult(NamedTuple):
+    """Outcome of bundling one project in a batch"""
+    project: Path
+    archive: Path
+    files: int
+    seconds: float
+    error: Optional[str] = None
+
+
+class BatchBundler:
+    """Bundles many projects concurrently, one archive each, on a process pool
+
+    Every project runs in its own worker and reports its own errors, so a
+    slow or broken project only holds up one worker. If a worker process
+    dies, the projects it took down with the pool are retried one by one.
+    """
+
+    @staticmethod
+    def find_projects(parent: Path) -> List[Path]:
+        """Immediate subfolders of parent, skipping hidden and pruned ones"""
+        projects = []
+        with os.scandir(parent) as it:
+            for entry in it:
+                if (entry.is_dir() and not entry.name.startswith(".")
+                        and entry.name not in ProjectManager.PRUNED_DIRS):
+                    projects.append(Path(entry.path))
+        return sorted(projects)
+
+    @staticmethod
+    def archive_paths(projects: Sequence[Path], out_dir: Path,
+                      suffix: str = ".txt") -> Dict[Path, Path]:
+        """Pick one archive path per project, numbering clashing folder names"""
+        now = datetime.datetime.now()
+        paths, used = {}, set()
+        for project in projects:
+            base = f"{project.name}_{now:%Y-%m-%d_%H-%M}"
+            name, number = base, 1
+            while name in used:
+                number += 1
+                name = f"{base}_{number}"
+            used.add(name)
+            paths[project] = Path(out_dir) / (name + suffix)
+        return paths
+
+    @staticmethod
+    def bundle_project(project: Path, out_path: Path,
+                       include: Sequence[str] = ProjectManager.DEFAULT_INCLUDE,
+                       exclude: Sequence[str] = (), index: bool = True,
+                       level: int = ArchiveManager.DEFAULT_COMPRESSION_LEVEL) -> BatchResult:
+        """Bundle one project; runs in a worker process and never raises"""
+        started = time.perf_counter()
+        files = 0
+        try:
+            if not Path(project).is_dir():
+                raise ValueError(f"not a folder: {project}")
+            project_manager = ProjectManager(Path(project), include=include, exclude=exclude)
+            paths = project_manager.get_py_files()
+            if not paths:
+                raise ValueError("no matching files")
+            files = ArchiveManager.write_archive(
+                out_path, project_manager.project_dir.name,
+                {project_manager.relative_name(path): path for path in paths},
+                index=index, level=level)
+            error = None if files == len(paths) else f"{len(paths) - files} files unreadable"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        return BatchResult(Path(project), Path(out_path), files,
+                           time.perf_counter() - started, error)
+
+    @staticmethod
+    def bundle_all(projects: Sequence[Path], out_dir: Path, workers: Optional[int] = None,
+                   suffix: str = ".txt", **options) -> Iterator[BatchResult]:
+        """Bundle projects on a process pool, yielding results as they finish
+
+        options are passed to bundle_project (include, exclude, index, level).
+        """
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        from concurrent.futures.process import BrokenProcessPool
+
+        Path(out_dir).mkdir(parents=True, exist_ok=True)
+        targets = BatchBundler.archive_paths(projects, out_dir, suffix)
+
+        def run(pool, projects):
+            """Yield results, collecting projects lost to a dead worker"""
+            futures = {pool.submit(BatchBundler.bundle_project, project, targets[project],
+                                   **options): project for project in projects}
+            for future in as_completed(futures):
+                project = futures[future]
+                try:
+                    yield future.result()
+                except BrokenProcessPool:
+                    broken.append(project)
+                except Exception as e:
+                    yield BatchResult(project, targets[project], 0, 0.0,
+                                      f"{type(e).__name__}: {e}")
+
+        broken: List[Path] = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            yield from run(pool, list(targets))
+
+        # A dead worker takes every pending project down with the pool; retry
+        # each of them alone, so only the one that crashes fails
+        for project in sorted(broken):
+            broken = []
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                yield from run(pool, [project])
+            if broken:
+                yield BatchResult(project, targets[project], 0, 0.0, "worker process crashed")
+
+    @staticmethod
+    def summarize(results: Sequence[BatchResult], wall_seconds: float) -> dict:
+        """Aggregate counts, timings and failures of a batch run"""
+        failed = [result for result in results if result.error]
+        slowest = sorted(results, key=lambda result: result.seconds, reverse=True)[:5]
+        return {
+            "projects": len(results),
+            "succeeded": len(results) - len(failed),
+            "failed": len(failed),
+            "files": sum(result.files for result in results),
+            "wall_seconds": round(wall_seconds, 3),
+            "project_seconds": round(sum(result.seconds for result in results), 3),
+            "slowest": [{"project": str(result.project), "seconds": round(result.seconds, 3)}
+                        for result in slowest],
+            "failures": [{"project": str(result.project), "error": result.error}
+                         for result in failed],
+        }
+
+
+class CatalogMember(NamedTuple):
+    """One file version found in the catalog"""
+    archive: Path
+    project: str
+    date: str
+    filename: str
+    offset: int
+    length: int
+    sha256: str
+
+
+class CatalogArchive(NamedTuple):
+    """One archive known to the catalog"""
+    path: Path
+    project: str
+    date: str
+    files: int
+    size: int
+
+
+class CatalogScan(NamedTuple):
+    """Outcome of bringing the catalog up to date with some folders"""
+    added: int
+    updated: int
+    removed: int
+    unchanged: int
+    errors: List[str]
+
+
+class SearchHit(NamedTuple):
+    """One line of an archived file that matched a search"""
+    archive: Path
+    project: str
+    date: str
+    filename: str
+    line: int
+    text: str
+
+
+class TextIndex:
+    """Trigram index of archived file contents, kept in the catalog database
+
+    Every distinct content (by hash) is indexed once, however many
+    archives hold it, as the set of lowercase three-character substrings
+    of its lines. A search only reads files that contain all of the
+    query's trigrams.
+    """
+
+    MAX_QUERY_GRAMS = 32        # more rarely narrows the candidates further
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+        self._known: Optional[set] = None
+
+    @staticmethod
+    def trigrams(text: str) -> set:
+        """Lowercase trigrams of text, leaving out ones that span lines"""
+        text = text.lower()
+        grams = {text[i:i + 3] for i in range(len(text) - 2)}
+        return {gram for gram in grams if "\n" not in gram and "\r" not in gram}
+
+    def has(self, sha256: str) -> bool:
+        if self._known is None:
+            self._known = {row[0] for row in self.connection.execute("SELECT sha256 FROM texts")}
+        return sha256 in self._known
+
+    def add(self, sha256: str, text: str):
+        """Index one content unless it already is"""
+        if self.has(sha256):
+            return
+        text_id = self.connection.execute("INSERT INTO texts (sha256) VALUES (?)",
+                                          (sha256,)).lastrowid
+        self.connection.executemany("INSERT INTO grams (gram, text_id) VALUES (?, ?)",
+                                    [(gram, text_id) for gram in self.trigrams(text)])
+        self._known.add(sha256)
+
+    def prune(self) -> int:
+        """Drop contents no catalogued archive holds any more, return how many"""
+        orphans = "SELECT id FROM texts WHERE sha256 NOT IN (SELECT sha256 FROM members)"
+        with self.connection:
+            self.connection.execute(f"DELETE FROM grams WHERE text_id IN ({orphans})")
+            count = self.connection.execute(
+                "DELETE FROM texts WHERE sha256 NOT IN (SELECT sha256 FROM members)").rowcount
+        self._known = None
+        return count
+
+    def candidates_query(self, query: str) -> Tuple[str, List[str]]:
+        """SQL selecting the hashes of contents that may contain query, and its parameters"""
+        grams = sorted(self.trigrams(query))[:self.MAX_QUERY_GRAMS]
+        if not grams:
+            raise ValueError("Search text needs at least 3 characters on one line")
+        ids = " INTERSECT ".join(["SELECT text_id FROM grams WHERE gram = ?"] * len(grams))
+        return f"SELECT sha256 FROM texts WHERE id IN ({ids})", grams
+
+
+class ArchiveCatalog:
+    """SQLite catalog of the archives under some folders and the files they hold
+
+    Every archive is recorded with its project, date, size and mtime, and
+    each live member with its offset, length and content hash (the same
+    hash delta manifests and DiffManager use), so lookups never reopen
+    archives. Scans are incremental: archives whose size and mtime are
+    unchanged are skipped, and ones that disappeared are dropped. Files
+    that aren't archives are remembered too, so they aren't reopened.
+    File contents are indexed for search as they are first seen.
+    """
+
+    ENV_PATH = "PROJECT_BUNDLER_CATALOG"
+    DEFAULT_NAME = ".project_bundler_catalog.sqlite"     # in the home folder
+    ARCHIVE_SUFFIXES = (".txt", ".txt.gz", ".txt.bz2", ".txt.xz")
+    SCHEMA_VERSION = 1
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS archives (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            project TEXT,                   -- NULL for files that aren't archives
+            date TEXT,
+            baseline TEXT,
+            files INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS members (
+            archive_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            basename TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            sha256 TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS archives_project ON archives (project, date);
+        CREATE INDEX IF NOT EXISTS members_archive ON members (archive_id);
+        CREATE INDEX IF NOT EXISTS members_filename ON members (filename);
+        CREATE INDEX IF NOT EXISTS members_basename ON members (basename);
+        CREATE INDEX IF NOT EXISTS members_sha256 ON members (sha256);
+        CREATE TABLE IF NOT EXISTS texts (
+            id INTEGER PRIMARY KEY,
+            sha256 TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS grams (
+            gram TEXT NOT NULL,
+            text_id INTEGER NOT NULL,
+            PRIMARY KEY (gram, text_id)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path or os.environ.get(self.ENV_PATH)
+                         or Path.home() / self.DEFAULT_NAME)
+        self.connection = sqlite3.connect(str(self.path))
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, self.SCHEMA_VERSION):
+            self.connection.close()
+            raise ValueError(f"{self.path} was made by a different version of this tool")
+        # Scans commit once per archive; without WAL each commit waits for a sync
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        with self.connection:
+            self.connection.executescript(self.SCHEMA)
+            self.connection.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        self.text_index = TextIndex(self.connection)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @staticmethod
+    def find_archives(folder: Path) -> Iterator[Path]:
+        """Archive-looking files below folder, skipping pruned and hidden folders"""
+        for directory, subdirs, names in os.walk(folder):
+            subdirs[:] = [name for name in subdirs if not name.startswith(".")
+                          and name not in ProjectManager.PRUNED_DIRS]
+            for name in names:
+                if name.endswith(ArchiveCatalog.ARCHIVE_SUFFIXES):
+                    yield Path(directory, name)
+
+    @staticmethod
+    def read_archive(path: Path, digests: Optional[Dict[str, str]] = None,
+                     text_index: Optional[TextIndex] = None
+                     ) -> Optional[Tuple[str, str, Optional[str], List[tuple]]]:
+        """(project, date, baseline, member rows) of an archive, None if it isn't one
+
+        digests caches content hashes of store objects, which many manifests
+        share. Contents text_index hasn't seen yet are added to it. A volume
+        set is read through its index as one archive, with every member of
+        its volumes; their offsets are within the volume that holds them.
+        """
+        with ArchiveManager.open_archive(path) as handle:
+            project = ArchiveManager.read_title(handle)
+        if project is None:
+            return None
+
+        digests = {} if digests is None else digests
+        with ExitStack() as stack:
+            # Only this archive's own records, not the baselines it is layered on
+            members = ArchiveMembers()
+            header, _ = ArchiveManager.add_members(members, path, stack)
+            items = members.entries.items()
+            if not header.get("Volume"):
+                # Volumes are already layered in order; offsets restart in each
+                items = sorted(items, key=lambda item: item[1][1].offset)
+            rows = []
+            for filename, (_, entry) in items:
+                if entry.stored and entry.checksum in digests:
+                    digest = digests[entry.checksum]
+                else:
+                    digest = DiffManager.member_digest(members, filename)
+                    if entry.stored:
+                        digests[entry.checksum] = digest
+                if text_index is not None and not text_index.has(digest):
+                    text_index.add(digest, members[filename])
+                rows.append((filename, filename.rpartition("/")[2], entry.offset, entry.length,
+                             digest))
+        return (project, header.get("Date", [""])[0], header.get("Baseline", [None])[0], rows)
+
+    def _update(self, path: Path, stat: os.stat_result, archive_id: Optional[int],
+                digests: Dict[str, str]):
+        """Record one archive (re-reading it if archive_id is known), in one commit"""
+        found = ArchiveCatalog.read_archive(path, digests, self.text_index)
+        project, date, baseline, rows = found if found else (None, None, None, [])
+        with self.connection:
+            if archive_id is not None:
+                self.connection.execute("DELETE FROM members WHERE archive_id = ?",
+                                        (archive_id,))
+                self.connection.execute(
+                    "UPDATE archives SET size = ?, mtime_ns = ?, project = ?, date = ?, "
+                    "baseline = ?, files = ? WHERE id = ?",
+                    (stat.st_size, stat.st_mtime_ns, project, date, baseline, len(rows),
+                     archive_id))
+            else:
+                archive_id = self.connection.execute(
+                    "INSERT INTO archives (path, size, mtime_ns, project, date, baseline, "
+                    "files) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (str(path), stat.st_size, stat.st_mtime_ns, project, date, baseline,
+                     len(rows))).lastrowid
+            self.connection.executemany(
+                "INSERT INTO members (archive_id, filename, basename, offset, length, "
+                "sha256) VALUES (?, ?, ?, ?, ?, ?)",
+                [(archive_id, *row) for row in rows])
+
+    def add_archive(self, path: Path) -> bool:
+        """Bring one archive's entry up to date, True if it had to be read"""
+        path = Path(path).resolve()
+        stat = path.stat()
+        row = self.connection.execute("SELECT id, size, mtime_ns FROM archives WHERE path = ?",
+                                      (str(path),)).fetchone()
+        if row and row[1:] == (stat.st_size, stat.st_mtime_ns):
+            return False
+        with METRICS.phase("catalog", nbytes=stat.st_size, files=1):
+            self._update(path, stat, row[0] if row else None, {})
+        if row:
+            self.text_index.prune()
+        return True
+
+    def scan(self, folders: Iterable[Path],
+             tracker: Optional[ProgressTracker] = None) -> CatalogScan:
+        """Bring the catalog up to date with the archives under folders
+
+        Each archive is committed on its own, so an interrupted scan keeps
+        what it has done. Unreadable archives are reported and retried on
+        the next scan. Volumes next to their volume set's index are left
+        out, as the index is catalogued with all of their members.
+        """
+        added = updated = removed = unchanged = 0
+        errors = []
+        digests: Dict[str, str] = {}
+        known = {path: (archive_id, size, mtime_ns) for archive_id, path, size, mtime_ns
+                 in self.connection.execute("SELECT id, path, size, mtime_ns FROM archives")}
+        for folder in folders:
+            folder = Path(folder).resolve()
+            seen = set()
+            found = list(ArchiveCatalog.find_archives(folder))
+            names = set(found)
+            for path in found:
+                if tracker is not None:
+                    tracker.check_cancel()
+                if VolumeSet.index_path(path) in names:
+                    continue
+                key = str(path)
+                seen.add(key)
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                previous = known.get(key)
+                if previous and previous[1:] == (stat.st_size, stat.st_mtime_ns):
+                    unchanged += 1
+                    continue
+                with METRICS.phase("catalog", nbytes=stat.st_size, files=1) as timer:
+                    try:
+                        self._update(path, stat, previous[0] if previous else None, digests)
+                    except Exception as e:
+                        timer.fail()
+                        errors.append(f"{path}: {e}")
+                        continue
+                if previous:
+                    updated += 1
+                else:
+                    added += 1
+                if tracker is not None:
+                    tracker.advance(stat.st_size)
+
+            # Archives that were under this folder and are gone now
+            prefix = os.path.join(str(folder), "")
+            gone = [(archive_id,) for path, (archive_id, _, _) in known.items()
+                    if path.startswith(prefix) and path not in seen]
+            with self.connection:
+                self.connection.executemany("DELETE FROM members WHERE archive_id = ?", gone)
+                self.connection.executemany("DELETE FROM archives WHERE id = ?", gone)
+            removed += len(gone)
+        if updated or removed:
+            self.text_index.prune()
+        return CatalogScan(added, updated, removed, unchanged, errors)
 
-        for filename, file_content in sorted(files.items()):
-            content_lines.extend([
-                f"=== {filename} ===",
-                file_content.rstrip(),
-                "\n=== END ===\n"
-            ])
+    def _members(self, where: str, parameters: Sequence) -> List[CatalogMember]:
+        rows = self.connection.execute(
+            "SELECT a.path, a.project, a.date, m.filename, m.offset, m.length, m.sha256 "
+            "FROM members m JOIN archives a ON a.id = m.archive_id "
+            f"WHERE {where} ORDER BY a.date, a.path, m.filename", parameters)
+        return [CatalogMember(Path(row[0]), *row[1:]) for row in rows]
 
-        return "\n".join(content_lines)
+    def versions(self, filename: str) -> List[CatalogMember]:
+        """Every archived copy of a file, oldest first
 
-    @staticmethod
-    def parse_archive(archive_content: str) -> Tuple[List[str], Dict[str, str]]:
-        """Parse archive content, return file list and content"""
-        # Find first marker
-        first_marker_pos = archive_content.find("===")
-        if first_marker_pos == -1:
-            raise ValueError("No '===' marker found in the text file")
+        A bare name ("settings.py") matches it in any folder; a path
+        ("app/settings.py") matches only that member.
+        """
+        if "/" in filename:
+            return self._members("m.filename = ?", (filename,))
+        return self._members("m.basename = ?", (filename,))
 
-        content = archive_content[first_marker_pos:]
-        blocks = re.split(r'(?m)^=== END ===\s*$', content)
+    def containing(self, sha256: str) -> List[CatalogMember]:
+        """Members whose content hash is sha256 or starts with it"""
+        sha256 = sha256.lower()
+        return self._members("m.sha256 >= ? AND m.sha256 < ?", (sha256, sha256 + "g"))
 
-        file_list = []
-        file_data = {}
+    def archives(self, project: Optional[str] = None) -> List[CatalogArchive]:
+        """Archives of a project (or all of them), newest first"""
+        query = "SELECT path, project, date, files, size FROM archives WHERE project IS NOT NULL"
+        parameters: Tuple = ()
+        if project is not None:
+            query += " AND project = ?"
+            parameters = (project,)
+        rows = self.connection.execute(query + " ORDER BY date DESC, mtime_ns DESC", parameters)
+        return [CatalogArchive(Path(row[0]), *row[1:]) for row in rows]
 
-        for block in blocks:
-            block = block.strip()
-            if not block:
-                continue
+    def latest(self, project: str) -> Optional[CatalogArchive]:
+        """Newest archive of a project, None if there is none"""
+        row = self.connection.execute(
+            "SELECT path, project, date, files, size FROM archives WHERE project = ? "
+            "ORDER BY date DESC, mtime_ns DESC LIMIT 1", (project,)).fetchone()
+        return CatalogArchive(Path(row[0]), *row[1:]) if row else None
 
-            match = re.match(r'^=== (.+?) ===\s*(.+)', block, re.DOTALL)
-            if match:
-                filename = match.group(1).strip()
-                file_content = match.group(2).rstrip()
+    def search(self, query: str, ignore_case: bool = False, archive: Optional[Path] = None,
+               limit: Optional[int] = None) -> List[SearchHit]:
+        """Lines containing query in catalogued files, oldest archive first
 
-                if filename:
-                    file_list.append(filename)
-                    file_data[filename] = file_content
+        The trigram index picks the files that can match; only those are
+        read, once per distinct content, to find the matching lines.
+        Archives that can't be read any more are skipped.
+        """
+        candidates, parameters = self.text_index.candidates_query(query)
+        where = f"m.sha256 IN ({candidates})"
+        if archive is not None:
+            where += " AND a.path = ?"
+            parameters.append(str(Path(archive).resolve()))
+        needle = query.lower() if ignore_case else query
 
-        return sorted(file_list), file_data
+        hits: List[SearchHit] = []
+        lines: Dict[str, List[Tuple[int, str]]] = {}
+        members = self._members(where, parameters)
+        for path, group in itertools.groupby(members, key=lambda member: member.archive):
+            group = list(group)
+            wanted = {member.filename for member in group if member.sha256 not in lines}
+            if wanted:
+                try:
+                    with ExitStack() as stack:
+                        _, data = ArchiveManager.open_members(path, stack)
+                        for member in group:
+                            if member.filename in wanted and member.sha256 not in lines:
+                                lines[member.sha256] = [
+                                    (number, line) for number, line
+                                    in enumerate(data[member.filename].splitlines(), 1)
+                                    if needle in (line.lower() if ignore_case else line)]
+                except (OSError, ValueError, KeyError):
+                    continue
+            for member in group:
+                for number, line in lines.get(member.sha256, ()):
+                    hits.append(SearchHit(path, member.project, member.date, member.filename,
+                                          number, line))
+                    if limit is not None and len(hits) >= limit:
+                        return hits
+        return hits
 
 
 class UIBuilder:
@@ -114,13 +3793,200 @@ class UIBuilder:
         return ttk.Separator(parent, orient="horizontal")
 
 
+class VirtualFileList:
+    """Filterable file list that materializes only the visible Treeview rows
+
+    A small pool of Treeview items is refilled as the list scrolls, so the
+    cost of opening it does not grow with the archive. Selection is kept
+    as one flag per sorted name and survives scrolling and filtering.
+    """
+
+    ROW_HEIGHT = 20
+    BUFFER_ROWS = 2
+
+    def __init__(self, parent, file_list: Iterable[str],
+                 status: Callable[[str], Tuple[str, str]], selectable: bool = True,
+                 on_open: Optional[Callable[[str], None]] = None):
+        self.names = sorted(file_list)
+        self.status = status
+        self.selected = bytearray(len(self.names))
+        self.view: Sequence[int] = range(len(self.names))  # indices of shown names
+        self.top = 0
+        self.capacity = 10
+        self.anchor: Optional[int] = None
+        self.rows: List[str] = []
+        self._folded: Optional[List[str]] = None
+        self._needle = ""
+
+        self.frame = tk.Frame(parent)
+
+        filter_row = tk.Frame(self.frame)
+        filter_row.pack(fill="x", pady=(0, 4))
+        tk.Label(filter_row, text="Filter:").pack(side="left")
+        self.filter_var = tk.StringVar()
+        tk.Entry(filter_row, textvariable=self.filter_var).pack(
+            side="left", fill="x", expand=True, padx=6)
+        self.count_var = tk.StringVar()
+        tk.Label(filter_row, textvariable=self.count_var, fg="#555555").pack(side="right")
+        self.filter_var.trace_add("write", lambda *_: self.set_filter(self.filter_var.get()))
+
+        body = tk.Frame(self.frame)
+        body.pack(fill="both", expand=True)
+        self.scrollbar = ttk.Scrollbar(body, orient="vertical", command=self._on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+        self.tree = ttk.Treeview(body, columns=("filename", "status"), show="headings",
+                                 selectmode="none")
+        self.tree.heading("filename", text="File")
+        self.tree.heading("status", text="Status")
+        self.tree.column("filename", width=300)
+        self.tree.column("status", width=200)
+        self.tree.pack(fill="both", expand=True)
+
+        # Color tags
+        self.tree.tag_configure("exists", foreground="#1b5e20")
+        self.tree.tag_configure("new", foreground="#e65100")
+        self.tree.tag_configure("identical", foreground="#757575")
+        self.tree.tag_configure("selected", background="#cfe3fc")
+
+        self.tree.bind("<Configure>", self._on_resize)
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll(-3 if e.delta > 0 else 3))
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(3))
+        self.tree.bind("<Up>", lambda e: self.scroll(-1))
+        self.tree.bind("<Down>", lambda e: self.scroll(1))
+        self.tree.bind("<Prior>", lambda e: self.scroll(-self.capacity))
+        self.tree.bind("<Next>", lambda e: self.scroll(self.capacity))
+        if selectable:
+            self.tree.bind("<Button-1>", lambda e: self._on_click(e, "set"))
+            self.tree.bind("<Control-Button-1>", lambda e: self._on_click(e, "toggle"))
+            self.tree.bind("<Shift-Button-1>", lambda e: self._on_click(e, "range"))
+        if on_open:
+            self.tree.bind("<Double-Button-1>", lambda e: self._on_double_click(e, on_open))
+
+        self._refresh()
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def _on_resize(self, event):
+        """Size the row pool to the rows that fit in the widget"""
+        box = self.tree.bbox(self.rows[0]) if self.rows else ""
+        header, row_height = (box[1], box[3]) if box else (self.ROW_HEIGHT + 4, self.ROW_HEIGHT)
+        self.capacity = max(1, (event.height - header) // max(1, row_height))
+        self._refresh()
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        """Translate scrollbar commands into a new first row"""
+        if action == "moveto":
+            self.top = int(float(amount) * len(self.view))
+        else:
+            self.top += int(amount) * (self.capacity if unit == "pages" else 1)
+        self._refresh()
+
+    def scroll(self, rows: int):
+        self.top += rows
+        self._refresh()
+        return "break"
+
+    def _refresh(self):
+        """Refill the row pool from the current scroll position"""
+        total = len(self.view)
+        self.top = max(0, min(self.top, total - self.capacity))
+        needed = max(0, min(self.capacity + self.BUFFER_ROWS, total - self.top))
+        while len(self.rows) > needed:
+            self.tree.delete(self.rows.pop())
+        while len(self.rows) < needed:
+            self.rows.append(self.tree.insert("", "end"))
+
+        for slot, iid in enumerate(self.rows):
+            index = self.view[self.top + slot]
+            filename = self.names[index]
+            tag, text = self.status(filename)
+            tags = (tag, "selected") if self.selected[index] else (tag,)
+            self.tree.item(iid, values=(filename, text), tags=tags)
+
+        if total:
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + self.capacity) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+        shown = f"{total} of {len(self.names)}" if total != len(self.names) else str(total)
+        self.count_var.set(f"{shown} files, {self.selected.count(1)} selected")
+
+    def _on_click(self, event, mode: str):
+        """Update the selection for a click on a row"""
+        self.tree.focus_set()
+        iid = self.tree.identify_row(event.y)
+        if not iid:
+            return "break"
+        position = self.top + self.rows.index(iid)
+        if mode == "toggle":
+            self.selected[self.view[position]] ^= 1
+            self.anchor = position
+        elif mode == "range" and self.anchor is not None:
+            self.selected = bytearray(len(self.names))
+            first, last = sorted((self.anchor, position))
+            for pos in range(first, last + 1):
+                self.selected[self.view[pos]] = 1
+        else:
+            self.selected = bytearray(len(self.names))
+            self.selected[self.view[position]] = 1
+            self.anchor = position
+        self._refresh()
+        return "break"
+
+    def _on_double_click(self, event, on_open: Callable[[str], None]):
+        iid = self.tree.identify_row(event.y)
+        if iid:
+            on_open(self.names[self.view[self.top + self.rows.index(iid)]])
+        return "break"
+
+    def set_filter(self, text: str):
+        """Show only names containing text, case-insensitively
+
+        A filter that extends the previous one only searches the names
+        still shown, so typing stays fast on long lists.
+        """
+        needle = text.strip().lower()
+        if not needle:
+            self.view = range(len(self.names))
+        else:
+            if self._folded is None:
+                self._folded = [name.lower() for name in self.names]
+            source = self.view if self._needle and needle.startswith(self._needle) else \
+                range(len(self.names))
+            self.view = [index for index in source if needle in self._folded[index]]
+        self._needle = needle
+        self.top = 0
+        self.anchor = None
+        self._refresh()
+
+    def select_where(self, predicate: Callable[[str], bool]):
+        """Replace the selection with the shown names matching predicate"""
+        self.selected = bytearray(len(self.names))
+        for index in self.view:
+            if predicate(self.names[index]):
+                self.selected[index] = 1
+        self._refresh()
+
+    def clear_selection(self):
+        self.selected = bytearray(len(self.names))
+        self._refresh()
+
+    def selected_names(self) -> List[str]:
+        """Selected names in list order, including ones hidden by the filter"""
+        return [name for name, flag in zip(self.names, self.selected) if flag]
+
+
 class FileSelectionDialog:
     """Dialog window for file selection during restoration"""
 
-    def __init__(self, parent, file_list: List[str], project_manager: ProjectManager):
+    def __init__(self, parent, file_list: List[str], project_manager: ProjectManager,
+                 members: Optional[ArchiveMembers] = None):
         self.parent = parent
         self.file_list = file_list
         self.project_manager = project_manager
+        self.members = members
+        self._statuses: Dict[str, str] = {}
         self.proceed = False
         self.selected_files = []
         self.auto_create = False
@@ -131,7 +3997,7 @@ class FileSelectionDialog:
     def _setup_dialog(self):
         """Setup dialog window"""
         self.dialog.title("Restoration Selection")
-        self.dialog.geometry("620x520")
+        self.dialog.geometry("620x550")
         self.dialog.transient(self.parent)
         self.dialog.grab_set()
         self.dialog.protocol("WM_DELETE_WINDOW", self._on_cancel)
@@ -173,42 +4039,48 @@ class FileSelectionDialog:
                  fg="#1b5e20").pack(anchor="w")
         tk.Label(legend, text="● Orange = doesn't exist (will be created if selected)", 
                  fg="#e65100").pack(anchor="w")
+        if self.members is not None:
+            tk.Label(legend, text="● Gray   = identical to the project copy (double-click a "
+                                  "file to see its changes)", fg="#757575").pack(anchor="w")
 
     def _create_file_tree(self):
-        """Create Treeview with file list"""
-        tree_frame = tk.Frame(self.dialog)
-        tree_frame.pack(fill="both", expand=True, padx=16, pady=(4, 12))
-
-        columns = ("filename", "status")
-        self.tree = ttk.Treeview(tree_frame, columns=columns, show="headings", selectmode="extended")
-        self.tree.heading("filename", text="File")
-        self.tree.heading("status", text="Status")
-        self.tree.column("filename", width=300)
-        self.tree.column("status", width=200)
-
-        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=self.tree.yview)
-        scrollbar.pack(side="right", fill="y")
-        self.tree.config(yscrollcommand=scrollbar.set)
-        self.tree.pack(fill="both", expand=True)
-
-        # Color tags
-        self.tree.tag_configure("exists", foreground="#1b5e20")
-        self.tree.tag_configure("new", foreground="#e65100")
+        """Create the file list"""
+        self.file_view = VirtualFileList(self.dialog, self.file_list, self._file_status,
+                                         on_open=self._show_diff if self.members else None)
+        self.file_view.pack(fill="both", expand=True, padx=16, pady=(4, 12))
 
-        # Populate with files
-        self._populate_file_tree()
+    def _file_status(self, filename: str) -> Tuple[str, str]:
+        """Color tag and status text for one file
 
-    def _populate_file_tree(self):
-        """Populate Treeview with file information"""
-        for filename in sorted(self.file_list):
+        With the archive at hand, existing files are compared by content,
+        using the members' checksums where they have them; this runs only
+        for rows as they scroll into view.
+        """
+        if self.members is None:
             if self.project_manager.file_exists(filename):
-                tag = "exists"
-                status = "Already exists (will overwrite)"
-            else:
-                tag = "new"
-                status = "Doesn't exist (will create)"
+                return "exists", "Already exists (will overwrite)"
+            return "new", "Doesn't exist (will create)"
 
-            self.tree.insert("", "end", values=(filename, status), tags=(tag,))
+        status = self._statuses.get(filename)
+        if status is None:
+            try:
+                status = DiffManager.compare_file(self.members, self.project_manager, filename)
+            except Exception:
+                status = "modified"
+            self._statuses[filename] = status
+        if status == "identical":
+            return "identical", "Identical (same content)"
+        if status == "modified":
+            return "exists", "Modified (will overwrite)"
+        return "new", "Doesn't exist (will create)"
+
+    def _show_diff(self, filename: str):
+        """Open the changes restoring one file would make"""
+        result = DiffResult(self.project_manager.read_file, self.members.__getitem__,
+                            ("project", "archive"))
+        self._file_status(filename)
+        result.add(filename, self._statuses[filename])
+        DiffWindow(self.dialog, filename, result)
 
     def _create_buttons(self):
         """Create buttons at the bottom of dialog"""
@@ -234,26 +4106,16 @@ class FileSelectionDialog:
         self.dialog.destroy()
 
     def _select_existing(self):
-        """Select all existing files in the tree"""
-        # First unselect all
-        for item in self.tree.selection():
-            self.tree.selection_remove(item)
-        
-        # Then select only existing files (green ones)
-        for item in self.tree.get_children():
-            filename = self.tree.item(item)["values"][0]
-            if self.project_manager.file_exists(filename):
-                self.tree.selection_add(item)
+        """Select all existing files in the list"""
+        self.file_view.select_where(self.project_manager.file_exists)
 
     def _unselect_all(self):
-        """Unselect all files in the tree"""
-        for item in self.tree.selection():
-            self.tree.selection_remove(item)
+        """Unselect all files in the list"""
+        self.file_view.clear_selection()
 
     def _on_continue(self):
         """Handle continue action"""
-        selected = self.tree.selection()
-        self.selected_files = [self.tree.item(item)["values"][0] for item in selected]
+        self.selected_files = self.file_view.selected_names()
         self.auto_create = self.auto_create_var.get()
         self.proceed = True
         self.dialog.destroy()
@@ -264,15 +4126,86 @@ class FileSelectionDialog:
         return self.proceed, self.selected_files, self.auto_create
 
 
+class DiffWindow:
+    """Window showing the unified diff of one file"""
+
+    def __init__(self, parent, filename: str, result: DiffResult):
+        self.window = tk.Toplevel(parent)
+        self.window.title(f"Changes: {filename}")
+        self.window.geometry("760x520")
+        self.window.transient(parent)
+
+        frame = tk.Frame(self.window)
+        frame.pack(fill="both", expand=True, padx=8, pady=8)
+        text = tk.Text(frame, wrap="none", font=("Consolas", 10))
+        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=text.yview)
+        scrollbar.pack(side="right", fill="y")
+        text.config(yscrollcommand=scrollbar.set)
+        text.pack(fill="both", expand=True)
+
+        text.tag_configure("added", foreground="#1b5e20")
+        text.tag_configure("removed", foreground="#b71c1c")
+        text.tag_configure("hunk", foreground="#0d47a1")
+
+        empty = True
+        for line in result.unified_diff(filename):
+            empty = False
+            if not line.endswith("\n"):
+                line += "\n"
+            tag = ("hunk" if line.startswith("@@") else
+                   "added" if line.startswith("+") else
+                   "removed" if line.startswith("-") else "")
+            text.insert("end", line, tag)
+        if empty:
+            text.insert("end", "No changes: the project copy matches the archive.\n")
+        text.config(state="disabled")
+
+        tk.Button(self.window, text="Close", command=self.window.destroy,
+                  width=12, bg="#607d8b", fg="white").pack(pady=8)
+
+
+class SearchResultsWindow:
+    """Window listing the archived lines that matched a search"""
+
+    def __init__(self, parent, query: str, hits: List[SearchHit], limit: int):
+        self.window = tk.Toplevel(parent)
+        self.window.title(f"Search: {query}")
+        self.window.geometry("760x520")
+        self.window.transient(parent)
+
+        frame = tk.Frame(self.window)
+        frame.pack(fill="both", expand=True, padx=8, pady=8)
+        text = tk.Text(frame, wrap="none", font=("Consolas", 10))
+        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=text.yview)
+        scrollbar.pack(side="right", fill="y")
+        text.config(yscrollcommand=scrollbar.set)
+        text.pack(fill="both", expand=True)
+        text.tag_configure("location", foreground="#0d47a1")
+
+        for hit in hits:
+            text.insert("end", f"{hit.filename}:{hit.line}: ", "location")
+            text.insert("end", hit.text.strip() + "\n")
+        if not hits:
+            text.insert("end", f"No file in the archive contains \"{query}\".\n")
+        elif len(hits) >= limit:
+            text.insert("end", f"\nShowing the first {limit} matching lines.\n")
+        text.config(state="disabled")
+
+        tk.Button(self.window, text="Close", command=self.window.destroy,
+                  width=12, bg="#607d8b", fg="white").pack(pady=8)
+
+
 class FileListWindow:
     """Window for displaying file list from archive"""
 
     def __init__(self, parent, title: str, file_list: List[str], 
-                 project_manager: ProjectManager, extra_text: str = ""):
+                 project_manager: ProjectManager, extra_text: str = "",
+                 on_search: Optional[Callable[[str], None]] = None):
         self.parent = parent
         self.file_list = file_list
         self.project_manager = project_manager
         self.extra_text = extra_text
+        self.on_search = on_search
 
         self.window = tk.Toplevel(parent)
         self._setup_window(title)
@@ -280,7 +4213,7 @@ class FileListWindow:
     def _setup_window(self, title: str):
         """Setup window"""
         self.window.title(title)
-        self.window.geometry("600x450")
+        self.window.geometry("600x480")
         self.window.transient(self.parent)
 
         # Header
@@ -290,6 +4223,9 @@ class FileListWindow:
         # Treeview
         self._create_file_tree()
 
+        if self.on_search:
+            self._create_search_row()
+
         # Extra info
         if self.extra_text:
             info = tk.Label(self.window, text=self.extra_text, 
@@ -301,50 +4237,116 @@ class FileListWindow:
                   width=12, bg="#607d8b", fg="white").pack(pady=12)
 
     def _create_file_tree(self):
-        """Create Treeview with file list"""
-        tree_frame = tk.Frame(self.window)
-        tree_frame.pack(fill="both", expand=True, padx=16, pady=(4, 12))
-
-        columns = ("filename", "status")
-        tree = ttk.Treeview(tree_frame, columns=columns, show="headings")
-        tree.heading("filename", text="File")
-        tree.heading("status", text="Status")
-        tree.column("filename", width=300)
-        tree.column("status", width=200)
-
-        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=tree.yview)
-        scrollbar.pack(side="right", fill="y")
-        tree.config(yscrollcommand=scrollbar.set)
-        tree.pack(fill="both", expand=True)
+        """Create the file list"""
+        view = VirtualFileList(self.window, self.file_list, self._file_status, selectable=False)
+        view.pack(fill="both", expand=True, padx=16, pady=(4, 12))
 
-        # Tags
-        tree.tag_configure("exists", foreground="#1b5e20")
-        tree.tag_configure("new", foreground="#e65100")
+    def _file_status(self, filename: str) -> Tuple[str, str]:
+        """Color tag and status text for one file"""
+        if self.project_manager.file_exists(filename):
+            return "exists", "Exists in project"
+        return "new", "Not in project"
 
-        # Populate
-        for filename in sorted(self.file_list):
-            if self.project_manager.file_exists(filename):
-                tag = "exists"
-                status = "Exists in project"
-            else:
-                tag = "new"
-                status = "Not in project"
+    def _create_search_row(self):
+        """Entry for searching the contents of the archived files"""
+        row = tk.Frame(self.window)
+        row.pack(fill="x", padx=16)
+        tk.Label(row, text="Search contents:").pack(side="left")
+        query_var = tk.StringVar()
+        entry = tk.Entry(row, textvariable=query_var)
+        entry.pack(side="left", fill="x", expand=True, padx=6)
+
+        def search(*_):
+            if query_var.get().strip():
+                self.on_search(query_var.get())
+
+        entry.bind("<Return>", search)
+        tk.Button(row, text="Search", command=search, width=10).pack(side="right")
+
+
+class BackgroundTask:
+    """Runs work on a worker thread and relays its events to the Tk thread
+
+    The worker only puts events on a queue; the Tk thread polls it with
+    root.after, so no widget is ever touched from the worker.
+    """
+
+    POLL_MS = 50
+
+    def __init__(self, root, work: Callable[[ProgressTracker], object],
+                 on_done: Callable, on_error: Callable, on_progress: Callable,
+                 files_total: int = 0):
+        self.root = root
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.tracker = ProgressTracker(files_total, self._report, self.cancel_event)
+
+        thread = threading.Thread(target=self._run, args=(work,), daemon=True)
+        thread.start()
+        self.root.after(self.POLL_MS, self._poll)
+
+    def cancel(self):
+        """Request a clean stop between files"""
+        self.cancel_event.set()
+
+    def _report(self, progress: Progress):
+        self.events.put(("progress", progress))
+
+    def _run(self, work: Callable[[ProgressTracker], object]):
+        try:
+            self.events.put(("done", work(self.tracker)))
+        except BaseException as e:
+            self.events.put(("error", e))
+
+    def _poll(self):
+        """Deliver queued events; only the latest progress event is shown"""
+        progress = None
+        while True:
+            try:
+                kind, payload = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                progress = payload
+                continue
+            if progress is not None:
+                self.on_progress(progress)
+            (self.on_done if kind == "done" else self.on_error)(payload)
+            return
 
-            tree.insert("", "end", values=(filename, status), tags=(tag,))
+        if progress is not None:
+            self.on_progress(progress)
+        self.root.after(self.POLL_MS, self._poll)
 
 
 class ProjectBundlerApp:
     """Main application class"""
 
-    def __init__(self, root: tk.Tk):
+    SAVE_FILETYPES = [
+        ("Text file", "*.txt"),
+        ("Gzip-compressed text", "*.txt.gz"),
+        ("Bzip2-compressed text", "*.txt.bz2"),
+        ("XZ-compressed text", "*.txt.xz"),
+    ]
+    OPEN_FILETYPES = [
+        ("Archive", "*.txt *.txt.gz *.txt.bz2 *.txt.xz"),
+        ("Text file", "*.txt"),
+    ]
+    SEARCH_LIMIT = 1000          # matching lines shown per search
+
+    def __init__(self, root: "tk.Tk"):
         self.root = root
         self.project_manager = ProjectManager()
+        self.task: Optional[BackgroundTask] = None
         self._setup_ui()
 
     def _setup_ui(self):
         """Setup user interface"""
         self.root.title("Python Project Bundler & Restorer")
-        self.root.geometry("740x420")
+        self.root.geometry("740x510")
         self.root.resizable(False, False)
 
         # === Header ===
@@ -366,10 +4368,11 @@ class ProjectBundlerApp:
                                      anchor="w", relief="sunken", padx=8, pady=6)
         self.folder_label.pack(fill="x", padx=12, pady=(4, 8))
 
-        tk.Button(folder_frame, text="📁 Choose Project Folder", 
+        folder_button = tk.Button(folder_frame, text="📁 Choose Project Folder", 
                  command=self.choose_project_folder,
                  bg="#0277bd", fg="white", font=("Segoe UI", 10), 
-                 width=25).pack(pady=(0, 8))
+                 width=25)
+        folder_button.pack(pady=(0, 8))
 
         # === Main Actions ===
         actions_frame = tk.Frame(self.root)
@@ -377,17 +4380,43 @@ class ProjectBundlerApp:
 
         btn_config = {"width": 30, "height": 2, "font": ("Segoe UI", 10, "bold")}
 
-        tk.Button(actions_frame, text="📦 Bundle → Create .txt Archive",
-                  command=self.bundle_files, bg="#4caf50", fg="white", 
-                  **btn_config).grid(row=0, column=0, padx=10, pady=8)
+        self.action_buttons = [folder_button]
+        for row, column, text, command, color in [
+            (0, 0, "📦 Bundle → Create .txt Archive", self.bundle_files, "#4caf50"),
+            (0, 1, "📥 Restore ← From .txt Archive", self.restore_files, "#ff9800"),
+            (1, 0, "🧩 Bundle Changes Since Archive", self.bundle_changes, "#8bc34a"),
+            (1, 1, "📋 View .txt Archive Contents", self.show_txt_file_list, "#03a9f4"),
+        ]:
+            button = tk.Button(actions_frame, text=text, command=command, bg=color,
+                               fg="white", **btn_config)
+            button.grid(row=row, column=column, padx=10, pady=8)
+            self.action_buttons.append(button)
+
+        # === Compression ===
+        compression_frame = tk.Frame(self.root)
+        compression_frame.pack()
+
+        tk.Label(compression_frame, text="Compression level (.gz / .bz2 / .xz archives):",
+                 font=("Segoe UI", 9)).pack(side="left")
+        self.compression_level = tk.IntVar(value=ArchiveManager.DEFAULT_COMPRESSION_LEVEL)
+        tk.Spinbox(compression_frame, from_=1, to=9, width=4, state="readonly",
+                   textvariable=self.compression_level).pack(side="left", padx=6)
+
+        tk.Label(compression_frame, text="Volume size in MB (0 = one file):",
+                 font=("Segoe UI", 9)).pack(side="left", padx=(12, 0))
+        self.volume_size = tk.IntVar(value=0)
+        tk.Spinbox(compression_frame, from_=0, to=1024 * 1024, increment=100, width=7,
+                   textvariable=self.volume_size).pack(side="left", padx=6)
 
-        tk.Button(actions_frame, text="📥 Restore ← From .txt Archive",
-                  command=self.restore_files, bg="#ff9800", fg="white", 
-                  **btn_config).grid(row=0, column=1, padx=10, pady=8)
+        # === Progress ===
+        progress_frame = tk.Frame(self.root)
+        progress_frame.pack(fill="x", padx=30, pady=(12, 0))
 
-        tk.Button(actions_frame, text="📋 View .txt Archive Contents",
-                  command=self.show_txt_file_list, bg="#03a9f4", fg="white", 
-                  **btn_config).grid(row=1, column=0, columnspan=2, pady=8)
+        self.progress_bar = ttk.Progressbar(progress_frame, mode="determinate")
+        self.progress_bar.pack(side="left", fill="x", expand=True)
+        self.cancel_button = tk.Button(progress_frame, text="Cancel", command=self.cancel_task,
+                                       width=10, bg="#f44336", fg="white", state="disabled")
+        self.cancel_button.pack(side="left", padx=(10, 0))
 
         # === Status Bar ===
         status_frame = tk.Frame(self.root, bg="#37474f")
@@ -420,31 +4449,74 @@ class ProjectBundlerApp:
         self.status_var.set(msg)
         self.root.update_idletasks()
 
+    def _start_task(self, message: str, work: Callable, on_done: Callable,
+                    on_finally: Optional[Callable] = None, files_total: int = 0):
+        """Run work(tracker) on a worker thread, then on_done(result) on the Tk thread
+
+        Action buttons are disabled while it runs; errors and cancellation
+        are reported in the status bar.
+        """
+        self._set_busy(True)
+        self.progress_bar.config(maximum=max(files_total, 1), value=0)
+        self.set_status(message)
+
+        def done(result):
+            self._set_busy(False)
+            try:
+                on_done(result)
+            finally:
+                if on_finally:
+                    on_finally()
+
+        def failed(error: BaseException):
+            self._set_busy(False)
+            try:
+                if isinstance(error, OperationCancelled):
+                    self.set_status("Cancelled", "#f57c00")
+                else:
+                    self.set_status(f"Error: {str(error)}", "darkred")
+                    messagebox.showerror("Error", str(error))
+            finally:
+                if on_finally:
+                    on_finally()
+
+        def instrumented(tracker: ProgressTracker):
+            # Metrics and profiling are only collected when the environment asks
+            with METRICS.session(message.rstrip(":")):
+                return work(tracker)
+
+        self.task = BackgroundTask(self.root, instrumented, done, failed,
+                                   lambda progress: self._show_progress(message, progress),
+                                   files_total)
+
+    def _set_busy(self, busy: bool):
+        """Enable or disable actions while a background task runs"""
+        for button in self.action_buttons:
+            button.config(state="disabled" if busy else "normal")
+        self.cancel_button.config(state="normal" if busy else "disabled")
+        if not busy:
+            self.task = None
+            self.progress_bar.config(value=0)
+
+    def _show_progress(self, message: str, progress: Progress):
+        """Update progress bar and status from a progress event"""
+        self.progress_bar.config(maximum=max(progress.files_total, 1), value=progress.files_done)
+        self.status_var.set(
+            f"{message} {progress.files_done}/{progress.files_total} files, "
+            f"{progress.bytes_done / 1e6:.1f} MB ({progress.throughput / 1e6:.1f} MB/s)")
+
+    def cancel_task(self):
+        """Ask the running background task to stop after the current file"""
+        if self.task is not None:
+            self.task.cancel()
+            self.status_var.set("Cancelling...")
+
     def bundle_files(self):
         """Bundle .py files into single .txt archive"""
         if not self.project_manager.project_dir.is_dir():
             messagebox.showwarning("Warning", "Please choose a valid project folder first.")
             return
 
-        py_files = self.project_manager.get_py_files()
-
-        if not py_files:
-            messagebox.showinfo("Info", "No .py files found in the selected folder.")
-            return
-
-        # Prepare file contents
-        files_content = {}
-        for file_path in py_files:
-            content = self.project_manager.read_file(file_path.name)
-            if content is not None:
-                files_content[file_path.name] = content
-
-        # Create archive
-        archive_content = ArchiveManager.create_archive(
-            self.project_manager.project_dir.name,
-            files_content
-        )
-
         # Ask for save location
         now = datetime.datetime.now()
         default_name = f"{self.project_manager.project_dir.name}_{now:%Y-%m-%d_%H-%M}.txt"
@@ -452,7 +4524,7 @@ class ProjectBundlerApp:
 
         out_path = filedialog.asksaveasfilename(
             defaultextension=".txt",
-            filetypes=[("Text file", "*.txt")],
+            filetypes=self.SAVE_FILETYPES,
             initialdir=default_dir,
             initialfile=default_name,
             title="Where to save the bundled file?"
@@ -461,13 +4533,84 @@ class ProjectBundlerApp:
         if not out_path:
             return
 
-        # Save archive
+        project_manager = self.project_manager
+        level = self.compression_level.get()
         try:
-            Path(out_path).write_text(archive_content, encoding="utf-8")
-            self.set_status(f"Saved: {Path(out_path).name}  ({len(py_files)} files)", "#006600")
-        except Exception as e:
-            self.set_status(f"Error: {str(e)}", "darkred")
-            messagebox.showerror("Error", str(e))
+            volume_size = max(self.volume_size.get(), 0) * 1024 * 1024
+        except tk.TclError:
+            volume_size = 0
+
+        def work(tracker: ProgressTracker):
+            # Scan and stream files into the archive off the Tk thread
+            py_files = project_manager.get_py_files()
+            if not py_files:
+                return None
+            tracker.files_total = len(py_files)
+            tracker.reset()
+            files = {project_manager.relative_name(path): path for path in py_files}
+            if volume_size:
+                return VolumeSet.write(Path(out_path), project_manager.project_dir.name, files,
+                                       volume_size, level=level, tracker=tracker)
+            return ArchiveManager.write_archive(
+                Path(out_path),
+                project_manager.project_dir.name,
+                files,
+                index=True,
+                level=level,
+                tracker=tracker
+            ), 1
+
+        def done(result: Optional[Tuple[int, int]]):
+            if result is None:
+                self.set_status("Nothing to bundle", "#f57c00")
+                messagebox.showinfo("Info", "No .py files found in the selected folder.")
+            else:
+                written, volumes = result
+                where = f" in {volumes} volumes" if volume_size else ""
+                self.set_status(f"Saved: {Path(out_path).name}  ({written} files{where})",
+                                "#006600")
+
+        self._start_task("Bundling:", work, done)
+
+    def bundle_changes(self):
+        """Bundle only files changed since a chosen baseline archive"""
+        if not self.project_manager.project_dir.is_dir():
+            messagebox.showwarning("Warning", "Please choose a valid project folder first.")
+            return
+
+        baseline = filedialog.askopenfilename(
+            filetypes=self.OPEN_FILETYPES,
+            initialdir=str(self.project_manager.project_dir),
+            title="Choose the baseline .txt archive"
+        )
+        if not baseline:
+            return
+
+        now = datetime.datetime.now()
+        default_name = f"{self.project_manager.project_dir.name}_{now:%Y-%m-%d_%H-%M}_delta.txt"
+        out_path = filedialog.asksaveasfilename(
+            defaultextension=".txt",
+            filetypes=self.SAVE_FILETYPES,
+            initialdir=str(Path(baseline).parent),
+            initialfile=default_name,
+            title="Where to save the changes?"
+        )
+        if not out_path:
+            return
+
+        project_manager = self.project_manager
+        level = self.compression_level.get()
+
+        def work(tracker: ProgressTracker) -> DeltaResult:
+            return DeltaManager.write_bundle(Path(out_path), project_manager, Path(baseline),
+                                             level=level, tracker=tracker)
+
+        def done(result: DeltaResult):
+            self.set_status(f"Saved: {Path(out_path).name}  ({len(result.changed)} changed, "
+                            f"{len(result.deleted)} deleted, {result.unchanged} unchanged)",
+                            "#006600")
+
+        self._start_task("Bundling changes:", work, done)
 
     def restore_files(self):
         """Restore files from .txt archive"""
@@ -477,7 +4620,7 @@ class ProjectBundlerApp:
 
         # Choose archive file
         in_path = filedialog.askopenfilename(
-            filetypes=[("Text file", "*.txt")],
+            filetypes=self.OPEN_FILETYPES,
             initialdir=str(self.project_manager.project_dir),
             title="Choose the bundled .txt file"
         )
@@ -485,81 +4628,113 @@ class ProjectBundlerApp:
         if not in_path:
             return
 
-        try:
-            # Read and parse archive
-            archive_content = Path(in_path).read_text(encoding="utf-8")
-            file_list, file_data = ArchiveManager.parse_archive(archive_content)
+        # Existence and size checks below answer from one fresh listing
+        self.project_manager.invalidate_snapshot()
 
-            if not file_list:
-                messagebox.showinfo("Info", "No valid .py files found in the text file.")
-                return
+        # Archives stay open from the scan until the writes are done
+        stack = ExitStack()
 
-            # Show file selection dialog
-            dialog = FileSelectionDialog(self.root, file_list, self.project_manager)
-            proceed, selected_files, auto_create = dialog.show()
+        def scan(tracker: ProgressTracker):
+            # Deltas pull in their baseline chain; bodies are decoded only when written
+            try:
+                return ArchiveManager.open_members(Path(in_path), stack)
+            except BaseException:
+                stack.close()
+                raise
 
-            if not proceed:
-                self.set_status("Restoration cancelled", "#f57c00")
-                return
+        def scanned(result: Tuple[List[str], ArchiveMembers]):
+            file_list, file_data = result
+            started = False
+            try:
+                started = self._restore_members(file_list, file_data, stack)
+            finally:
+                if not started:
+                    stack.close()
 
-            # Perform restoration
-            restored, created_new, skipped, errors = self._perform_restoration(
-                file_list, file_data, selected_files, auto_create
-            )
+        self._start_task("Reading archive...", scan, scanned)
 
-            # Show results
-            self._show_restoration_results(restored, created_new, skipped, errors)
+    def _search_archive(self, archive_path: Path, query: str, parent):
+        """Find lines containing query in an archive, through the catalog's index"""
+        if self.task is not None:
+            return
 
-        except Exception as e:
-            self.set_status(f"Error during restoration: {str(e)}", "darkred")
-            messagebox.showerror("Error", str(e))
+        def search(tracker: ProgressTracker) -> List[SearchHit]:
+            # Indexes the archive first if the catalog doesn't know it as it is now
+            with ArchiveCatalog() as catalog:
+                catalog.add_archive(archive_path)
+                return catalog.search(query, ignore_case=True, archive=archive_path,
+                                      limit=self.SEARCH_LIMIT)
+
+        def searched(hits: List[SearchHit]):
+            files = len({hit.filename for hit in hits})
+            self.set_status(f"{len(hits)} matching lines in {files} files", "#006064")
+            SearchResultsWindow(parent, query, hits, self.SEARCH_LIMIT)
+
+        self._start_task("Searching archive...", search, searched)
+
+    def _restore_members(self, file_list: List[str], file_data: ArchiveMembers,
+                         stack: ExitStack) -> bool:
+        """Run the restoration dialog, then start the writes in the background
+
+        Returns False if nothing was started, so the caller can close the archive.
+        """
+        if not file_list:
+            messagebox.showinfo("Info", "No valid .py files found in the text file.")
+            self.set_status("Nothing to restore", "#f57c00")
+            return False
+
+        # Show file selection dialog
+        dialog = FileSelectionDialog(self.root, file_list, self.project_manager, file_data)
+        proceed, selected_files, auto_create = dialog.show()
 
-    def _perform_restoration(self, file_list: List[str], file_data: Dict[str, str],
-                             selected_files: List[str], auto_create: bool) -> Tuple[int, int, int, int]:
-        """Perform file restoration"""
-        restored = created_new = skipped = errors = 0
+        if not proceed:
+            self.set_status("Restoration cancelled", "#f57c00")
+            return False
+
+        to_write, skipped = self._plan_restoration(file_list, file_data,
+                                                   selected_files, auto_create)
+        project_manager = self.project_manager
+
+        def work(tracker: ProgressTracker) -> RestoreStats:
+            return project_manager.restore_members(file_data, to_write, tracker)
+
+        def done(stats: RestoreStats):
+            self._show_restoration_results(stats.restored, stats.created_new, skipped,
+                                           stats.errors, stats.unchanged, stats.cancelled,
+                                           stats.corrupt, stats.missing)
+
+        self._start_task("Restoring:", work, done, on_finally=stack.close,
+                         files_total=len(to_write))
+        return True
+
+    def _plan_restoration(self, file_list: List[str], file_data: Mapping,
+                          selected_files: List[str],
+                          auto_create: bool) -> Tuple[List[str], int]:
+        """Decide which files to write, asking about new ones if requested
+
+        Runs on the Tk thread since it may show questions; returns the files
+        to write and the number skipped.
+        """
+        skipped = 0
 
         # Determine which files to process
         files_to_process = self._determine_files_to_process(file_list, selected_files, auto_create)
 
-        # Process each file
+        to_write = []
         for filename in files_to_process:
             if filename not in file_data:
                 continue
 
-            exists = self.project_manager.file_exists(filename)
-
-            if exists:
-                # Overwrite existing file
-                if self.project_manager.write_file(filename, file_data[filename]):
-                    restored += 1
-                else:
-                    errors += 1
-            else:
-                # New file - logic depends on selection
-                if selected_files:
-                    # Files are selected - restore them without asking
-                    if self.project_manager.write_file(filename, file_data[filename]):
-                        created_new += 1
-                    else:
-                        errors += 1
-                elif auto_create:
-                    # No selection, but auto_create checked - ask for each new file
-                    if messagebox.askyesno("New file", f"Create {filename}?"):
-                        if self.project_manager.write_file(filename, file_data[filename]):
-                            created_new += 1
-                        else:
-                            errors += 1
-                    else:
-                        skipped += 1
-                else:
-                    # No selection, no auto_create - create all new files without asking
-                    if self.project_manager.write_file(filename, file_data[filename]):
-                        created_new += 1
-                    else:
-                        errors += 1
+            if (not selected_files and auto_create
+                    and not self.project_manager.file_exists(filename)):
+                # No selection, but auto_create checked - ask for each new file
+                if not messagebox.askyesno("New file", f"Create {filename}?"):
+                    skipped += 1
+                    continue
+            # Existing files are overwritten, other new files created without asking
+            to_write.append(filename)
 
-        return restored, created_new, skipped, errors
+        return to_write, skipped
 
     def _determine_files_to_process(self, file_list: List[str],
                                     selected_files: List[str],
@@ -573,13 +4748,24 @@ class ProjectBundlerApp:
             return file_list
 
     def _show_restoration_results(self, restored: int, created_new: int,
-                                  skipped: int, errors: int):
+                                  skipped: int, errors: int, unchanged: int = 0,
+                                  cancelled: bool = False, corrupt: Sequence[str] = (),
+                                  missing: Sequence[str] = ()):
         """Show restoration results"""
-        msg_lines = ["Completed."]
+
+        def some(names: Sequence[str]) -> str:
+            return ", ".join(names[:5]) + (f" and {len(names) - 5} more" if len(names) > 5 else "")
+
+        msg_lines = ["Cancelled." if cancelled else "Completed."]
         if restored:   msg_lines.append(f"Overwritten existing: {restored}")
         if created_new: msg_lines.append(f"Created new: {created_new}")
+        if unchanged:  msg_lines.append(f"Unchanged (not rewritten): {unchanged}")
         if skipped:    msg_lines.append(f"Skipped non-existing: {skipped}")
         if errors:     msg_lines.append(f"Errors: {errors}")
+        if corrupt:
+            msg_lines.append("Failed checksum, not restored: " + some(corrupt))
+        if missing:
+            msg_lines.append("Missing from the object store, not restored: " + some(missing))
 
         msg = "\n".join(msg_lines) or "Nothing was changed."
         color = "#006600" if errors == 0 else "darkred"
@@ -588,7 +4774,7 @@ class ProjectBundlerApp:
     def show_txt_file_list(self):
         """Show file list from .txt archive"""
         in_path = filedialog.askopenfilename(
-            filetypes=[("Text file", "*.txt")],
+            filetypes=self.OPEN_FILETYPES,
             initialdir=str(self.project_manager.project_dir),
             title="Choose .txt file to view contents"
         )
@@ -596,32 +4782,484 @@ class ProjectBundlerApp:
         if not in_path:
             return
 
-        try:
-            # Read and parse archive
-            archive_content = Path(in_path).read_text(encoding="utf-8")
-            file_list, _ = ArchiveManager.parse_archive(archive_content)
+        self.project_manager.invalidate_snapshot()
+
+        def scan(tracker: ProgressTracker) -> List[str]:
+            # Scan archive (and any baselines) for file names only
+            with ExitStack() as stack:
+                file_list, _ = ArchiveManager.open_members(Path(in_path), stack)
+            return file_list
 
+        def scanned(file_list: List[str]):
             if not file_list:
+                self.set_status("Nothing to show", "#f57c00")
                 messagebox.showinfo("Info", "No valid .py files found in the text file.")
                 return
 
             # Show file list in window
             extra_text = f"\n\nTotal: {len(file_list)} files\n\nFile: {Path(in_path).name}"
-            FileListWindow(
+            window = FileListWindow(
                 self.root,
                 "Files in txt Archive",
                 file_list,
                 self.project_manager,
-                extra_text
+                extra_text,
+                on_search=lambda query: self._search_archive(Path(in_path), query,
+                                                             window.window)
             )
 
             self.set_status(f"Viewed list from: {Path(in_path).name}", "#006064")
 
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to process txt file:\n{str(e)}")
+        self._start_task("Reading archive...", scan, scanned)
+
+
+class CommandLine:
+    """Headless command-line interface; never imports tkinter"""
+
+    @staticmethod
+    def build_parser() -> argparse.ArgumentParser:
+        """Create the argument parser with its subcommands"""
+        parser = argparse.ArgumentParser(
+            prog="project_bundler.py",
+            description="Bundle and restore Python project files via text archives. "
+                        "Run without a command to open the GUI.")
+        parser.add_argument("--metrics", metavar="FILE",
+                            help="write per-phase timings as JSON to FILE ('-' for stdout); "
+                                 f"also ${Metrics.ENV_REPORT}")
+        parser.add_argument("--profile", metavar="FILE",
+                            help=f"save cProfile stats to FILE; also ${Metrics.ENV_PROFILE}")
+        parser.add_argument("--trace-memory", action="store_true",
+                            help="record peak memory with tracemalloc in the metrics; "
+                                 f"also ${Metrics.ENV_TRACEMALLOC}=1")
+        commands = parser.add_subparsers(dest="command", metavar="command")
+
+        bundle = commands.add_parser("bundle", help="bundle a project into an archive")
+        bundle.add_argument("project", type=Path, help="project folder")
+        bundle.add_argument("-o", "--output", type=Path,
+                            help="archive path (.txt, .txt.gz, .txt.bz2 or .txt.xz); "
+                                 "default: <project>/<name>_<date>.txt")
+        bundle.add_argument("--baseline", type=Path,
+                            help="only bundle changes since this archive")
+        bundle.add_argument("--append", action="store_true",
+                            help="add changes since the last update to the end of the "
+                                 "output archive instead of rewriting it")
+        bundle.add_argument("--level", type=int, default=ArchiveManager.DEFAULT_COMPRESSION_LEVEL,
+                            help="compression level 1-9 for compressed outputs")
+        bundle.add_argument("--include", action="append", metavar="GLOB",
+                            help="file glob to include (repeatable, default: *.py)")
+        bundle.add_argument("--exclude", action="append", metavar="GLOB", default=[],
+                            help="path glob to exclude (repeatable)")
+        bundle.add_argument("--no-index", action="store_true",
+                            help="don't append the table-of-contents trailer")
+        bundle.add_argument("--format", type=int, choices=(1, 2), default=ArchiveWriter.VERSION,
+                            help="archive format; 1 is readable by older versions "
+                                 "(default %(default)s)")
+        bundle.add_argument("--store", type=Path, metavar="DIR",
+                            help="keep file contents in this shared object store and write "
+                                 "only references into the archive")
+        bundle.add_argument("--volume-size", type=CommandLine.parse_size, metavar="SIZE",
+                            help="split the archive into volumes of about this size "
+                                 "(e.g. 500M or 2G), listed by a small index at the output path")
+        bundle.set_defaults(handler=CommandLine.cmd_bundle)
+
+        watch = commands.add_parser("watch", help="keep a rolling archive current as files change")
+        watch.add_argument("project", type=Path, help="project folder")
+        watch.add_argument("-o", "--output", type=Path, required=True,
+                           help="archive path; earlier states are kept as numbered deltas")
+        watch.add_argument("--debounce", type=float, default=ProjectWatcher.DEBOUNCE,
+                           help="seconds without changes before bundling (default %(default)s)")
+        watch.add_argument("--max-deltas", type=int, default=ProjectWatcher.MAX_DELTAS,
+                           help="deltas kept before starting a fresh full bundle "
+                                "(default %(default)s)")
+        watch.add_argument("--append", action="store_true",
+                           help="append each round to the archive instead of keeping deltas")
+        watch.add_argument("--level", type=int, default=ArchiveManager.DEFAULT_COMPRESSION_LEVEL,
+                           help="compression level 1-9 for compressed outputs")
+        watch.add_argument("--include", action="append", metavar="GLOB",
+                           help="file glob to include (repeatable, default: *.py)")
+        watch.add_argument("--exclude", action="append", metavar="GLOB", default=[],
+                           help="path glob to exclude (repeatable)")
+        watch.set_defaults(handler=CommandLine.cmd_watch)
+
+        batch = commands.add_parser("batch", help="bundle many projects in parallel")
+        batch.add_argument("projects", nargs="*", type=Path, help="project folders")
+        batch.add_argument("--parent", type=Path, action="append", default=[],
+                           help="bundle every subfolder of this folder (repeatable)")
+        batch.add_argument("-o", "--output-dir", type=Path, required=True,
+                           help="folder for the archives, one per project")
+        batch.add_argument("-j", "--workers", type=int,
+                           help="worker processes (default: number of CPUs)")
+        batch.add_argument("--suffix", default=".txt",
+                           help="archive suffix, e.g. .txt.gz to compress (default .txt)")
+        batch.add_argument("--level", type=int, default=ArchiveManager.DEFAULT_COMPRESSION_LEVEL,
+                           help="compression level 1-9 for compressed outputs")
+        batch.add_argument("--include", action="append", metavar="GLOB",
+                           help="file glob to include (repeatable, default: *.py)")
+        batch.add_argument("--exclude", action="append", metavar="GLOB", default=[],
+                           help="path glob to exclude (repeatable)")
+        batch.add_argument("--no-index", action="store_true",
+                           help="don't append the table-of-contents trailer")
+        batch.add_argument("--summary", type=Path,
+                           help="write the run summary as JSON to this file")
+        batch.set_defaults(handler=CommandLine.cmd_batch)
+
+        restore = commands.add_parser("restore", help="restore files from an archive")
+        restore.add_argument("archive", type=Path)
+        restore.add_argument("files", nargs="*", help="files to restore (default: all)")
+        restore.add_argument("-C", "--target", type=Path, default=Path.cwd(),
+                             help="project folder to restore into (default: current folder)")
+        restore.add_argument("--existing-only", action="store_true",
+                             help="only overwrite files that already exist")
+        restore.add_argument("-j", "--workers", type=int,
+                             help="worker processes for multi-volume archives "
+                                  "(default: one per CPU)")
+        restore.add_argument("--stages", action="store_true",
+                             help="print the throughput of each restore stage")
+        restore.set_defaults(handler=CommandLine.cmd_restore)
+
+        diff = commands.add_parser("diff", help="show what an archive would change")
+        diff.add_argument("old", type=Path, help="project folder or archive to compare against")
+        diff.add_argument("archive", type=Path)
+        diff.add_argument("-u", "--unified", action="store_true",
+                          help="print unified diffs, not just file names")
+        diff.add_argument("--all", action="store_true", help="list identical files too")
+        diff.set_defaults(handler=CommandLine.cmd_diff)
+
+        listing = commands.add_parser("list", help="list files in an archive")
+        listing.add_argument("archive", type=Path)
+        listing.set_defaults(handler=CommandLine.cmd_list)
+
+        verify = commands.add_parser("verify",
+                                     help="check every file in an archive against its checksum")
+        verify.add_argument("archive", type=Path)
+        verify.add_argument("-j", "--workers", type=int, default=ProjectManager.READ_WORKERS,
+                            help="hashing threads, or processes for multi-volume archives "
+                                 "(default %(default)s)")
+        verify.set_defaults(handler=CommandLine.cmd_verify)
+
+        compact = commands.add_parser("compact",
+                                      help="rewrite an archive without superseded or deleted files")
+        compact.add_argument("archive", type=Path)
+        compact.add_argument("-o", "--output", type=Path,
+                             help="write the compacted archive here (default: in place)")
+        compact.add_argument("--level", type=int,
+                             default=ArchiveManager.DEFAULT_COMPRESSION_LEVEL,
+                             help="compression level 1-9 for compressed outputs")
+        compact.set_defaults(handler=CommandLine.cmd_compact)
+
+        catalog = commands.add_parser("catalog", help="find files across many archives")
+        catalog.add_argument("--db", type=Path,
+                             help=f"catalog database (default ${ArchiveCatalog.ENV_PATH} "
+                                  f"or ~/{ArchiveCatalog.DEFAULT_NAME})")
+        actions = catalog.add_subparsers(dest="action", metavar="action", required=True)
+        scan = actions.add_parser("scan", help="add or refresh the archives under folders")
+        scan.add_argument("folders", nargs="+", type=Path)
+        versions = actions.add_parser("versions", help="every archived copy of a file")
+        versions.add_argument("filename", help="member path, or a bare name to match any folder")
+        contains = actions.add_parser("contains", help="archives holding some exact content")
+        source = contains.add_mutually_exclusive_group(required=True)
+        source.add_argument("sha256", nargs="?", help="content hash or a prefix of it")
+        source.add_argument("--file", type=Path, help="hash this file and look it up")
+        latest = actions.add_parser("latest", help="newest archive of a project")
+        latest.add_argument("project", help="project name as stored in the archive header")
+        search = actions.add_parser("search", help="lines of archived files containing text")
+        search.add_argument("text", help="text to find, at least 3 characters")
+        search.add_argument("-i", "--ignore-case", action="store_true")
+        search.add_argument("--archive", type=Path, help="only search this archive")
+        search.add_argument("--limit", type=int, help="stop after this many lines")
+        catalog.set_defaults(handler=CommandLine.cmd_catalog)
+
+        return parser
+
+    @staticmethod
+    def parse_size(text: str) -> int:
+        """Bytes in a size such as 750000, 64K, 500M or 2G"""
+        match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kmg]?)b?\s*", text.lower())
+        if not match or float(match.group(1)) <= 0:
+            raise argparse.ArgumentTypeError(f"not a size: {text!r}")
+        return int(float(match.group(1)) * 1024 ** " kmg".index(match.group(2) or " "))
+
+    @staticmethod
+    def cmd_bundle(args) -> int:
+        """Bundle a project folder"""
+        project_manager = ProjectManager(args.project.resolve(),
+                                         include=args.include or ProjectManager.DEFAULT_INCLUDE,
+                                         exclude=args.exclude)
+        if not project_manager.project_dir.is_dir():
+            print(f"Error: not a folder: {args.project}", file=sys.stderr)
+            return 1
+
+        out_path = args.output
+        if out_path is None:
+            now = datetime.datetime.now()
+            out_path = project_manager.project_dir / (
+                f"{project_manager.project_dir.name}_{now:%Y-%m-%d_%H-%M}.txt")
+
+        if args.append and args.baseline:
+            print("Error: --append and --baseline can't be combined", file=sys.stderr)
+            return 1
+        if args.store and (args.append or args.baseline):
+            print("Error: --store can't be combined with --append or --baseline",
+                  file=sys.stderr)
+            return 1
+        if args.volume_size and (args.append or args.baseline or args.store or args.format == 1):
+            print("Error: --volume-size can't be combined with --append, --baseline, --store "
+                  "or --format 1", file=sys.stderr)
+            return 1
+        if args.append and out_path.exists():
+            result = DeltaManager.append_bundle(out_path, project_manager, level=args.level)
+            print(f"Updated: {out_path}  ({len(result.changed)} changed, "
+                  f"{len(result.deleted)} deleted, {result.unchanged} unchanged)")
+            return 0
+        if args.baseline or args.append:
+            # A first --append bundle also gets the manifest later appends rely on
+            result = DeltaManager.write_bundle(out_path, project_manager, args.baseline,
+                                               level=args.level)
+            print(f"Saved: {out_path}  ({len(result.changed)} changed, "
+                  f"{len(result.deleted)} deleted, {result.unchanged} unchanged)")
+            return 0
+
+        files = project_manager.get_py_files()
+        if not files:
+            print("No matching files found in the project folder.", file=sys.stderr)
+            return 1
+        if args.volume_size:
+            written, volumes = VolumeSet.write(
+                out_path, project_manager.project_dir.name,
+                {project_manager.relative_name(path): path for path in files},
+                args.volume_size, level=args.level)
+            print(f"Saved: {out_path}  ({written} files in {volumes} volumes)")
+            return 0 if written == len(files) else 1
+
+        store = ObjectStore(args.store.resolve()) if args.store else None
+        written = ArchiveManager.write_archive(
+            out_path, project_manager.project_dir.name,
+            {project_manager.relative_name(path): path for path in files},
+            index=not args.no_index, level=args.level, version=args.format, store=store)
+        print(f"Saved: {out_path}  ({written} files)")
+        if store is not None:
+            print(f"Store: {store.root}  ({store.objects_written} new objects, "
+                  f"{store.bytes_written / 1e6:.1f} MB)")
+        return 0 if written == len(files) else 1
+
+    @staticmethod
+    def cmd_watch(args) -> int:
+        """Re-bundle a project whenever it changes, until interrupted"""
+        project_manager = ProjectManager(args.project.resolve(),
+                                         include=args.include or ProjectManager.DEFAULT_INCLUDE,
+                                         exclude=args.exclude)
+        if not project_manager.project_dir.is_dir():
+            print(f"Error: not a folder: {args.project}", file=sys.stderr)
+            return 1
+
+        def report(result: DeltaResult):
+            print(f"{datetime.datetime.now():%H:%M:%S}  Saved: {args.output}  "
+                  f"({len(result.changed)} changed, {len(result.deleted)} deleted, "
+                  f"{result.unchanged} unchanged)", flush=True)
+
+        watcher = ProjectWatcher(project_manager, args.output, level=args.level,
+                                 debounce=args.debounce, max_deltas=args.max_deltas,
+                                 on_round=report, append=args.append)
+        print(f"Watching {project_manager.project_dir} (Ctrl+C to stop)", flush=True)
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    @staticmethod
+    def cmd_batch(args) -> int:
+        """Bundle several projects concurrently and summarize the run"""
+        projects = [project.resolve() for project in args.projects]
+        for parent in args.parent:
+            projects.extend(BatchBundler.find_projects(parent.resolve()))
+        projects = list(dict.fromkeys(projects))
+        if not projects:
+            print("Error: no projects given", file=sys.stderr)
+            return 1
+
+        started = time.perf_counter()
+        results = []
+        for result in BatchBundler.bundle_all(
+                projects, args.output_dir, args.workers, args.suffix,
+                include=tuple(args.include or ProjectManager.DEFAULT_INCLUDE),
+                exclude=tuple(args.exclude), index=not args.no_index, level=args.level):
+            results.append(result)
+            status = f"FAILED: {result.error}" if result.error else f"{result.files} files"
+            print(f"{result.project}: {status}  ({result.seconds:.2f}s)", flush=True)
+
+        summary = BatchBundler.summarize(results, time.perf_counter() - started)
+        print(f"{summary['succeeded']} of {summary['projects']} projects bundled, "
+              f"{summary['files']} files in {summary['wall_seconds']:.1f}s")
+        if args.summary:
+            args.summary.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+        return 1 if summary["failed"] else 0
+
+    @staticmethod
+    def cmd_restore(args) -> int:
+        """Restore files from an archive into a folder"""
+        project_manager = ProjectManager(args.target.resolve())
+        volumes = VolumeSet.volume_paths(args.archive)
+        with ExitStack() as stack:
+            if volumes:
+                # Only the index is read here; the volumes are opened by the workers
+                file_list = [entry.filename for entry in VolumeSet.entries(args.archive)]
+                members = set(file_list)
+            else:
+                file_list, members = ArchiveManager.open_members(args.archive, stack)
+            missing = [name for name in args.files if name not in members]
+            for name in missing:
+                print(f"Not in archive: {name}", file=sys.stderr)
+
+            filenames = [name for name in (args.files or file_list) if name in members]
+            if args.existing_only:
+                filenames = [name for name in filenames if project_manager.file_exists(name)]
+            if volumes:
+                stats = VolumeSet.restore(args.archive, project_manager.project_dir, filenames,
+                                          args.workers)
+            else:
+                stats = project_manager.restore_members(members, filenames)
+
+        for name in stats.corrupt:
+            print(f"Corrupt, not restored: {name}", file=sys.stderr)
+        for name in stats.missing:
+            print(f"Object missing from the store, not restored: {name}", file=sys.stderr)
+        print(f"Overwritten existing: {stats.restored}\n"
+              f"Created new: {stats.created_new}\n"
+              f"Unchanged (not rewritten): {stats.unchanged}\n"
+              f"Errors: {stats.errors}")
+        if args.stages:
+            for stage in stats.stages:
+                print(f"  {stage.name:<6} {stage.files:>7} files  {stage.bytes / 1e6:>9.1f} MB  "
+                      f"{stage.busy:>7.2f}s busy  {stage.waited:>7.2f}s waiting  "
+                      f"{stage.throughput / 1e6:>8.1f} MB/s")
+        return 1 if stats.errors or missing else 0
+
+    @staticmethod
+    def cmd_diff(args) -> int:
+        """Compare an archive with a folder or another archive; 1 if they differ"""
+        with ExitStack() as stack:
+            _, members = ArchiveManager.open_members(args.archive, stack)
+            if args.old.is_dir():
+                result = DiffManager.compare_directory(members, ProjectManager(args.old.resolve()))
+            else:
+                _, old_members = ArchiveManager.open_members(args.old, stack)
+                result = DiffManager.compare_archives(old_members, members,
+                                                      (args.old.name, args.archive.name))
+
+            marks = {"added": "A", "removed": "D", "modified": "M", "identical": "="}
+            for filename in sorted(result.added + result.removed + result.modified
+                                   + (result.identical if args.all else [])):
+                status = result.status(filename)
+                print(f"{marks[status]} {filename}")
+                if args.unified and status != "identical":
+                    for line in result.unified_diff(filename):
+                        print(line, end="" if line.endswith("\n") else "\n")
+
+        print(f"{len(result.added)} added, {len(result.removed)} removed, "
+              f"{len(result.modified)} modified, {len(result.identical)} identical",
+              file=sys.stderr)
+        return 1 if result.added or result.removed or result.modified else 0
+
+    @staticmethod
+    def cmd_list(args) -> int:
+        """Print the files stored in an archive"""
+        if VolumeSet.volume_paths(args.archive):
+            file_list = sorted(entry.filename for entry in VolumeSet.entries(args.archive))
+        else:
+            with ExitStack() as stack:
+                file_list, _ = ArchiveManager.open_members(args.archive, stack)
+        for filename in file_list:
+            print(filename)
+        return 0
+
+    @staticmethod
+    def cmd_verify(args) -> int:
+        """Check every record of an archive against its hash without writing anything"""
+        result = ArchiveManager.verify_archive(args.archive, args.workers)
+        for failure in result.failures:
+            print(f"FAILED {failure}")
+        print(f"{result.checked} OK, {len(result.failures)} failed"
+              + (f", {result.unverified} without a checksum" if result.unverified else ""))
+        return 1 if result.failures else 0
+
+    @staticmethod
+    def cmd_compact(args) -> int:
+        """Drop superseded records and tombstones from an archive"""
+        out_path = args.output or args.archive
+        before = args.archive.stat().st_size
+        kept = ArchiveManager.compact_archive(args.archive, args.output, level=args.level)
+        after = out_path.stat().st_size
+        print(f"Saved: {out_path}  ({kept} files, {before:,} -> {after:,} bytes)")
+        return 0
+
+    @staticmethod
+    def cmd_catalog(args) -> int:
+        """Update or query the archive catalog"""
+        with ArchiveCatalog(args.db) as catalog:
+            if args.action == "scan":
+                result = catalog.scan(args.folders)
+                for error in result.errors:
+                    print(f"FAILED {error}", file=sys.stderr)
+                print(f"{result.added} added, {result.updated} updated, {result.removed} removed, "
+                      f"{result.unchanged} unchanged")
+                return 1 if result.errors else 0
+
+            if args.action == "search":
+                if args.archive:
+                    catalog.add_archive(args.archive)
+                lines = catalog.search(args.text, args.ignore_case, args.archive, args.limit)
+                for hit in lines:
+                    print(f"{hit.archive}  {hit.filename}:{hit.line}: {hit.text.strip()}")
+                return 0 if lines else 1
+
+            if args.action == "latest":
+                archive = catalog.latest(args.project)
+                if archive is None:
+                    print(f"No archives of {args.project}", file=sys.stderr)
+                    return 1
+                print(f"{archive.date}  {archive.path}  ({archive.files} files)")
+                return 0
+
+            if args.action == "versions":
+                hits = catalog.versions(args.filename)
+            else:
+                sha256 = args.sha256
+                if args.file:
+                    sha256 = DiffManager.file_digest(args.file)
+                    if sha256 is None:
+                        print(f"Error: can't read {args.file}", file=sys.stderr)
+                        return 1
+                hits = catalog.containing(sha256)
+            for hit in hits:
+                print(f"{hit.date}  {hit.sha256[:12]}  {hit.length:>9}  "
+                      f"{hit.archive}  {hit.filename}")
+            return 0 if hits else 1
+
+    @staticmethod
+    def run(argv: Optional[Sequence[str]] = None) -> int:
+        """Run a subcommand, or the GUI when none is given"""
+        parser = CommandLine.build_parser()
+        args, extra = parser.parse_known_args(argv)
+        if extra and args.command == "restore" and not any(a.startswith("-") for a in extra):
+            # Files may also follow the options, as in "restore ARCHIVE -C DIR a.py"
+            args.files.extend(extra)
+        elif extra:
+            parser.error(f"unrecognized arguments: {' '.join(extra)}")
+        if args.command is None:
+            _load_tk()
+            root = tk.Tk()
+            ProjectBundlerApp(root)
+            root.mainloop()
+            return 0
+
+        try:
+            with METRICS.session(args.command, args.metrics, args.profile, args.trace_memory):
+                return args.handler(args)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
 
 
 if __name__ == "__main__":
-    root = tk.Tk()
-    app = ProjectBundlerApp(root)
-    root.mainloop()
+    sys.exit(CommandLine.run())